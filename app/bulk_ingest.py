@@ -0,0 +1,214 @@
+"""
+Bulk-ingest a directory (or a manifest) of PDFs into a collection.
+
+    python -m app.bulk_ingest <directory> --collection <name>
+    python -m app.bulk_ingest --manifest files.jsonl --collection <name>
+
+With a directory, the topic of a PDF is its first-level folder
+(`<directory>/<topic>/.../file.pdf`); PDFs directly in the directory get
+`--default-topic`. A manifest has one JSON object per line,
+`{"path": "...", "topic": "..."}`, with paths relative to the manifest.
+
+Finished documents are appended to a checkpoint file, so an interrupted run
+started again with the same arguments skips them; a document interrupted
+half-way only re-embeds the chunks that did not reach Qdrant (chunk ids are
+content-addressed).
+
+A collection created by the run uses the `--profile` settings (`bulk-ingest`:
+no HNSW graph, indexing disabled) and is migrated to `--serving-profile`
+(`balanced` unless given) once every document is in.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Iterator, List, Set, Tuple
+
+from app.src.process import IngestStats, ingest_pdf, answer_cache
+from app.src.qdrant import (
+    PROFILES,
+    apply_profile,
+    create_async_qdrant_client,
+    create_qdrant_client,
+    get_profile,
+    init_collection,
+    is_embedded_client,
+)
+from app.src.utils import run_in_thread, setEnvronVariable, shutdown_executors
+
+Document = Tuple[str, str]  # (path, topic)
+
+
+def _sanitize_topic(topic: str) -> str:
+    # Same rule as the upload endpoint
+    return topic.replace("/", "_").replace("\\", "_")
+
+
+def iter_directory(root: str, default_topic: str) -> Iterator[Document]:
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        relative = os.path.relpath(directory, root)
+        topic = default_topic if relative == "." else relative.split(os.sep)[0]
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(directory, name), _sanitize_topic(topic)
+
+
+def iter_manifest(path: str) -> Iterator[Document]:
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "path" not in entry or "topic" not in entry:
+                raise ValueError(f"{path}:{line_number}: expected \"path\" and \"topic\"")
+            yield os.path.join(base, entry["path"]), _sanitize_topic(entry["topic"])
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines file of finished documents, keyed by path, size and mtime
+    (a file changed since it was ingested is ingested again).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._done.add(json.loads(line)["key"])
+                    except (ValueError, KeyError):
+                        pass  # Line cut off by an interruption
+        self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def key(path: str) -> str:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    def __contains__(self, path: str) -> bool:
+        return self.key(path) in self._done
+
+    def add(self, path: str, topic: str, stored: int, skipped: int):
+        key = self.key(path)
+        self._done.add(key)
+        self._file.write(json.dumps({"key": key, "path": path, "topic": topic, "stored": stored, "skipped": skipped},
+                                    ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _report(stats: IngestStats, elapsed: float, failed: int) -> str:
+    chunks = stats.chunks_stored + stats.chunks_skipped
+    return (
+        f"{stats.documents} documents ({failed} failed), {stats.chunks_stored} chunks stored, "
+        f"{stats.chunks_skipped} skipped in {elapsed:.1f}s | "
+        f"{stats.documents / max(elapsed, 1e-9):.2f} docs/s, {chunks / max(elapsed, 1e-9):.1f} chunks/s | "
+        f"stage time: extract {stats.extract_seconds:.1f}s, embed {stats.embed_seconds:.1f}s, "
+        f"upsert {stats.upsert_seconds:.1f}s"
+    )
+
+
+async def bulk_ingest(documents: List[Document], collection_name: str, checkpoint: Checkpoint,
+                      concurrency: int) -> Tuple[IngestStats, int]:
+    """
+    Ingest documents with up to `concurrency` of them in flight; their page
+    extraction shares the process pool and their encodes the embedding model.
+    """
+    client = create_qdrant_client()
+    async_client = create_async_qdrant_client()
+    if async_client is None and is_embedded_client(client):
+        concurrency = 1  # Embedded Qdrant cannot be written from several documents at once
+    stats = IngestStats()
+    failed = 0
+    pending = [(path, topic) for path, topic in documents if path not in checkpoint]
+    print(f"{len(documents)} documents, {len(documents) - len(pending)} already done, {len(pending)} to ingest")
+    queue: asyncio.Queue = asyncio.Queue()
+    for document in pending:
+        queue.put_nowait(document)
+    started = time.perf_counter()
+
+    async def worker():
+        nonlocal failed
+        while not queue.empty():
+            path, topic = queue.get_nowait()
+            document_started = time.perf_counter()
+            try:
+                stored, skipped = await ingest_pdf(path, client, collection_name, topic,
+                                                   async_client=async_client, stats=stats)
+            except Exception as e:
+                failed += 1
+                print(f"Error ingesting {path}: {e}")
+                continue
+            checkpoint.add(path, topic, stored, skipped)
+            print(f"[{stats.documents}/{len(pending)}] {path} ({topic}): {stored} stored, {skipped} skipped "
+                  f"in {time.perf_counter() - document_started:.1f}s")
+            if stats.documents % 100 == 0:
+                print(_report(stats, time.perf_counter() - started, failed))
+
+    try:
+        await run_in_thread(init_collection, client, collection_name)
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        if stats.chunks_stored:
+            # Running API workers miss on their own: the collection version changed
+            await run_in_thread(answer_cache.invalidate, collection_name)
+    finally:
+        if async_client is not None:
+            await async_client.close()
+        client.close()
+    print(_report(stats, time.perf_counter() - started, failed))
+    return stats, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?", help="Directory of PDFs, one sub-folder per topic")
+    parser.add_argument("--manifest", help="JSON lines file of {\"path\", \"topic\"} entries")
+    parser.add_argument("--collection", required=True, help="Target collection")
+    parser.add_argument("--default-topic", default="general", help="Topic of PDFs directly in the directory")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: .bulk_ingest_<collection>.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Documents ingested at the same time")
+    parser.add_argument("--workers", type=int, help="Extraction processes (WORKER_PROCESSES)")
+    parser.add_argument("--embed-batch-size", type=int, default=256, help="Chunks per encode (INGEST_EMBED_BATCH_SIZE)")
+    parser.add_argument("--profile", choices=list(PROFILES), default="bulk-ingest",
+                        help="Profile of the collection if it is created by this run")
+    # The bulk-ingest profile has no HNSW graph: serving from it would scan every vector
+    parser.add_argument("--serving-profile", choices=list(PROFILES), default="balanced",
+                        help="Profile the collection is migrated to once every document is ingested (default: balanced)")
+    args = parser.parse_args()
+    if bool(args.directory) == bool(args.manifest):
+        parser.error("give either a directory or --manifest")
+
+    # Settings read by the ingestion pipeline and the process pool
+    setEnvronVariable("COLLECTION_PROFILE", args.profile)
+    setEnvronVariable("INGEST_EMBED_BATCH_SIZE", str(args.embed_batch_size))
+    if args.workers:
+        setEnvronVariable("WORKER_PROCESSES", str(args.workers))
+
+    documents = list(iter_manifest(args.manifest) if args.manifest else iter_directory(args.directory, args.default_topic))
+    checkpoint = Checkpoint(args.checkpoint or f".bulk_ingest_{args.collection}.jsonl")
+    try:
+        _, failed = asyncio.run(bulk_ingest(documents, args.collection, checkpoint, args.concurrency))
+    finally:
+        checkpoint.close()
+        shutdown_executors()
+
+    if args.serving_profile:
+        if failed:
+            print(f"Not migrating to {args.serving_profile}: {failed} documents failed, run again to retry them")
+        else:
+            apply_profile(create_qdrant_client(), args.collection, get_profile(args.serving_profile))
+            print(f"Collection {args.collection} migrated to profile {args.serving_profile}.")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
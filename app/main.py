@@ -1,24 +1,61 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from app.src.api import create_response, handle_upload_file, handle_chat
-from qdrant_client import QdrantClient
-from app.src.utils import getEnvVariable, setEnvronVariable
-from typing import Optional
+from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from app.src.api import create_response, handle_upload_file, handle_chat, handle_chat_stream, handle_chat_batch, MetricsMiddleware, render_metrics, handle_profiler
+from app.src.qdrant import create_qdrant_client, create_async_qdrant_client
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from app.src.utils import getEnvVariable, setEnvronVariable, shutdown_executors
+from app.src.process import get_embedding_service, get_reranker, rerank_enabled, answer_cache, session_memory
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import logging
+import uuid
 
 # Set environment variables for API keys and tokenizer parallelism
 setEnvronVariable("OPENAI_API_KEY", getEnvVariable("OPENAI_API_KEY"))
 setEnvronVariable("TOKENIZERS_PARALLELISM", "false")
+# LOG_LEVEL applies to the application's loggers (request diagnostics are logged at DEBUG);
+# libraries such as httpx stay at WARNING
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("app").setLevel(getEnvVariable("LOG_LEVEL", "INFO").upper())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the shared Qdrant clients and load the embedding model (and the
+    reranker when enabled) once at startup; release them on shutdown.
+    """
+    app.state.qdrant_client = create_qdrant_client()
+    app.state.async_qdrant_client = create_async_qdrant_client()
+    service = get_embedding_service()
+    service.load()
+    if rerank_enabled():
+        get_reranker().load()
+    yield
+    service.close()
+    shutdown_executors()
+    app.state.qdrant_client.close()
+    if app.state.async_qdrant_client is not None:
+        await app.state.async_qdrant_client.close()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
-def init_qdrant_client():
+def get_qdrant_client(request: Request) -> QdrantClient:
     """
-    Initialize the Qdrant client with the specified host and port.
+    Return the shared Qdrant client created in the lifespan.
     """
-    return QdrantClient("localhost", port=6333)
-    
+    return request.app.state.qdrant_client
+
+def get_async_qdrant_client(request: Request) -> Optional[AsyncQdrantClient]:
+    """
+    Return the shared async Qdrant client created in the lifespan.
+    """
+    return request.app.state.async_qdrant_client
+
 @app.post("/upload")
-async def upload_pdf(file: UploadFile = File(...), topic: str = Form(...), collection_name: str = Form(...)):
+async def upload_pdf(request: Request, file: UploadFile = File(...), topic: str = Form(...), collection_name: str = Form(...)):
     """
     Endpoint to upload a PDF file and process it into vectors for retrieval.
     """
@@ -32,21 +69,29 @@ async def upload_pdf(file: UploadFile = File(...), topic: str = Form(...), colle
     if not file.filename.endswith('.pdf'):
         return create_response(status_code=400, detail="Only PDF files are allowed")
     # Handle file upload and processing
-    status, message, data = await handle_upload_file(file, init_qdrant_client(), topic, collection_name)
+    status, message, data = await handle_upload_file(file, get_qdrant_client(request), topic, collection_name, async_client=get_async_qdrant_client(request))
     return create_response(status, message, data)
 
 @app.post("/chat")
 async def chat(
+    request: Request,
     question: str = Form(...), 
     collection_name: str = Form(...), 
     type: str = Form(...), 
     is_topic: Optional[str] = Form("false"), 
     memory: Optional[str] = Form("false"), 
     type_iterative: Optional[str] = Form("standard"),
-    model_name: Optional[str] = Form(None)
+    model_name: Optional[str] = Form(None),
+    stream: Optional[str] = Form("false"),
+    session_id: Optional[str] = Form(None),
+    timings: Optional[str] = Form("false")
 ):
     """
     Endpoint to chat with the RAG system using a user query.
+    With stream=true the answer is streamed as server-sent events (the "done" event carries the per-stage timings);
+    otherwise timings=true adds the per-stage timings to the response.
+    With memory=true the conversation is kept under `session_id` (a new one is
+    returned when it is not provided); older turns are summarized after the response.
     """
     # Validate required parameters
     if not question:
@@ -57,15 +102,106 @@ async def chat(
         return create_response(status_code=400, message="type parameter is required")
     if not question.strip():
         return create_response(status_code=400, message="question cannot be empty")
+    is_memory = memory == "true"
+    if is_memory and not session_id:
+        session_id = uuid.uuid4().hex
+    # Fold turns that left the history window into the summary once the response is sent
+    compact = BackgroundTask(session_memory.compact, session_id) if is_memory else None
+    if stream == "true":
+        status, message, events = await handle_chat_stream(
+            question=question,
+            client=get_qdrant_client(request),
+            collection_name=collection_name,
+            type=type,
+            is_topic=is_topic=="true",
+            type_iterative=type_iterative,
+            is_memmory=is_memory,
+            model_name=model_name,
+            async_client=get_async_qdrant_client(request),
+            session_id=session_id
+        )
+        if status != 200:
+            return create_response(status, message)
+        # Disable proxy buffering so tokens reach the client immediately
+        return StreamingResponse(events, media_type="text/event-stream", background=compact,
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     # Handle chat logic and return response
     status, message, data = await handle_chat(
         question=question, 
-        client=init_qdrant_client(), 
+        client=get_qdrant_client(request), 
         collection_name=collection_name, 
         type=type,
         is_topic=is_topic=="true",
         type_iterative=type_iterative,
-        is_memmory=memory=="true",
-        model_name=model_name
+        is_memmory=is_memory,
+        model_name=model_name,
+        async_client=get_async_qdrant_client(request),
+        session_id=session_id,
+        timings=timings == "true"
     )
-    return create_response(status, message, data)
\ No newline at end of file
+    response = create_response(status, message, data)
+    response.background = compact
+    return response
+
+@app.post("/chat/batch")
+async def chat_batch(
+    request: Request,
+    questions: List[str] = Form(...),
+    collection_name: str = Form(...),
+    type: str = Form(...),
+    is_topic: Optional[str] = Form("false"),
+    type_iterative: Optional[str] = Form("standard"),
+    model_name: Optional[str] = Form(None),
+    concurrency: Optional[int] = Form(None)
+):
+    """
+    Endpoint to answer many questions (repeated `questions` fields) on one collection.
+    Answers are streamed as server-sent events in completion order: one "result" or "error"
+    event per question (with its index), then "done" with the counts and per-stage timings.
+    """
+    if not collection_name:
+        return create_response(status_code=400, message="collection_name parameter is required")
+    if not type:
+        return create_response(status_code=400, message="type parameter is required")
+    status, message, events = await handle_chat_batch(
+        questions=questions,
+        client=get_qdrant_client(request),
+        collection_name=collection_name,
+        type=type,
+        is_topic=is_topic=="true",
+        type_iterative=type_iterative,
+        model_name=model_name,
+        async_client=get_async_qdrant_client(request),
+        concurrency=concurrency
+    )
+    if status != 200:
+        return create_response(status, message)
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters of the semantic answer cache (used to tune ANSWER_CACHE_THRESHOLD).
+    """
+    return create_response(200, "Answer cache statistics", answer_cache.stats())
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, token, chunk and cache counters, LLM backend load.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# The profiler route is unauthenticated and can run the sampler in production: only register it on request
+if getEnvVariable("PROFILER_ENABLED", "false") == "true":
+    @app.post("/debug/profiler")
+    async def debug_profiler(action: str = Form(...), interval_ms: Optional[float] = Form(None)):
+        """
+        Switch the sampling profiler on (action=start, optional interval_ms) or off (action=stop,
+        returns the collapsed stacks for flamegraph.pl or speedscope), or get its status (action=status).
+        """
+        status, message, data = handle_profiler(action, interval_ms)
+        if action == "stop" and status == 200:
+            return PlainTextResponse(data)
+        return create_response(status, message, data)
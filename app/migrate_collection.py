@@ -0,0 +1,21 @@
+"""
+Migrate an existing Qdrant collection to a collection profile.
+
+    python -m app.migrate_collection <collection_name> <profile>
+"""
+import argparse
+
+from app.src.qdrant import PROFILES, apply_profile, create_qdrant_client, get_profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a Qdrant collection to a collection profile.")
+    parser.add_argument("collection_name")
+    parser.add_argument("profile", choices=list(PROFILES))
+    args = parser.parse_args()
+    apply_profile(create_qdrant_client(), args.collection_name, get_profile(args.profile))
+    print(f"Collection {args.collection_name} migrated to profile {args.profile}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 from .response import create_response
 from .upload_file import handle_upload_file
-from .chat import handle_chat
\ No newline at end of file
+from .chat import handle_chat, handle_chat_stream, handle_chat_batch
+from .metrics import MetricsMiddleware, render_metrics, handle_profiler
@@ -1,7 +1,29 @@
-from app.src.rag.standard_rag import run_retriever as standard_retriever, run as standard_rag_run
-from app.src.rag.hybrid_rag import run_retriever as hybrid_retriever, run as hybrid_rag_run
-from app.src.rag.iterative_rag import run as iterative_rag_run
-from typing import Optional
+from app.src.rag.standard_rag import run_retriever as standard_retriever, run as standard_rag_run, stream as standard_rag_stream
+from app.src.rag.hybrid_rag import run_retriever as hybrid_retriever, run as hybrid_rag_run, stream as hybrid_rag_stream
+from app.src.rag.iterative_rag import run as iterative_rag_run, stream as iterative_rag_stream
+from app.src.rag.batch_rag import stream as batch_rag_stream
+from app.src.utils import SingleFlight, getEnvVariable, run_in_thread
+from app.src.process import LLMOverloadedError, llm_registry
+from langchain.schema import Document
+from qdrant_client import AsyncQdrantClient
+from typing import AsyncIterator, List, Optional, Tuple
+import functools
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+chat_flights = SingleFlight("chat")
+chat_stream_flights = SingleFlight("chat_stream")
+
+def _coalescing_enabled() -> bool:
+    return getEnvVariable("CHAT_COALESCING_ENABLED", "true") == "true"
+
+def _flight_key(question: str, type: str, collection_name: str, is_topic: bool, type_iterative: str,
+                model_name: Optional[str]) -> tuple:
+    # Requests that differ only in case or whitespace get the same answer
+    return (" ".join(question.lower().split()), collection_name, type,
+            type_iterative if type == "iterative" else "", is_topic, model_name or "")
 
 async def handle_chat(question: str, 
                       type: str, 
@@ -10,29 +32,176 @@ async def handle_chat(question: str,
                       is_topic: bool, 
                       type_iterative: str,
                       is_memmory: bool,
-                      model_name: Optional[str] = None):
+                      model_name: Optional[str] = None,
+                      async_client: Optional[AsyncQdrantClient] = None,
+                      session_id: Optional[str] = None,
+                      timings: bool = False):
     """
-    Chat with the RAG system using a query
+    Chat with the RAG system using a query.
+    With `timings`, the result includes the per-stage breakdown of the request.
+    Single-turn chats identical to one in flight (see `_flight_key`) wait for
+    its result instead of running again; they are marked `coalesced`.
     """
-    print(f"Handling chat with question: {question}, type: {type}, collection_name: {collection_name}, is_topic: {is_topic}, type_iterative: {type_iterative}, is_memmory: {is_memmory}, model_name: {model_name}")
+    logger.debug("Handling chat: type=%s collection=%s is_topic=%s type_iterative=%s memory=%s model=%s session=%s",
+                 type, collection_name, is_topic, type_iterative, is_memmory, model_name, session_id)
+    compute = functools.partial(_run_chat, question, type, client, collection_name, is_topic, type_iterative,
+                                is_memmory, model_name, async_client, session_id)
     try:
-        if type == "standard":
-            result = standard_rag_run(question, client, collection_name, is_topic, is_memmory, model_name=model_name)
-        elif type == "hybrid":
-            result = hybrid_rag_run(question, client, collection_name, is_topic, is_memmory, model_name=model_name)
-        elif type == "iterative":
-            if type_iterative not in ["standard", "hybrid"]:
-                return 400, "Invalid type_iterative parameter. Use 'standard' or 'hybrid'.", None
-            if type_iterative == "standard":
-                retriever = standard_retriever(question, client, collection_name, is_topic)
-            else:
-                retriever = hybrid_retriever(question, client, collection_name, is_topic)
-            if not retriever:
-                return 400, "No retriever provided", None
-            result = iterative_rag_run(question, client, retriever, collection_name, is_topic)
+        if is_memmory or not _coalescing_enabled():
+            (status, message, result), coalesced = await compute(), False
+        else:
+            key = _flight_key(question, type, collection_name, is_topic, type_iterative, model_name)
+            (status, message, result), coalesced = await chat_flights.do(key, compute)
+        if status != 200:
+            return status, message, result
+        # Copied: coalesced requests share the result
+        result = {**result, "coalesced": coalesced}
+        if not timings:
+            result.pop("timings", None)
+        return status, message, result
+    except LLMOverloadedError as e:
+        return 429, str(e), None
+    except Exception as e:
+        logger.exception("Error in handle_chat: %s", e)
+        return 500, str(e), None
+
+async def _run_chat(question: str, type: str, client: any, collection_name: str, is_topic: bool, type_iterative: str,
+                    is_memmory: bool, model_name: Optional[str], async_client: Optional[AsyncQdrantClient],
+                    session_id: Optional[str]):
+    if type == "standard":
+        result = await standard_rag_run(question, client, collection_name, is_topic, is_memmory, model_name=model_name, async_client=async_client, session_id=session_id)
+    elif type == "hybrid":
+        result = await hybrid_rag_run(question, client, collection_name, is_topic, is_memmory, model_name=model_name, async_client=async_client, session_id=session_id)
+    elif type == "iterative":
+        if type_iterative not in ["standard", "hybrid"]:
+            return 400, "Invalid type_iterative parameter. Use 'standard' or 'hybrid'.", None
+        if type_iterative == "standard":
+            retriever = await run_in_thread(standard_retriever, question, client, collection_name, is_topic, async_client)
         else:
-            return 400, "Invalid type parameter. Use 'standard' or 'hybrid'.", None
-        return 200, "Get answer successfully", result
+            retriever = await run_in_thread(hybrid_retriever, question, client, collection_name, is_topic, async_client)
+        if not retriever:
+            return 400, "No retriever provided", None
+        result = await iterative_rag_run(question, client, retriever, collection_name, is_topic)
+    else:
+        return 400, "Invalid type parameter. Use 'standard' or 'hybrid'.", None
+    return 200, "Get answer successfully", result
+
+def _to_sse(event: str, data: dict) -> str:
+    """
+    Format one server-sent event; retrieved documents are sent as text + metadata.
+    """
+    if "documents" in data:
+        data = {**data, "documents": [_document_payload(doc) for doc in data["documents"]]}
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def _document_payload(doc: Document) -> dict:
+    return {"text": doc.page_content, "metadata": {k: v for k, v in doc.metadata.items() if k != "text"}}
+
+async def _sse_stream(events: AsyncIterator[Tuple[str, dict]]) -> AsyncIterator[str]:
+    try:
+        async for event, data in events:
+            yield _to_sse(event, data)
+    except LLMOverloadedError as e:
+        yield _to_sse("error", {"message": str(e), "status": 429})
     except Exception as e:
-        print(f"Error in handle_chat: {e}")
-        return 500, str(e), None
\ No newline at end of file
+        logger.exception("Error in handle_chat_stream: %s", e)
+        yield _to_sse("error", {"message": str(e), "status": 500})
+
+async def handle_chat_stream(question: str,
+                             type: str,
+                             client: any,
+                             collection_name: str,
+                             is_topic: bool,
+                             type_iterative: str,
+                             is_memmory: bool,
+                             model_name: Optional[str] = None,
+                             async_client: Optional[AsyncQdrantClient] = None,
+                             session_id: Optional[str] = None):
+    """
+    Chat with the RAG system and stream the answer as server-sent events:
+    "retrieval" (topic and documents), "token" (answer tokens), then "done" (per-stage timings),
+    or "error" if the chat fails after the stream started.
+    A single-turn chat identical to a stream in flight subscribes to it: it
+    receives the events sent so far, then the rest as they are produced.
+
+    Returns:
+        tuple: (status code, message, async iterator of SSE strings or None)
+    """
+    logger.debug("Handling streaming chat: type=%s collection=%s is_topic=%s type_iterative=%s memory=%s model=%s session=%s",
+                 type, collection_name, is_topic, type_iterative, is_memmory, model_name, session_id)
+    if type not in ["standard", "hybrid", "iterative"]:
+        return 400, "Invalid type parameter. Use 'standard' or 'hybrid'.", None
+    if type == "iterative" and type_iterative not in ["standard", "hybrid"]:
+        return 400, "Invalid type_iterative parameter. Use 'standard' or 'hybrid'.", None
+    try:
+        # Reject before the stream starts when the backend queue is already full
+        llm_registry.limiter(None if type == "iterative" else model_name).check()
+        events = functools.partial(_chat_events, question, type, client, collection_name, is_topic, type_iterative,
+                                   is_memmory, model_name, async_client, session_id)
+        if is_memmory or not _coalescing_enabled():
+            return 200, "Streaming answer", _sse_stream(events())
+        key = _flight_key(question, type, collection_name, is_topic, type_iterative, model_name)
+        return 200, "Streaming answer", _sse_stream(chat_stream_flights.stream(key, events))
+    except LLMOverloadedError as e:
+        return 429, str(e), None
+    except Exception as e:
+        logger.exception("Error in handle_chat_stream: %s", e)
+        return 500, str(e), None
+
+async def _chat_events(question: str, type: str, client: any, collection_name: str, is_topic: bool, type_iterative: str,
+                       is_memmory: bool, model_name: Optional[str], async_client: Optional[AsyncQdrantClient],
+                       session_id: Optional[str]) -> AsyncIterator[Tuple[str, dict]]:
+    if type == "standard":
+        events = standard_rag_stream(question, client, collection_name, is_topic, is_memmory, model_name=model_name, async_client=async_client, session_id=session_id)
+    elif type == "hybrid":
+        events = hybrid_rag_stream(question, client, collection_name, is_topic, is_memmory, model_name=model_name, async_client=async_client, session_id=session_id)
+    else:
+        if type_iterative == "standard":
+            retriever = await run_in_thread(standard_retriever, question, client, collection_name, is_topic, async_client)
+        else:
+            retriever = await run_in_thread(hybrid_retriever, question, client, collection_name, is_topic, async_client)
+        if not retriever:
+            yield "error", {"message": "No retriever provided", "status": 400}
+            return
+        events = iterative_rag_stream(question, client, retriever, collection_name, is_topic)
+    async for event in events:
+        yield event
+
+async def handle_chat_batch(questions: List[str],
+                            type: str,
+                            client: any,
+                            collection_name: str,
+                            is_topic: bool,
+                            type_iterative: str,
+                            model_name: Optional[str] = None,
+                            async_client: Optional[AsyncQdrantClient] = None,
+                            concurrency: Optional[int] = None):
+    """
+    Answer many single-turn questions on one collection and stream the answers as
+    server-sent events: one "result" (or "error") per question as soon as it is
+    answered, then "done" (counts and per-stage timings of the batch).
+    At most BATCH_MAX_QUESTIONS questions are accepted, and BATCH_CONCURRENCY LLM calls run at once by default.
+
+    Returns:
+        tuple: (status code, message, async iterator of SSE strings or None)
+    """
+    logger.debug("Handling batch chat: questions=%d type=%s collection=%s is_topic=%s type_iterative=%s model=%s",
+                 len(questions), type, collection_name, is_topic, type_iterative, model_name)
+    if not questions or any(not question.strip() for question in questions):
+        return 400, "questions cannot be empty", None
+    max_questions = int(getEnvVariable("BATCH_MAX_QUESTIONS", "256"))
+    if len(questions) > max_questions:
+        return 400, f"Too many questions: at most {max_questions} per batch", None
+    if type not in ["standard", "hybrid", "iterative"]:
+        return 400, "Invalid type parameter. Use 'standard', 'hybrid' or 'iterative'.", None
+    if type == "iterative" and type_iterative not in ["standard", "hybrid"]:
+        return 400, "Invalid type_iterative parameter. Use 'standard' or 'hybrid'.", None
+    try:
+        # Reject before the stream starts when the backend queue is already full
+        llm_registry.limiter(None if type == "iterative" else model_name).check()
+    except LLMOverloadedError as e:
+        return 429, str(e), None
+    events = batch_rag_stream(questions, client, collection_name, type, is_topic, type_iterative=type_iterative,
+                              model_name=model_name, async_client=async_client,
+                              concurrency=concurrency or int(getEnvVariable("BATCH_CONCURRENCY", "8")))
+    return 200, "Streaming answers", _sse_stream(events)
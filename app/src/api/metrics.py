@@ -0,0 +1,103 @@
+from app.src.api.chat import chat_flights, chat_stream_flights
+from app.src.process import answer_cache, embedding_cache, llm_registry
+from app.src.utils import metrics, profiler
+from typing import Optional
+import time
+
+http_requests = metrics.counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+http_request_seconds = metrics.histogram(
+    "http_request_seconds", "Time until the response starts (whole answer unless streamed)", ["method", "route"])
+
+
+def _cache_families():
+    answer = answer_cache.stats()
+    chunks = embedding_cache.stats()
+    yield ("answer_cache_lookups_total", "counter", "Semantic answer cache lookups",
+           [({"result": "hit"}, answer["hits"]), ({"result": "miss"}, answer["misses"])])
+    yield ("answer_cache_disk_hits_total", "counter", "Answer cache hits served from disk", [({}, answer["disk_hits"])])
+    yield ("answer_cache_entries", "gauge", "Answers held in memory", [({}, answer["entries"])])
+    yield ("embedding_cache_lookups_total", "counter", "Chunk embedding cache lookups",
+           [({"result": "hit"}, chunks["hits"]), ({"result": "miss"}, chunks["misses"])])
+
+
+def _llm_families():
+    stats = llm_registry.stats()
+    yield ("llm_active_calls", "gauge", "LLM calls running per backend",
+           [({"backend": backend}, values["active"]) for backend, values in stats.items()])
+    yield ("llm_queued_calls", "gauge", "LLM calls waiting for a slot per backend",
+           [({"backend": backend}, values["queued"]) for backend, values in stats.items()])
+    yield ("llm_rejected_calls_total", "counter", "LLM calls rejected by admission control per backend",
+           [({"backend": backend}, values["rejected"]) for backend, values in stats.items()])
+
+
+def _flight_families():
+    yield ("single_flight_in_flight", "gauge", "Distinct chat computations running that identical requests can join",
+           [({"flight": flights.name}, flights.in_flight()) for flights in (chat_flights, chat_stream_flights)])
+
+
+metrics.collector(_cache_families)
+metrics.collector(_llm_families)
+metrics.collector(_flight_families)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them until the response starts.
+    Requests are labelled with their route template, not the raw path, to keep the label set small.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status: int):
+            nonlocal recorded
+            recorded = True
+            # The router stores the matched route in the shared scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(method=scope["method"], route=route, status=status)
+            http_request_seconds.observe(time.perf_counter() - started, method=scope["method"], route=route)
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            if not recorded:
+                record(500)
+
+
+def render_metrics() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    return metrics.render()
+
+
+def handle_profiler(action: str, interval_ms: Optional[float] = None):
+    """
+    Start or stop the sampling profiler, or report its status.
+
+    Returns:
+        tuple: (status code, message, data); stopping returns the collapsed stacks as text.
+    """
+    if action == "start":
+        interval = (interval_ms or 10.0) / 1000
+        if not profiler.start(interval):
+            return 409, "Profiler is already running", profiler.stats()
+        return 200, "Profiler started", profiler.stats()
+    if action == "stop":
+        if not profiler.running:
+            return 409, "Profiler is not running", None
+        return 200, "Profiler stopped", profiler.stop()
+    if action == "status":
+        return 200, "Profiler status", profiler.stats()
+    return 400, "Invalid action. Use 'start', 'stop' or 'status'.", None
@@ -1,31 +1,36 @@
 from fastapi import UploadFile
-from app.src.utils import extract_pdf_text
-from app.src.qdrant import qbrant_service as qbrant
-from app.src.process import preparing_data
-from qdrant_client import QdrantClient
+from app.src.utils import getEnvVariable, run_in_thread
+from app.src.process import ingest_pdf, answer_cache
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from typing import Optional
 import aiofiles
+import logging
 import tempfile
 import os
 
-async def handle_upload_file(file: UploadFile, client: QdrantClient, topic: str, collection_name: str):
+logger = logging.getLogger(__name__)
+
+async def handle_upload_file(file: UploadFile, client: QdrantClient, topic: str, collection_name: str,
+                             async_client: Optional[AsyncQdrantClient] = None):
     # Sanitize context to prevent path traversal
     topic = topic.replace("/", "_").replace("\\", "_")
     # Create a temporary file
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            # Save uploaded content to temporary file
+            # Save uploaded content to temporary file, one bounded chunk at a time
+            chunk_size = int(getEnvVariable("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
             async with aiofiles.open(temp_file.name, 'wb') as out_file:
-                content = await file.read()
-                await out_file.write(content)
+                while content := await file.read(chunk_size):
+                    await out_file.write(content)
             
-            # Extract text and process to vectors
-            extracted_text = extract_pdf_text(temp_file.name)
-            if not extracted_text.strip():
+            # Stream pages -> chunks -> embeddings -> Qdrant
+            stored, skipped = await ingest_pdf(temp_file.name, client, collection_name, topic, async_client=async_client)
+            logger.info("Extracted %d chunks from PDF (%d already stored).", stored + skipped, skipped)
+            if not stored and not skipped:
                 return 400, "No text could be extracted from the PDF", None
-            qbrant.init_collection(client=client, collection_name=collection_name)
-            ids, vectors, chunks = preparing_data(extracted_text)
-            print(f"Extracted {len(chunks)} chunks from PDF.")
-            qbrant.add_text(client, collection_name, ids, vectors, chunks, topic=topic)
+            if stored:
+                # Cached answers no longer reflect the collection
+                await run_in_thread(answer_cache.invalidate, collection_name)
     
     except Exception as e:
             return 500, f"Error processing PDF: {str(e)}", None
@@ -39,5 +44,7 @@ async def handle_upload_file(file: UploadFile, client: QdrantClient, topic: str,
         "filename": file.filename,
         "topic": topic,
         "collection_name": collection_name,
+        "chunks_stored": stored,
+        "chunks_skipped": skipped,
         "message": "PDF processed and vectors saved successfully"
     }
\ No newline at end of file
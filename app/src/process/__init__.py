@@ -1,3 +1,25 @@
-from .process_data import preparing_data, detect_topic
-from .chains import generate_answer, generate_followup_question_if_needed, generate_answer_from_docs
-from .model import get_model
\ No newline at end of file
+from .process_data import preparing_data, detect_topic, IncrementalChunker, content_hash, chunk_id, embed_chunks
+from .chains import (
+    generate_answer,
+    generate_followup_question_if_needed,
+    generate_answer_from_docs,
+    agenerate_answer,
+    agenerate_answer_with_docs,
+    agenerate_followup_question_if_needed,
+    agenerate_answer_from_docs,
+    astream_answer,
+    astream_answer_from_docs,
+    agenerate_answer_with_followup,
+    astream_answer_with_followup
+)
+from .model import get_model
+from .embedding_service import EmbeddingService, get_embedding_service
+from .embedding_cache import EmbeddingCache, embedding_cache
+from .embedding_backends import EMBEDDING_BACKENDS, load_embedding_model
+from .reranker import Reranker, get_reranker, rerank_enabled, rerank_settings
+from .context_packing import pack_context, context_budget
+from .topic_embeddings import TopicEmbeddingCache, topic_embeddings
+from .ingestion import ingest_pdf, IngestStats
+from .answer_cache import AnswerCache, answer_cache, model_key
+from .session_memory import SessionMemory, SessionState, InMemorySessionStore, SQLiteSessionStore, session_memory
+from .llm_registry import LLMRegistry, BackendLimiter, LLMOverloadedError, llm_registry
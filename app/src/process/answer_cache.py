@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from app.src.utils import getEnvVariable
+from .embedding_service import get_embedding_service
+
+# (collection, collection version, topic, mode, model)
+Scope = Tuple[str, int, Optional[str], str, str]
+
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers.
+
+    Entries are scoped by (collection, version, topic, mode, model) and matched by the
+    cosine similarity of the question embedding (the same "passage: " embedding
+    the retrievers compute, so it comes from the embedding cache). A lookup hits
+    when the most similar cached question of the scope is at or above
+    `threshold`. The memory tier is an LRU of at most `max_entries` entries that
+    expire after `ttl` seconds; with `path` set, entries are also written to a
+    SQLite file and survive restarts, which is bounded the same way. The version of the collection (see
+    `collection_version`) is part of the scope, so answers given before
+    documents were added miss, even when another process or worker added
+    them; `invalidate` also drops them right away in this process.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024, ttl: float = 3600.0,
+                 path: Optional[str] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # id -> (scope, normalized question vector, answer, created)
+        self._entries: "OrderedDict[int, Tuple[Scope, np.ndarray, str, float]]" = OrderedDict()
+        # scope -> ids, kept to compare only against the entries of the scope
+        self._scopes: Dict[Scope, Dict[int, None]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path and enabled:
+            self._open_db(path)
+
+    def get(self, collection_name: str, topic: Optional[str], mode: str, model: str, question: str,
+            version: int = 0) -> Optional[str]:
+        """
+        Return the cached answer of a similar question in the same scope, or None.
+        """
+        if not self.enabled:
+            return None
+        scope = (collection_name, version, topic, mode, model)
+        vector = self._embed(question)
+        with self._lock:
+            answer = self._match_memory(scope, vector)
+            if answer is not None:
+                self.hits += 1
+                return answer
+        answer = self._match_disk(scope, vector)
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._insert(scope, vector, answer, time.time())
+        return answer
+
+    def put(self, collection_name: str, topic: Optional[str], mode: str, model: str, question: str, answer: str,
+            version: int = 0):
+        """
+        Cache the answer to a question, given with the collection at `version`.
+        """
+        if not self.enabled:
+            return
+        scope = (collection_name, version, topic, mode, model)
+        vector = self._embed(question)
+        created = time.time()
+        with self._lock:
+            self._insert(scope, vector, answer, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO answers (collection, scope, vector, answer, created, used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (collection_name, json.dumps(scope), vector.tobytes(), answer, created, created),
+                )
+                # Evict the least recently used rows beyond `max_entries`
+                self._db.execute(
+                    "DELETE FROM answers WHERE rowid IN "
+                    "(SELECT rowid FROM answers ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def invalidate(self, collection_name: str):
+        """
+        Drop every cached answer of the collection (its documents changed).
+        """
+        with self._lock:
+            for scope in [scope for scope in self._scopes if scope[0] == collection_name]:
+                for entry_id in self._scopes.pop(scope):
+                    self._entries.pop(entry_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers WHERE collection = ?", (collection_name,))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+            }
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(get_embedding_service().encode([f"passage: {question}"])[0], dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _match_memory(self, scope: Scope, vector: np.ndarray) -> Optional[str]:
+        ids = list(self._scopes.get(scope, ()))
+        if not ids:
+            return None
+        expired = [entry_id for entry_id in ids if time.time() - self._entries[entry_id][3] >= self.ttl]
+        for entry_id in expired:
+            self._remove(entry_id)
+        ids = [entry_id for entry_id in ids if entry_id in self._entries]
+        if not ids:
+            return None
+        scores = np.stack([self._entries[entry_id][1] for entry_id in ids]) @ vector
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        self._entries.move_to_end(ids[best])
+        return self._entries[ids[best]][2]
+
+    def _match_disk(self, scope: Scope, vector: np.ndarray) -> Optional[str]:
+        if self._db is None:
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT rowid, vector, answer FROM answers WHERE scope = ? AND created > ?",
+                (json.dumps(scope), time.time() - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+        scores = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) @ vector
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        with self._lock:
+            self._db.execute("UPDATE answers SET used = ? WHERE rowid = ?", (time.time(), rows[best][0]))
+            self._db.commit()
+        return rows[best][2]
+
+    def _insert(self, scope: Scope, vector: np.ndarray, answer: str, created: float):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (scope, vector, answer, created)
+        self._scopes.setdefault(scope, {})[entry_id] = None
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._scopes.get(scope)
+        if ids is not None:
+            ids.pop(entry_id, None)
+            if not ids:
+                del self._scopes[scope]
+
+    def _open_db(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers "
+            "(collection TEXT, scope TEXT, vector BLOB, answer TEXT, created REAL, used REAL)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(answers)")]
+        if "used" not in columns:
+            # Files written before the disk tier was bounded
+            self._db.execute("ALTER TABLE answers ADD COLUMN used REAL")
+            self._db.execute("UPDATE answers SET used = created")
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers (used)")
+        self._db.execute("DELETE FROM answers WHERE created <= ?", (time.time() - self.ttl,))
+        self._db.commit()
+
+
+def model_key(model_name: Optional[str] = None) -> str:
+    """
+    Cache scope name of the model `generate_answer` uses for `model_name`.
+    """
+    return f"ollama:{model_name}" if model_name else f"openai:{getEnvVariable('OPENAI_MODEL')}"
+
+
+answer_cache = AnswerCache(
+    threshold=float(getEnvVariable("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(getEnvVariable("ANSWER_CACHE_SIZE", "1024")),
+    ttl=float(getEnvVariable("ANSWER_CACHE_TTL", "3600")),
+    path=getEnvVariable("ANSWER_CACHE_PATH"),
+    # Off by default: e5 question embeddings are all close to each other, so the
+    # threshold has to be tuned on real traffic (GET /cache/stats) before enabling it
+    enabled=getEnvVariable("ANSWER_CACHE_ENABLED", "false") == "true",
+)
@@ -1,29 +1,19 @@
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langchain.chains import RetrievalQA
-from langchain_core.runnables import RunnableMap
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_core.messages import get_buffer_string
-from langchain.memory import ConversationBufferMemory
-from langchain.memory import ConversationSummaryMemory
-from app.src.utils import getEnvVariable
-from typing import List, Optional
+from langchain.memory.prompt import SUMMARY_PROMPT
+from typing import AsyncIterator, List, Optional, Tuple
 from langchain.schema import Document
+from app.src.utils import span
+from .context_packing import context_budget, pack_context
+from .llm_registry import llm_registry
 
-def generate_answer(retriever, question, is_memory: bool, model_name: Optional[str]=None) -> str:
-    """
-    Generate an answer to the question using the provided retriever and a language model.
-    """
-    if is_memory:
-        # Prompt template including chat history for conversational memory
-        prompt_template = """
+# Prompt template including chat history for conversational memory
+ANSWER_WITH_HISTORY_PROMPT = PromptTemplate.from_template("""
         You are an assistant answering questions based on the provided context. Use the context to provide a concise and accurate answer to the question.
-        
+
         Chat History:
         {chat_history}
-        
+
         Context:
         {context}
 
@@ -31,10 +21,10 @@ def generate_answer(retriever, question, is_memory: bool, model_name: Optional[s
         {question}
 
         Answer:
-        """
-    else:
-        # Prompt template for single-turn QA (no memory)
-        prompt_template = """
+        """)
+
+# Prompt template for single-turn QA (no memory)
+ANSWER_PROMPT = PromptTemplate.from_template("""
         You are an assistant answering questions based on the provided context. Use the context to provide a concise and accurate answer to the question.
 
         Context:
@@ -44,59 +34,157 @@ def generate_answer(retriever, question, is_memory: bool, model_name: Optional[s
         {question}
 
         Answer:
-        """
-        
-    # Create a prompt template with the provided template
-    prompt = PromptTemplate.from_template(prompt_template)
-    
-    print("Using model:", model_name if model_name else "default OpenAI model")
-
-    # Define the LLM (Language Model) using environment variable for model name
-    if model_name:
-        llm = ChatOllama(
-            model=model_name,
-            base_url="https://ai-api.bravesoft.vn:8080", )
-    else:
-        llm = ChatOpenAI(model=getEnvVariable("OPENAI_MODEL"))
-        
-    # If memory is enabled, use ConversationSummaryMemory to summarize chat history
-    # Otherwise, create a RetrievalQA chain for single-turn QA
+        """)
+
+# Prompt template for answering based on provided context
+DOCS_ANSWER_PROMPT = PromptTemplate.from_template("""
+    You are an assistant answering questions based on the provided context.
+    Use only the context to answer the question as accurately and concisely as possible.
+
+    Context:
+    {context}
+
+    Question:
+    {question}
+
+    Answer:
+    """)
+
+# Prompt template for generating a follow-up question if needed
+FOLLOWUP_PROMPT = PromptTemplate.from_template("""
+    Given the original question and the current answer, decide whether a follow-up question is needed
+    to clarify or improve the answer.
+
+    If the answer is sufficient, respond with only "None".
+    Otherwise, generate a follow-up question that helps improve or complete the answer.
+
+    Original Question: {question}
+    Current Answer: {answer}
+
+    Follow-up Question:
+    """)
+
+FOLLOWUP_MARKER = "Follow-up question:"
+
+# Prompt template answering and deciding on a follow-up in a single call (iterative RAG)
+ANSWER_WITH_FOLLOWUP_PROMPT = PromptTemplate.from_template("""
+    You are an assistant answering questions based on the provided context.
+    Use only the context to answer the question as accurately and concisely as possible.
+
+    Then decide whether the context was sufficient. On a final separate line write
+    "Follow-up question:" followed by either a follow-up question that would retrieve
+    the missing information, or "None" if the answer is complete.
+
+    Context:
+    {context}
+
+    Question:
+    {question}
+
+    Answer:
+    """)
+
+
+def _format_docs(docs: List[Document]) -> str:
+    # Same context layout as the "stuff" chain of RetrievalQA
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def _pack(docs: List[Document], model_name: Optional[str] = None, max_tokens: Optional[int] = None) -> List[Document]:
+    """
+    Merge, deduplicate and budget the retrieved documents (see `pack_context`)
+    with the tokenizer of the model answering.
+    """
+    with span("context_packing"):
+        budget = context_budget() if max_tokens is None else max_tokens
+        return pack_context(docs, budget, llm_registry.tokenizer(model_name))
+
+
+def _answer_chain(is_memory: bool, model_name: Optional[str] = None):
+    # prompt -> llm -> text, compiled once per model (OpenAI by default, Ollama when model_name is set)
+    prompt = ANSWER_WITH_HISTORY_PROMPT if is_memory else ANSWER_PROMPT
+    name = "answer_with_history" if is_memory else "answer"
+    return llm_registry.chain(name, model_name, lambda llm: prompt | llm | StrOutputParser())
+
+
+def _answer_input(question: str, docs: List[Document], is_memory: bool, chat_history: str,
+                  model_name: Optional[str] = None) -> dict:
+    chain_input = {"context": _format_docs(_pack(docs, model_name)), "question": question}
     if is_memory:
-        # === memory for context ===
-        memory = ConversationSummaryMemory(
-            llm=llm,
-            return_messages=True
-        )
-        # === Define the chain using RunnableMap ===
-        chain = (
-            RunnableMap({
-                "context": lambda x: retriever.invoke(x["question"]),
-                "question": lambda x: x["question"],
-                "chat_history": lambda x: get_buffer_string(memory.chat_memory.messages)
-            })
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
-
-        # === Manually update memory ===
-        memory.chat_memory.add_user_message(question)
-        response = chain.invoke({"question": question})
-        memory.chat_memory.add_ai_message(response)
-        return response  # Return the generated answer
-    else:
-        # Create the RetrievalQA chain with the prompt for single-turn QA
-        rag_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=retriever,
-            chain_type="stuff",
-            chain_type_kwargs={"prompt": prompt}
-        )
-
-        # Invoke the chain with the user's query
-        response = rag_chain.invoke({"query": question})
-        # Return the generated answer (expects a dict with "result" key)
-        return response["result"]
+        chain_input["chat_history"] = chat_history
+    return chain_input
+
+
+def generate_answer(retriever, question, is_memory: bool, model_name: Optional[str]=None, chat_history: str = "") -> str:
+    """
+    Generate an answer to the question using the provided retriever and a language model.
+    With `is_memory`, `chat_history` (see `SessionMemory.history`) is included in the prompt.
+    """
+    docs = retriever.invoke(question)
+    return _answer_chain(is_memory, model_name).invoke(_answer_input(question, docs, is_memory, chat_history, model_name))
+
+
+async def agenerate_answer(retriever, question, is_memory: bool, model_name: Optional[str]=None, chat_history: str = "") -> str:
+    """
+    Async variant of `generate_answer`: retrieval and the LLM call run through `ainvoke`.
+    The LLM call waits for a slot of its backend (see `LLMRegistry.limit`).
+    """
+    with span("retrieval"):
+        docs = await retriever.ainvoke(question)
+    return await agenerate_answer_with_docs(question, docs, is_memory, model_name, chat_history)
+
+
+async def agenerate_answer_with_docs(question: str, docs: List[Document], is_memory: bool = False,
+                                     model_name: Optional[str] = None, chat_history: str = "") -> str:
+    """
+    The answer of `agenerate_answer` from already retrieved documents (e.g. a batch retrieval).
+    """
+    chain_input = _answer_input(question, docs, is_memory, chat_history, model_name)
+    with span("generation"):
+        async with llm_registry.limit(model_name, chain_input):
+            return await _answer_chain(is_memory, model_name).ainvoke(chain_input)
+
+
+async def astream_answer(question: str, docs: List[Document], is_memory: bool,
+                         model_name: Optional[str] = None, chat_history: str = "") -> AsyncIterator[str]:
+    """
+    Stream the answer to the question token by token from already retrieved documents.
+    Uses the same prompts and backends (OpenAI or Ollama) as `generate_answer`.
+
+    Args:
+        question (str): The user's question.
+        docs (List[Document]): Retrieved documents used as context.
+        is_memory (bool): Whether to use the prompt with chat history.
+        model_name (Optional[str]): Ollama model name; the OpenAI model is used when None.
+        chat_history (str): Session history used with `is_memory`.
+
+    Yields:
+        str: Answer tokens as they are generated.
+    """
+    chain_input = _answer_input(question, docs, is_memory, chat_history, model_name)
+    async with llm_registry.limit(model_name, chain_input):
+        async for token in _answer_chain(is_memory, model_name).astream(chain_input):
+            yield token
+
+
+async def astream_answer_from_docs(question: str, docs: List[Document]) -> AsyncIterator[str]:
+    """
+    Streaming variant of `agenerate_answer_from_docs`.
+    """
+    chain_input = _docs_answer_input(question, docs)
+    async with llm_registry.limit(None, chain_input):
+        async for token in _docs_answer_chain().astream(chain_input):
+            yield token
+
+
+async def asummarize_conversation(summary: str, new_lines: str) -> str:
+    """
+    Fold new conversation lines into the running summary of a session.
+    """
+    chain_input = {"summary": summary, "new_lines": new_lines}
+    chain = llm_registry.chain("summary", None, lambda llm: SUMMARY_PROMPT | llm | StrOutputParser())
+    async with llm_registry.limit(None, chain_input):
+        return await chain.ainvoke(chain_input)
 
 
 def generate_answer_from_docs(question: str, docs: List[Document]) -> str:
@@ -110,33 +198,76 @@ def generate_answer_from_docs(question: str, docs: List[Document]) -> str:
     Returns:
         str: The generated answer.
     """
+    # Invoke the chain with the context and question
+    return _docs_answer_chain().invoke(_docs_answer_input(question, docs))
+
+async def agenerate_answer_from_docs(question: str, docs: List[Document]) -> str:
+    """
+    Async variant of `generate_answer_from_docs`.
+    """
+    chain_input = _docs_answer_input(question, docs)
+    async with llm_registry.limit(None, chain_input):
+        return await _docs_answer_chain().ainvoke(chain_input)
+
+def _docs_answer_chain():
+    # Create runnable chain (prompt -> llm -> text)
+    return llm_registry.chain("docs_answer", None, lambda llm: DOCS_ANSWER_PROMPT | llm | StrOutputParser())
+
+def _docs_answer_input(question: str, docs: List[Document], max_tokens: Optional[int] = None) -> dict:
     # Combine the content of all documents into a single context string
-    context = "\n".join([doc.page_content for doc in docs])
+    return {"context": "\n".join([doc.page_content for doc in _pack(docs, max_tokens=max_tokens)]), "question": question}
 
-    # Prompt template for answering based on provided context
-    prompt_template = """
-    You are an assistant answering questions based on the provided context.
-    Use only the context to answer the question as accurately and concisely as possible.
+async def agenerate_answer_with_followup(question: str, docs: List[Document],
+                                         max_tokens: Optional[int] = None) -> Tuple[str, Optional[str]]:
+    """
+    Answer the question from the documents and decide on a follow-up question in one LLM call.
+    The context is packed within `max_tokens` (CONTEXT_MAX_TOKENS when None).
 
-    Context:
-    {context}
+    Returns:
+        Tuple[str, Optional[str]]: The answer and the follow-up question (None if the answer is complete).
+    """
+    chain_input = _docs_answer_input(question, docs, max_tokens)
+    with span("generation"):
+        async with llm_registry.limit(None, chain_input):
+            return _split_followup(await _answer_with_followup_chain().ainvoke(chain_input))
 
-    Question:
-    {question}
+async def astream_answer_with_followup(question: str, docs: List[Document],
+                                       max_tokens: Optional[int] = None) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """
+    Streaming variant of `agenerate_answer_with_followup`.
 
-    Answer:
+    Yields:
+        Tuple[str, Optional[str]]: ("token", answer text) while the answer is generated,
+        then one ("followup", follow-up question or None).
     """
-    prompt = PromptTemplate.from_template(prompt_template)
+    chain_input = _docs_answer_input(question, docs, max_tokens)
+    text, emitted, marker_at = "", 0, -1
+    async with llm_registry.limit(None, chain_input):
+        async for token in _answer_with_followup_chain().astream(chain_input):
+            text += token
+            if marker_at >= 0:
+                continue
+            marker_at = text.lower().find(FOLLOWUP_MARKER.lower(), emitted)
+            # Hold back a possible beginning of the marker until it is complete
+            safe = marker_at if marker_at >= 0 else max(len(text) - len(FOLLOWUP_MARKER) + 1, emitted)
+            if safe > emitted:
+                yield "token", text[emitted:safe]
+                emitted = safe
+    # Everything from the first marker on was held back: like `_split_followup`, the answer ends at the last one
+    answer_end = text.lower().rfind(FOLLOWUP_MARKER.lower())
+    answer_end = len(text) if answer_end < 0 else answer_end
+    if answer_end > emitted:
+        yield "token", text[emitted:answer_end]
+    yield "followup", _split_followup(text)[1]
 
-    # Define the LLM
-    llm = ChatOpenAI(model=getEnvVariable("OPENAI_MODEL"))
-    # Create runnable chain (prompt -> llm)
-    chain = prompt | llm
+def _answer_with_followup_chain():
+    return llm_registry.chain("answer_with_followup", None, lambda llm: ANSWER_WITH_FOLLOWUP_PROMPT | llm | StrOutputParser())
 
-    # Invoke the chain with the context and question
-    result = chain.invoke({"context": context, "question": question})
-    # Return the generated answer (expects .content attribute)
-    return result.content
+def _split_followup(text: str) -> Tuple[str, Optional[str]]:
+    position = text.lower().rfind(FOLLOWUP_MARKER.lower())
+    if position < 0:
+        return text.strip(), None
+    return text[:position].strip(), _parse_followup(text[position + len(FOLLOWUP_MARKER):])
 
 def generate_followup_question_if_needed(question: str, answer: str) -> Optional[str]:
     """
@@ -149,29 +280,23 @@ def generate_followup_question_if_needed(question: str, answer: str) -> Optional
     Returns:
         Optional[str]: The follow-up question if needed, otherwise None.
     """
-    # Prompt template for generating a follow-up question if needed
-    prompt_template = """
-    Given the original question and the current answer, decide whether a follow-up question is needed
-    to clarify or improve the answer.
-
-    If the answer is sufficient, respond with only "None".
-    Otherwise, generate a follow-up question that helps improve or complete the answer.
-
-    Original Question: {question}
-    Current Answer: {answer}
+    # Invoke the chain with the question and answer
+    return _parse_followup(_followup_chain().invoke({"question": question, "answer": answer}))
 
-    Follow-up Question:
+async def agenerate_followup_question_if_needed(question: str, answer: str) -> Optional[str]:
+    """
+    Async variant of `generate_followup_question_if_needed`.
     """
+    chain_input = {"question": question, "answer": answer}
+    async with llm_registry.limit(None, chain_input):
+        return _parse_followup(await _followup_chain().ainvoke(chain_input))
 
-    prompt = PromptTemplate.from_template(prompt_template)
-    # Define the LLM
-    llm = ChatOpenAI(model=getEnvVariable("OPENAI_MODEL"))
+def _followup_chain():
     # Create the LLM chain with the prompt
-    chain = prompt | llm
+    return llm_registry.chain("followup", None, lambda llm: FOLLOWUP_PROMPT | llm | StrOutputParser())
 
-    # Invoke the chain with the question and answer
-    result = chain.invoke({"question": question, "answer": answer})
-    followup = result.content.strip()  # Get the follow-up question or "None"
+def _parse_followup(content: str) -> Optional[str]:
+    followup = content.strip()  # Get the follow-up question or "None"
 
     # Return None if no follow-up is needed, otherwise return the follow-up question
-    return None if followup.lower() == "none" else followup
\ No newline at end of file
+    return None if followup.strip(" .\"'").lower() in ("none", "") else followup
@@ -0,0 +1,164 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from app.src.utils import Tokenizer, get_tokenizer, getEnvVariable, metrics
+from .process_data import content_hash
+
+context_tokens = metrics.histogram(
+    "rag_context_tokens", "Tokens of the packed context sent to the LLM",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+context_chunks = metrics.counter(
+    "rag_context_chunks_total", "Retrieved chunks by context packing result", ["result"])
+
+
+@dataclass
+class _Span:
+    """
+    Contiguous text of one document made of one or more retrieved chunks.
+    """
+    rank: int  # Position of the best chunk in the retrieved (relevance) order
+    doc_id: Optional[str]
+    first_index: int
+    last_index: int
+    start: int
+    end: int
+    text: str
+    metadata: dict
+    pages: List[int] = field(default_factory=list)
+    chunks: int = 1
+
+    def document(self) -> Document:
+        if self.doc_id is None:
+            return Document(page_content=self.text, metadata=self.metadata)
+        metadata = {**self.metadata, "chunk_index": self.first_index, "chunk_index_end": self.last_index,
+                    "start": self.start, "end": self.end, "chunks": self.chunks}
+        if self.pages:
+            metadata.update(page=min(self.pages), page_end=max(self.pages))
+        return Document(page_content=self.text, metadata=metadata)
+
+
+def _position(doc: Document) -> Optional[Tuple[str, int, int, int]]:
+    # (document id, chunk index, start, end), stored at ingestion (see `IncrementalChunker`)
+    metadata = doc.metadata
+    try:
+        return str(metadata["doc_id"]), int(metadata["chunk_index"]), int(metadata["start"]), int(metadata["end"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _pages(doc: Document) -> List[int]:
+    return [doc.metadata[key] for key in ("page", "page_end") if isinstance(doc.metadata.get(key), int)]
+
+
+def _extend(span: _Span, doc: Document, index: int, start: int, end: int) -> bool:
+    """
+    Append the chunk to the span it follows or overlaps; False when its text is already in the span.
+    """
+    if start >= span.start and end <= span.end:
+        return False
+    overlap = span.end - start
+    text = doc.page_content
+    if 0 < overlap < len(text) and span.text.endswith(text[:overlap]):
+        span.text += text[overlap:]
+    else:
+        # Adjacent chunks (the splitter drops the whitespace between them), or offsets that do not line up
+        span.text += "\n" + text
+    span.last_index = max(span.last_index, index)
+    span.end = max(span.end, end)
+    span.pages.extend(_pages(doc))
+    span.chunks += 1
+    return True
+
+
+def _spans(docs: List[Document]) -> Tuple[List[_Span], int, int]:
+    """
+    Deduplicate the documents and merge chunks that are next to each other
+    in the same source document. Returns the spans in relevance order, and
+    the number of duplicate and of merged chunks.
+    """
+    spans: List[_Span] = []
+    positioned: Dict[str, List[Tuple[int, int, int, int, Document]]] = {}
+    seen = set()
+    duplicates = 0
+    for rank, doc in enumerate(docs):
+        key = doc.metadata.get("id") or content_hash(doc.page_content)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        position = _position(doc)
+        if position is None:
+            spans.append(_Span(rank, None, -1, -1, 0, 0, doc.page_content, doc.metadata, _pages(doc)))
+        else:
+            doc_id, index, start, end = position
+            positioned.setdefault(doc_id, []).append((start, end, index, rank, doc))
+
+    merged = 0
+    for doc_id, chunks in positioned.items():
+        # Sweep the chunks of each document in text order
+        span: Optional[_Span] = None
+        for start, end, index, rank, doc in sorted(chunks, key=lambda chunk: (chunk[0], chunk[1])):
+            if span is not None and (start <= span.end or index == span.last_index + 1):
+                if _extend(span, doc, index, start, end):
+                    merged += 1
+                else:
+                    duplicates += 1
+                if rank < span.rank:
+                    span.rank, span.metadata = rank, doc.metadata
+                continue
+            span = _Span(rank, doc_id, index, index, start, end, doc.page_content, doc.metadata, _pages(doc))
+            spans.append(span)
+    spans.sort(key=lambda item: item.rank)
+    return spans, duplicates, merged
+
+
+def pack_context(docs: List[Document], max_tokens: int = 0, tokenizer: Optional[Tokenizer] = None) -> List[Document]:
+    """
+    Turn retrieved chunks into the context of a prompt.
+
+    Duplicates are dropped, chunks that follow or overlap each other in the
+    same document are merged back into one span (the overlap is included
+    once), and the spans are taken in relevance order (the rank of their best
+    chunk) while they fit `max_tokens` counted with `tokenizer` (the
+    tokenizer of the model answering; 0 means no limit). A span that does not
+    fit is skipped for smaller ones further down, except for the first one,
+    which is truncated rather than leaving the context empty.
+
+    Args:
+        docs (List[Document]): Retrieved documents, most relevant first.
+        max_tokens (int): Token budget of the context.
+        tokenizer (Optional[Tokenizer]): Counts the tokens; cl100k_base when None.
+
+    Returns:
+        List[Document]: The packed documents, most relevant first.
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    spans, duplicates, merged = _spans(docs)
+    packed: List[Document] = []
+    used = 0
+    over_budget = 0
+    for span in spans:
+        tokens = tokenizer.count(span.text)
+        if max_tokens and used + tokens > max_tokens:
+            if packed:
+                over_budget += span.chunks
+                continue
+            span.text = tokenizer.truncate(span.text, max_tokens)
+            tokens = tokenizer.count(span.text)
+        packed.append(span.document())
+        used += tokens
+    context_tokens.observe(used)
+    context_chunks.inc(duplicates, result="duplicate")
+    context_chunks.inc(merged, result="merged")
+    context_chunks.inc(over_budget, result="over_budget")
+    context_chunks.inc(sum(doc.metadata.get("chunks", 1) for doc in packed), result="kept")
+    return packed
+
+
+def context_budget() -> int:
+    """
+    Token budget of the retrieved context in a prompt (CONTEXT_MAX_TOKENS, 0 = no limit).
+    """
+    return int(getEnvVariable("CONTEXT_MAX_TOKENS", "3000"))
@@ -0,0 +1,55 @@
+import logging
+import os
+import re
+
+from sentence_transformers import SentenceTransformer
+
+from app.src.utils import getEnvVariable
+
+logger = logging.getLogger(__name__)
+
+# "torch": full-precision PyTorch (reference), "onnx": ONNX Runtime, "int8": ONNX Runtime with
+# dynamically int8-quantized weights
+EMBEDDING_BACKENDS = ("torch", "onnx", "int8")
+
+
+def load_embedding_model(model_name: str, backend: str = "torch") -> SentenceTransformer:
+    """
+    Load the embedding model on the given runtime.
+
+    Every backend is a `SentenceTransformer` with the same tokenizer, pooling
+    and normalization, so `encode` and the "passage: "/"query: " prefixes the
+    callers add behave identically; only the inference runtime differs.
+    The ONNX backends need `sentence-transformers[onnx]` (optimum + onnxruntime).
+
+    The int8 model is exported once with ONNX Runtime dynamic quantization
+    (EMBEDDING_INT8_CONFIG: "avx2", "avx512", "avx512_vnni" or "arm64") into
+    EMBEDDING_ONNX_DIR and loaded from there afterwards.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend} (available: {', '.join(EMBEDDING_BACKENDS)})")
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    return _load_int8(model_name, int8_config())
+
+
+def int8_config() -> str:
+    """
+    Quantization target of the int8 backend (EMBEDDING_INT8_CONFIG).
+    """
+    return getEnvVariable("EMBEDDING_INT8_CONFIG", "avx2")
+
+
+def _load_int8(model_name: str, quantization_config: str) -> SentenceTransformer:
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    directory = os.path.join(getEnvVariable("EMBEDDING_ONNX_DIR", "onnx_models"), re.sub(r"[^\w.-]", "_", model_name))
+    file_name = f"onnx/model_qint8_{quantization_config}.onnx"
+    if not os.path.exists(os.path.join(directory, file_name)):
+        logger.info("Exporting int8 ONNX model (%s) to %s", quantization_config, directory)
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save(directory)
+        export_dynamic_quantized_onnx_model(model, quantization_config, directory)
+    return SentenceTransformer(directory, backend="onnx", model_kwargs={"file_name": file_name})
@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.src.utils import getEnvVariable
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of chunk embeddings keyed by (model, content hash).
+
+    The key does not include the collection or topic, so a chunk uploaded to
+    another collection, or kept unchanged in a new revision of a document, is
+    never encoded twice by the same model. The SQLite file is opened on first
+    use, so importing the module creates nothing.
+    """
+
+    def __init__(self, path: Optional[str] = None, enabled: bool = True):
+        self.enabled = enabled and bool(path)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with the lock held
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))"
+            )
+            self._db.commit()
+        return self._db
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Return the cached vectors of the given hashes (missing hashes are left out).
+        """
+        if not self.enabled or not hashes:
+            return {}
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay below SQLite's limit of bound parameters per statement
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                rows = self._connection().execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    (model, *part),
+                ).fetchall()
+                found.update((row[0], np.frombuffer(row[1], dtype=np.float32)) for row in rows)
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, model: str, hashes: List[str], vectors: np.ndarray):
+        if not self.enabled or not hashes:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            db = self._connection()
+            db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, content_hash, vector.tobytes()) for content_hash, vector in zip(hashes, vectors)],
+            )
+            db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+embedding_cache = EmbeddingCache(
+    path=getEnvVariable("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
+    enabled=getEnvVariable("EMBEDDING_CACHE_ENABLED", "true") == "true",
+)
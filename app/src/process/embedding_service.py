@@ -0,0 +1,224 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from app.src.utils import getEnvVariable, metrics
+from .embedding_backends import int8_config, load_embedding_model
+
+DEFAULT_MODEL_NAME = "intfloat/multilingual-e5-small"
+
+query_cache_lookups = metrics.counter("embedding_query_cache_total", "Query embedding cache lookups", ["result"])
+micro_batch_texts = metrics.histogram("embedding_micro_batch_texts", "Texts encoded per query micro-batch",
+                                      buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class EmbeddingService:
+    """
+    Process-wide embedding service.
+
+    The model is loaded once, on the runtime selected by `backend` (see
+    `load_embedding_model`), and shared by every caller. Query encodes coming
+    from concurrent requests are collected by a background worker into
+    micro-batches of at most `max_batch_size` texts, waiting at most
+    `max_wait_ms` for the batch to fill up. Recently encoded query texts are
+    kept in a small LRU cache, so the same question embedded for topic
+    detection and then for retrieval is encoded only once.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 query_cache_size: int = 1024, backend: str = "torch"):
+        self.model_name = model_name
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._model: Optional[SentenceTransformer] = None
+        self._load_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[List[str], Future]]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """
+        Return the shared model, loading it on first access.
+        """
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self):
+        """
+        Load the model and start the micro-batching worker (idempotent).
+        """
+        with self._load_lock:
+            if self._model is None:
+                self._model = load_embedding_model(self.model_name, self.backend)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    @property
+    def model_key(self) -> str:
+        """
+        Identifies the vectors this service produces (model, runtime and int8 quantization
+        target), e.g. for caching them.
+        """
+        if self.backend == "int8":
+            return f"{self.model_name}:int8:{int8_config()}"
+        return self.model_name if self.backend == "torch" else f"{self.model_name}:{self.backend}"
+
+    def use_model(self, model):
+        """
+        Serve embeddings from an already created model with the `SentenceTransformer.encode`
+        interface (e.g. a local stand-in for benchmarks) instead of loading `model_name`.
+        """
+        with self._load_lock:
+            self._model = model
+        with self._cache_lock:
+            self._query_cache.clear()
+
+    def close(self):
+        """
+        Stop the micro-batching worker.
+        """
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
+        self._worker = None
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts through the micro-batcher and block until done.
+        Signature-compatible with `SentenceTransformer.encode` as used by the retrievers.
+        """
+        texts, found, missing = self._split_cached(texts)
+        if missing:
+            found.update(self._store(missing, self.submit(missing).result()))
+        return np.stack([found[text] for text in texts])
+
+    async def aencode(self, texts: List[str]) -> np.ndarray:
+        """
+        Async variant of `encode`; does not block the event loop.
+        """
+        texts, found, missing = self._split_cached(texts)
+        if missing:
+            found.update(self._store(missing, await asyncio.wrap_future(self.submit(missing))))
+        return np.stack([found[text] for text in texts])
+
+    def _split_cached(self, texts: List[str]):
+        if isinstance(texts, str):
+            texts = [texts]
+        with self._cache_lock:
+            cached = {}
+            for text in texts:
+                if text in self._query_cache:
+                    self._query_cache.move_to_end(text)
+                    cached[text] = self._query_cache[text]
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        query_cache_lookups.inc(len(cached), result="hit")
+        query_cache_lookups.inc(len(missing), result="miss")
+        return texts, cached, missing
+
+    def _store(self, texts: List[str], embeddings: np.ndarray) -> dict:
+        computed = dict(zip(texts, embeddings))
+        with self._cache_lock:
+            for text, embedding in computed.items():
+                self._query_cache[text] = embedding
+                self._query_cache.move_to_end(text)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return computed
+
+    def submit(self, texts: List[str]) -> Future:
+        """
+        Queue texts for the next micro-batch and return a future of their embeddings.
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if self._worker is None or not self._worker.is_alive():
+            self.load()
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode_batch(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Encode a large list of texts directly (ingestion path), bypassing the micro-batcher.
+        Concurrent ingestions take turns: one encode already uses every core.
+        """
+        model = self.model
+        with self._batch_lock:
+            return model.encode(texts, batch_size=batch_size)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            # Collect more requests until the batch is full or the wait time is over
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # Stop after flushing the current batch
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[Tuple[List[str], Future]]):
+        batch = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        micro_batch_texts.observe(len(texts))
+        try:
+            embeddings = self.model.encode(texts, batch_size=max(len(texts), 1))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for item_texts, future in batch:
+            future.set_result(embeddings[start:start + len(item_texts)])
+            start += len(item_texts)
+
+
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """
+    Return the process-wide embedding service, configured from environment variables.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService(
+                    model_name=getEnvVariable("EMBEDDING_MODEL_NAME", DEFAULT_MODEL_NAME),
+                    max_batch_size=int(getEnvVariable("EMBEDDING_MAX_BATCH_SIZE", "32")),
+                    max_wait_ms=float(getEnvVariable("EMBEDDING_MAX_WAIT_MS", "5")),
+                    query_cache_size=int(getEnvVariable("EMBEDDING_QUERY_CACHE_SIZE", "1024")),
+                    backend=getEnvVariable("EMBEDDING_BACKEND", "torch"),
+                )
+    return _service
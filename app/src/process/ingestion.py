@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Set, Tuple
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+
+from app.src.qdrant import qbrant_service as qbrant, get_bm25_index, has_sparse_vectors, is_embedded_client
+from app.src.utils import getEnvVariable, metrics, run_in_process, run_in_thread, count_pdf_pages, extract_pdf_pages, ocr_pdf_page
+from .process_data import IncrementalChunker, chunk_id, content_hash, embed_chunks
+from .topic_embeddings import topic_embeddings
+
+ingested_chunks = metrics.counter("ingested_chunks_total", "Chunks of ingested documents", ["status"])
+ingested_documents = metrics.counter("ingested_documents_total", "Ingested documents")
+
+
+async def _iter_pages(pdf_path: str, page_window: int, parallelism: int, ocr_dpi: Optional[int]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Yield (page number, text) in page order while up to `parallelism` page
+    windows are extracted concurrently in the process pool. Image-only pages
+    are OCR-ed as separate pool tasks as soon as their window is extracted.
+    """
+    num_pages = await run_in_process(count_pdf_pages, pdf_path)
+    windows = iter(range(0, num_pages, page_window))
+    pending: deque = deque()
+
+    def submit_next():
+        start = next(windows, None)
+        if start is not None:
+            end = min(start + page_window, num_pages)
+            pending.append(asyncio.ensure_future(run_in_process(extract_pdf_pages, pdf_path, start, end)))
+
+    try:
+        for _ in range(parallelism):
+            submit_next()
+        while pending:
+            pages = await pending.popleft()
+            submit_next()
+            ocr_tasks = {
+                number: asyncio.ensure_future(run_in_process(ocr_pdf_page, pdf_path, number, ocr_dpi))
+                for number, _, needs_ocr in pages if needs_ocr and ocr_dpi
+            }
+            for number, text, _ in pages:
+                yield number, await ocr_tasks[number] if number in ocr_tasks else text
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _document_id(pdf_path: str) -> str:
+    # Content hash of the file: chunks of the same document share it, whatever the upload name
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+async def _iter_chunk_batches(pdf_path: str, page_window: int, parallelism: int, ocr_dpi: Optional[int],
+                              batch_size: int) -> AsyncIterator[List[Tuple[str, dict]]]:
+    chunker = IncrementalChunker()
+    doc_id = await run_in_thread(_document_id, pdf_path)
+    batch: List[Tuple[str, dict]] = []
+    async for number, text in _iter_pages(pdf_path, page_window, parallelism, ocr_dpi):
+        batch.extend((chunk, {**metadata, "doc_id": doc_id}) for chunk, metadata in chunker.feed(text, page=number))
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    batch.extend((chunk, {**metadata, "doc_id": doc_id}) for chunk, metadata in chunker.flush())
+    for start in range(0, len(batch), batch_size):
+        yield batch[start:start + batch_size]
+
+
+@dataclass
+class IngestStats:
+    """
+    Counters of one or more ingestions. Stage times are the seconds each stage
+    spent working, excluding the time it was blocked by the next stage; stages
+    overlap, so they add up to more than the wall time.
+    """
+    documents: int = 0
+    chunks_stored: int = 0
+    chunks_skipped: int = 0
+    extract_seconds: float = 0.0
+    embed_seconds: float = 0.0
+    upsert_seconds: float = 0.0
+
+
+async def _timed(iterator: AsyncIterator, stats: IngestStats, field: str) -> AsyncIterator:
+    # Add the time spent waiting for each item to the stage time
+    iterator = iterator.__aiter__()
+    while True:
+        started = time.perf_counter()
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            setattr(stats, field, getattr(stats, field) + time.perf_counter() - started)
+        yield item
+
+
+class _BM25Buffer:
+    """
+    Collects uploaded chunks and adds them to the BM25 index in large segments.
+    """
+
+    def __init__(self, client: QdrantClient, collection_name: str, flush_size: int):
+        self.client = client
+        self.collection_name = collection_name
+        self.flush_size = flush_size
+        self.ids: List[str] = []
+        self.chunks: List[str] = []
+
+    async def add(self, ids: List[str], chunks: List[str]):
+        self.ids.extend(ids)
+        self.chunks.extend(chunks)
+        if len(self.ids) >= self.flush_size:
+            await self.flush(save=False)
+
+    async def flush(self, save: bool = True):
+        ids, chunks = self.ids, self.chunks
+        self.ids, self.chunks = [], []
+        index = await run_in_thread(get_bm25_index, self.client, self.collection_name)
+        if ids:
+            await run_in_thread(index.add_documents, ids, chunks)
+        if save:
+            await run_in_thread(index.save)
+
+
+async def ingest_pdf(pdf_path: str, client: QdrantClient, collection_name: str, topic: str,
+                     async_client: Optional[AsyncQdrantClient] = None, stats: Optional[IngestStats] = None) -> Tuple[int, int]:
+    """
+    Stream a PDF into a collection: parallel page extraction (with OCR of
+    image-only pages) -> incremental chunking -> fixed-size embedding batches
+    -> parallel upserts. Chunks keep the page numbers they come from, the id
+    of the document and their position in it (see `IncrementalChunker`).
+
+    Stages are connected by bounded queues, so a slow stage blocks the one
+    before it and memory stays constant regardless of the document size.
+
+    Chunk ids are derived from the chunk text, collection and topic. Chunks
+    already stored in the collection are skipped before embedding, so
+    uploading the same document again, or a revision of it, only embeds and
+    upserts the chunks that changed.
+
+    Args:
+        pdf_path (str): Path of the PDF on disk.
+        client (QdrantClient): Qdrant client (collection setup, BM25 bootstrap).
+        collection_name (str): Target collection.
+        topic (str): Topic stored with every chunk.
+        async_client (Optional[AsyncQdrantClient]): Used for upserts when provided.
+        stats (Optional[IngestStats]): Counters and stage times are added to it.
+
+    Returns:
+        Tuple[int, int]: Number of chunks stored and number of chunks skipped as already stored.
+    """
+    page_window = int(getEnvVariable("INGEST_PAGE_WINDOW", "8"))
+    extract_parallelism = int(getEnvVariable("INGEST_EXTRACT_PARALLELISM", str(os.cpu_count() or 1)))
+    ocr_dpi = int(getEnvVariable("OCR_DPI", "300")) if getEnvVariable("OCR_ENABLED", "true") == "true" else None
+    batch_size = int(getEnvVariable("INGEST_EMBED_BATCH_SIZE", "64"))
+    queue_size = int(getEnvVariable("INGEST_QUEUE_SIZE", "4"))
+    upsert_parallelism = int(getEnvVariable("INGEST_UPSERT_PARALLELISM", "4"))
+
+    chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    vector_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    bm25_buffer = _BM25Buffer(client, collection_name, flush_size=batch_size * 32)
+    # Embedded Qdrant is not thread-safe: serialize the sync upserts
+    upsert_slots = asyncio.Semaphore(1 if async_client is None and is_embedded_client(client) else upsert_parallelism)
+    stats = stats if stats is not None else IngestStats()
+    stored = 0
+    skipped = 0
+    collection_ready = False
+    sparse = False  # Keyword search in Qdrant (sparse vectors) instead of the local BM25 index
+
+    async def extract():
+        batches = _iter_chunk_batches(pdf_path, page_window, extract_parallelism, ocr_dpi, batch_size)
+        async for batch in _timed(batches, stats, "extract_seconds"):
+            await chunk_queue.put(batch)
+        await chunk_queue.put(None)
+
+    async def existing(ids: List[str]) -> Set[str]:
+        if async_client is not None:
+            return await qbrant.aexisting_ids(async_client, collection_name, ids)
+        async with upsert_slots:
+            return await run_in_thread(qbrant.existing_ids, client, collection_name, ids)
+
+    async def embed():
+        nonlocal skipped
+        seen: Set[str] = set()  # Ids queued by this upload (a chunk may repeat within the document)
+        while (batch := await chunk_queue.get()) is not None:
+            started = time.perf_counter()
+            hashes = [content_hash(chunk) for chunk, _ in batch]
+            ids = [chunk_id(text_hash, collection_name, topic) for text_hash in hashes]
+            stored_ids = await existing([point_id for point_id in ids if point_id not in seen])
+            new = []
+            for i, point_id in enumerate(ids):
+                if point_id not in seen and point_id not in stored_ids:
+                    new.append(i)
+                seen.add(point_id)
+            skipped += len(ids) - len(new)
+            if not new:
+                stats.embed_seconds += time.perf_counter() - started
+                continue
+            batch, hashes, ids = [batch[i] for i in new], [hashes[i] for i in new], [ids[i] for i in new]
+            # Only new chunks are embedded; texts seen before (in any collection) come from the cache
+            vectors = await run_in_thread(embed_chunks, [chunk for chunk, _ in batch], hashes, batch_size)
+            stats.embed_seconds += time.perf_counter() - started
+            await vector_queue.put((ids, vectors.tolist(), [chunk for chunk, _ in batch], [metadata for _, metadata in batch]))
+        await vector_queue.put(None)
+
+    async def store(ids: List[str], vectors: List[List[float]], chunks: List[str], metadatas: List[dict]):
+        nonlocal stored
+        started = time.perf_counter()
+        try:
+            if async_client is not None:
+                await qbrant.aadd_text(async_client, collection_name, ids, vectors, chunks, topic=topic, metadatas=metadatas)
+            else:
+                await run_in_thread(qbrant.add_text, client, collection_name, ids, vectors, chunks, topic=topic, metadatas=metadatas)
+            if not sparse:
+                await bm25_buffer.add(ids, chunks)
+            topic_embeddings.add_vectors(collection_name, topic, vectors)
+            stored += len(ids)
+        finally:
+            stats.upsert_seconds += time.perf_counter() - started
+            upsert_slots.release()
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(extract())
+            group.create_task(embed())
+            while (item := await vector_queue.get()) is not None:
+                if not collection_ready:
+                    await run_in_thread(qbrant.init_collection, client=client, collection_name=collection_name)
+                    sparse = await run_in_thread(has_sparse_vectors, client, collection_name)
+                    if not sparse:
+                        # Collection without sparse vectors: load (or bootstrap) the local BM25 index
+                        # before our own chunks are in Qdrant
+                        await run_in_thread(get_bm25_index, client, collection_name)
+                    collection_ready = True
+                # Wait for a free upsert slot before taking the next batch
+                await upsert_slots.acquire()
+                group.create_task(store(*item))
+    except ExceptionGroup as e:
+        # Surface the first stage failure instead of the group wrapper
+        raise e.exceptions[0]
+
+    if stored and not sparse:
+        await bm25_buffer.flush()
+    stats.documents += 1
+    stats.chunks_stored += stored
+    stats.chunks_skipped += skipped
+    ingested_documents.inc()
+    ingested_chunks.inc(stored, status="stored")
+    ingested_chunks.inc(skipped, status="skipped")
+    return stored, skipped
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI
+
+from app.src.utils import Tokenizer, count_tokens, get_tokenizer, getEnvVariable, metrics, span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_BASE_URL = "https://ai-api.bravesoft.vn:8080"
+
+
+llm_calls = metrics.counter("llm_calls_total", "LLM calls by backend and outcome", ["backend", "status"])
+llm_tokens = metrics.counter("llm_tokens_total", "Estimated LLM tokens by backend, prompt or completion", ["backend", "kind"])
+
+
+class _UsageCallback(BaseCallbackHandler):
+    """
+    Counts the calls and (estimated) tokens of a chat model, streamed or not.
+    """
+    run_inline = True
+
+    def __init__(self, backend: str):
+        self.backend = backend
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        tokens = sum(count_tokens(str(message.content)) for batch in messages for message in batch)
+        llm_tokens.inc(tokens, backend=self.backend, kind="prompt")
+
+    def on_llm_end(self, response, **kwargs):
+        tokens = sum(count_tokens(generation.text) for generations in response.generations for generation in generations)
+        llm_tokens.inc(tokens, backend=self.backend, kind="completion")
+        llm_calls.inc(backend=self.backend, status="ok")
+
+    def on_llm_error(self, error, **kwargs):
+        llm_calls.inc(backend=self.backend, status="error")
+
+
+class LLMOverloadedError(Exception):
+    """
+    Raised when a backend's wait queue is full or a request waited too long for it (HTTP 429).
+    """
+
+
+class BackendLimiter:
+    """
+    Admission control for one LLM backend.
+
+    At most `max_concurrency` calls run at once and, with `tokens_per_minute`
+    set, the estimated tokens of started calls stay within a token bucket of
+    one minute's budget. Waiting calls are admitted strictly in arrival order
+    (a large request at the head is not overtaken by small ones). A call is
+    rejected immediately when `max_queue` calls are already waiting, and after
+    `queue_timeout` seconds of waiting.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 8, tokens_per_minute: int = 0, max_queue: int = 64,
+                 queue_timeout: float = 30.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.rejected = 0
+        self._queue: deque = deque()
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._condition: Optional[asyncio.Condition] = None
+
+    def check(self):
+        """
+        Fail fast when the queue is already full.
+        """
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise LLMOverloadedError(f"Too many pending requests for the {self.name} backend, please retry later")
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """
+        Hold a call slot (and `tokens` of the rate budget) for the duration of the block.
+        """
+        with span("llm_queue"):
+            await self._acquire(tokens)
+        try:
+            yield
+        finally:
+            condition = self._get_condition()
+            async with condition:
+                self.active -= 1
+                condition.notify_all()
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": len(self._queue), "rejected": self.rejected}
+
+    async def _acquire(self, tokens: int):
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        deadline = time.monotonic() + self.queue_timeout
+        entry = object()
+        condition = self._get_condition()
+        async with condition:
+            self.check()
+            self._queue.append(entry)
+            try:
+                while not self._ready(entry, tokens):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise LLMOverloadedError(f"Timed out waiting for the {self.name} backend, please retry later")
+                    try:
+                        await asyncio.wait_for(condition.wait(), min(remaining, self._refill_delay(entry, tokens)))
+                    except asyncio.TimeoutError:
+                        pass
+                self.active += 1
+                if self.tokens_per_minute:
+                    self._tokens -= tokens
+            finally:
+                self._queue.remove(entry)
+                condition.notify_all()
+
+    def _ready(self, entry, tokens: int) -> bool:
+        if self._queue[0] is not entry or self.active >= self.max_concurrency:
+            return False
+        if not self.tokens_per_minute:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled) * self.tokens_per_minute / 60)
+        self._refilled = now
+        return self._tokens >= tokens
+
+    def _refill_delay(self, entry, tokens: int) -> float:
+        # Only the head of the queue waits for the bucket; everybody else waits for a notification
+        if not self.tokens_per_minute or self._queue[0] is not entry or self.active >= self.max_concurrency:
+            return self.queue_timeout
+        return max((tokens - self._tokens) * 60 / self.tokens_per_minute, 0.01)
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+
+class LLMRegistry:
+    """
+    Creates each chat model and compiled chain once per model and reuses them
+    (and their HTTP connection pools) across requests. Calls go through the
+    limiter of their backend ("openai" or "ollama").
+    """
+
+    def __init__(self):
+        self._llms: Dict[Tuple[str, str], Any] = {}
+        self._chains: Dict[Tuple[str, str, str], Any] = {}
+        self._limiters: Dict[str, BackendLimiter] = {}
+        self._factory: Optional[Callable[[Optional[str]], Any]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def backend(model_name: Optional[str] = None) -> str:
+        return "ollama" if model_name else "openai"
+
+    def use_factory(self, factory: Optional[Callable[[Optional[str]], Any]]):
+        """
+        Build chat models with `factory(model_name)` instead of ChatOpenAI/ChatOllama
+        (e.g. a local stand-in for benchmarks); None restores the real backends.
+        """
+        with self._lock:
+            self._factory = factory
+            self._llms.clear()
+            self._chains.clear()
+
+    def llm(self, model_name: Optional[str] = None):
+        """
+        Return the shared chat model: the Ollama model `model_name`, or the OpenAI model when None.
+        """
+        key = (self.backend(model_name), model_name or getEnvVariable("OPENAI_MODEL") or "")
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is None:
+                logger.info("Creating model: %s", model_name if model_name else "default OpenAI model")
+                if self._factory is not None:
+                    llm = self._factory(model_name)
+                elif model_name:
+                    llm = ChatOllama(model=model_name, base_url=getEnvVariable("OLLAMA_BASE_URL", DEFAULT_OLLAMA_BASE_URL))
+                else:
+                    llm = ChatOpenAI(model=getEnvVariable("OPENAI_MODEL"))
+                llm.callbacks = [*(llm.callbacks or []), _UsageCallback(key[0])]
+                self._llms[key] = llm
+            return llm
+
+    def tokenizer(self, model_name: Optional[str] = None) -> Tokenizer:
+        """
+        Tokenizer of the model answering: tiktoken's encoding of OPENAI_MODEL, or for
+        Ollama models the Hugging Face tokenizer OLLAMA_TOKENIZER (cl100k_base when unset).
+        """
+        if model_name:
+            repo = getEnvVariable("OLLAMA_TOKENIZER")
+            return get_tokenizer(f"hf:{repo}" if repo else None)
+        return get_tokenizer(getEnvVariable("OPENAI_MODEL") or None)
+
+    def chain(self, name: str, model_name: Optional[str], build: Callable[[Any], Any]):
+        """
+        Return the chain `name` for the model, compiling it with `build(llm)` on first use.
+        """
+        key = (name, self.backend(model_name), model_name or "")
+        with self._lock:
+            chain = self._chains.get(key)
+        if chain is None:
+            chain = build(self.llm(model_name))
+            with self._lock:
+                chain = self._chains.setdefault(key, chain)
+        return chain
+
+    def limiter(self, model_name: Optional[str] = None) -> BackendLimiter:
+        backend = self.backend(model_name)
+        with self._lock:
+            limiter = self._limiters.get(backend)
+            if limiter is None:
+                prefix = f"LLM_{backend.upper()}"
+                limiter = BackendLimiter(
+                    backend,
+                    max_concurrency=int(getEnvVariable(f"{prefix}_MAX_CONCURRENCY", "2" if backend == "ollama" else "16")),
+                    tokens_per_minute=int(getEnvVariable(f"{prefix}_TOKENS_PER_MINUTE", "0")),
+                    max_queue=int(getEnvVariable(f"{prefix}_MAX_QUEUE", "64")),
+                    queue_timeout=float(getEnvVariable("LLM_QUEUE_TIMEOUT", "30")),
+                )
+                self._limiters[backend] = limiter
+            return limiter
+
+    def limit(self, model_name: Optional[str], chain_input: dict):
+        """
+        Async context manager holding a slot of the model's backend for one call.
+        The token cost is the estimated prompt size plus LLM_EXPECTED_OUTPUT_TOKENS.
+        """
+        tokens = sum(count_tokens(str(value)) for value in chain_input.values())
+        return self.limiter(model_name).slot(tokens + int(getEnvVariable("LLM_EXPECTED_OUTPUT_TOKENS", "256")))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {backend: limiter.stats() for backend, limiter in self._limiters.items()}
+
+
+llm_registry = LLMRegistry()
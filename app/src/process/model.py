@@ -1,7 +1,9 @@
 from sentence_transformers import SentenceTransformer
-def get_model():
+from .embedding_service import get_embedding_service
+
+def get_model() -> SentenceTransformer:
     """
     Returns the model for the RAG system.
-    Use multilingual E5
+    Use multilingual E5, shared process-wide through the embedding service.
     """
-    return SentenceTransformer("intfloat/multilingual-e5-small")
\ No newline at end of file
+    return get_embedding_service().model
@@ -1,32 +1,229 @@
+import bisect
+import hashlib
 import uuid
-from .model import get_model
+import numpy as np
+from .embedding_service import get_embedding_service
+from .embedding_cache import embedding_cache
+from .topic_embeddings import topic_embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import Optional, List
-from sentence_transformers import util
+from qdrant_client import QdrantClient
+from typing import Optional, List, Tuple
 
-def preparing_data(text):
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+# Namespace of the deterministic chunk ids
+CHUNK_ID_NAMESPACE = uuid.UUID("5b0c6b1e-8f0a-4c54-9a52-3f6f3c2d7e10")
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(text_hash: str, collection_name: str, topic: str) -> str:
+    """
+    Deterministic point id of a chunk: the same text uploaded again to the same
+    collection and topic maps to the same point instead of a duplicate.
+    """
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{collection_name}\0{topic}\0{text_hash}"))
+
+def embed_chunks(chunks: List[str], hashes: Optional[List[str]] = None, batch_size: int = 64) -> np.ndarray:
+    """
+    Passage embeddings of chunks; vectors of already seen texts come from the embedding cache.
+    """
+    hashes = hashes or [content_hash(chunk) for chunk in chunks]
+    service = get_embedding_service()
+    cached = embedding_cache.get_many(service.model_key, hashes)
+    # Encode each missing text once, even if it repeats within the batch
+    missing = {text_hash: chunk for text_hash, chunk in zip(hashes, chunks) if text_hash not in cached}
+    if missing:
+        vectors = service.encode_batch(["passage: " + chunk for chunk in missing.values()], batch_size)
+        embedding_cache.put_many(service.model_key, list(missing), vectors)
+        cached.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+    if not chunks:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([cached[text_hash] for text_hash in hashes])
+
+def preparing_data(text, collection_name: str = "", topic: str = ""):
     # Split text into chunks
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     chunks = splitter.split_text(text)
 
-    embeddings = get_model().encode(["passage: " + c for c in chunks]).tolist()
+    hashes = [content_hash(chunk) for chunk in chunks]
+    embeddings = embed_chunks(chunks, hashes).tolist()
 
-    ids = [str(uuid.uuid4()) for _ in chunks]
+    ids = [chunk_id(text_hash, collection_name, topic) for text_hash in hashes]
     return [ids, embeddings, chunks]
 
-def detect_topic(question: str, context_labels: List[str]) -> Optional[str]:
+# RecursiveCharacterTextSplitter's default separators, tried in this order
+SEPARATORS = ["\n\n", "\n", " ", ""]
+
+class _StreamingSplit:
     """
-    Detect topic using zero-shot classification.
+    `RecursiveCharacterTextSplitter._split_text(text, separators)` (default
+    `keep_separator` and `len`) computed on text that arrives in parts.
+
+    The splitter cuts the text into pieces at every occurrence of the first
+    separator, each piece starting with its separator. Pieces shorter than
+    `chunk_size` are merged greedily (with overlap) into chunks. Longer pieces
+    end the current run and are split the same way with the remaining
+    separators. When the first separator does not occur at all, the splitter
+    uses the next one that does. That is the same as treating the whole text
+    as one long piece, so the result only depends on text seen so far plus
+    the current piece. Only the current piece (while shorter than
+    `chunk_size`), the chunk being merged and the levels below are held.
     """
-    model = get_model()
 
-    # Encode
-    emb_q = model.encode(question, convert_to_tensor=True)
-    emb_labels = model.encode(context_labels, convert_to_tensor=True)
+    def __init__(self, separators: List[str], chunk_size: int, chunk_overlap: int, offset: int = 0):
+        self._separator = separators[0]
+        self._separators = separators[1:]
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._buffer = ""  # Text of the current piece not yet handed to `_child`
+        self._offset = offset  # Document offset of the start of the buffer
+        self._scan = 0  # Where to look for the next separator in the buffer
+        self._child: Optional["_StreamingSplit"] = None  # Splits the current piece once it is long
+        self._run: List[Tuple[str, int]] = []  # (piece, offset) of the chunk being merged
+        self._total = 0
+
+    def feed(self, text: str) -> List[Tuple[str, int, int]]:
+        """
+        Add text and return the (chunk, start, end) that are complete.
+        """
+        if not self._separator:
+            # Split into characters, each one merged as a short piece
+            chunks = []
+            for position, char in enumerate(text):
+                chunks.extend(self._merge(char, self._offset + position))
+            self._offset += len(text)
+            return chunks
+        self._buffer += text
+        chunks = []
+        while True:
+            found = self._buffer.find(self._separator, self._scan)
+            if found >= 0:
+                chunks.extend(self._end_piece(found))
+                continue
+            # The end of the buffer may be the start of a separator
+            self._scan = max(self._scan, len(self._buffer) - len(self._separator) + 1)
+            if self._child is None and self._scan >= self._chunk_size:
+                chunks.extend(self._flush_run())
+                self._child = self._new_child()
+            if self._child is not None:
+                chunks.extend(self._child.feed(self._buffer[:self._scan]))
+                self._buffer, self._offset, self._scan = self._buffer[self._scan:], self._offset + self._scan, 0
+            return chunks
+
+    def finish(self) -> List[Tuple[str, int, int]]:
+        """
+        Return the remaining chunks at the end of the text.
+        """
+        chunks = self._end_piece(len(self._buffer)) if self._separator else []
+        return chunks + self._flush_run()
+
+    def _end_piece(self, end: int) -> List[Tuple[str, int, int]]:
+        # The current piece ends at `end` in the buffer; the next one starts there with its separator
+        piece, offset = self._buffer[:end], self._offset
+        self._buffer, self._offset, self._scan = self._buffer[end:], self._offset + end, len(self._separator)
+        if self._child is not None:
+            child, self._child = self._child, None
+            return child.feed(piece) + child.finish()
+        if not piece:
+            return []
+        if len(piece) < self._chunk_size:
+            return self._merge(piece, offset)
+        chunks = self._flush_run()
+        if not self._separators:
+            return chunks + [(piece, offset, offset + len(piece))]
+        child = self._new_child(offset)
+        return chunks + child.feed(piece) + child.finish()
+
+    def _new_child(self, offset: Optional[int] = None) -> "_StreamingSplit":
+        return _StreamingSplit(self._separators, self._chunk_size, self._chunk_overlap,
+                               self._offset if offset is None else offset)
 
-    # Calculate the similarity
-    cos_scores = util.cos_sim(emb_q, emb_labels)[0]
+    def _merge(self, piece: str, offset: int) -> List[Tuple[str, int, int]]:
+        # One step of TextSplitter._merge_splits (the separator is kept in the pieces)
+        chunks = []
+        if self._total + len(piece) > self._chunk_size and self._run:
+            chunks = self._chunk()
+            while self._total > self._chunk_overlap or (self._total + len(piece) > self._chunk_size and self._total > 0):
+                self._total -= len(self._run.pop(0)[0])
+        self._run.append((piece, offset))
+        self._total += len(piece)
+        return chunks
+
+    def _flush_run(self) -> List[Tuple[str, int, int]]:
+        chunks = self._chunk()
+        self._run, self._total = [], 0
+        return chunks
+
+    def _chunk(self) -> List[Tuple[str, int, int]]:
+        text = "".join(piece for piece, _ in self._run)
+        chunk = text.strip()
+        if not chunk:
+            return []
+        start = self._run[0][1] + len(text) - len(text.lstrip())
+        return [(chunk, start, start + len(chunk))]
+
+class IncrementalChunker:
+    """
+    Split a stream of page texts into the same chunks as `preparing_data`
+    gives for the concatenated text, while holding only a few chunks of text
+    in memory (see `_StreamingSplit`).
+
+    Each chunk is returned with its position in the document: its index, its
+    start and end offsets in the concatenated page texts, and the pages it
+    starts and ends on. Chunks with consecutive indexes (or overlapping
+    offsets) can be merged back into the text they were split from.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._split = _StreamingSplit(SEPARATORS, chunk_size, chunk_overlap)
+        self._length = 0  # Characters fed so far
+        self._index = 0  # Index of the next chunk in the document
+        # Document offset where each page starts, and its page number
+        self._page_offsets: List[int] = []
+        self._pages: List[Optional[int]] = []
+
+    def feed(self, text: str, page: Optional[int] = None) -> List[Tuple[str, dict]]:
+        """
+        Add page text and return the (chunk, metadata) pairs that are complete.
+        """
+        self._page_offsets.append(self._length)
+        self._pages.append(page)
+        self._length += len(text)
+        return [self._with_position(*record) for record in self._split.feed(text)]
+
+    def flush(self) -> List[Tuple[str, dict]]:
+        """
+        Return the remaining chunks at the end of the document.
+        """
+        chunks = [self._with_position(*record) for record in self._split.finish()]
+        self._split = _StreamingSplit(SEPARATORS, self._chunk_size, self._chunk_overlap, offset=self._length)
+        return chunks
+
+    def _page_at(self, offset: int) -> Optional[int]:
+        position = bisect.bisect_right(self._page_offsets, offset) - 1
+        return self._pages[max(position, 0)] if self._pages else None
+
+    def _with_position(self, chunk: str, start: int, end: int) -> Tuple[str, dict]:
+        metadata = {"chunk_index": self._index, "start": start, "end": end}
+        self._index += 1
+        page, page_end = self._page_at(start), self._page_at(max(end - 1, start))
+        if page is not None:
+            metadata.update(page=page, page_end=page_end)
+        return chunk, metadata
+
+def detect_topic(question: str, context_labels: List[str], collection_name: Optional[str] = None,
+                 client: Optional[QdrantClient] = None) -> Optional[str]:
+    """
+    Detect topic using zero-shot classification.
+    Label embeddings are cached per collection; the question embedding is the
+    same one the retrievers compute, so it is served from the embedding cache.
+    """
+    # Encode the question exactly like the retrievers do
+    emb_q = get_embedding_service().encode([f"passage: {question}"])[0]
 
-    # Take the label with the highest score
-    best_label = context_labels[cos_scores.argmax()]
-    return best_label
\ No newline at end of file
+    # Take the label with the highest cosine similarity
+    return topic_embeddings.match(emb_q, context_labels, collection_name=collection_name, client=client)
\ No newline at end of file
@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from sentence_transformers import CrossEncoder
+
+from app.src.utils import getEnvVariable, metrics, run_in_thread
+from .process_data import content_hash
+
+# Small multilingual cross-encoder (MiniLM, 12 layers, 384 hidden); runs on CPU
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+rerank_pairs = metrics.counter("rerank_pairs_total", "(query, chunk) pairs by rerank cache result", ["result"])
+rerank_dropped = metrics.counter("rerank_dropped_chunks_total", "Candidates dropped by the rerank score cutoff")
+
+
+class Reranker:
+    """
+    Process-wide cross-encoder reranker.
+
+    All candidates of a query are scored in one batched `predict` call; the
+    scores are kept in an LRU cache keyed by (query, chunk content hash), so
+    a chunk seen again for the same question (iterative RAG, retries,
+    streamed and non-streamed requests) is not scored twice. The model is
+    loaded once, like the embedding model.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, backend: str = "torch", batch_size: int = 32,
+                 cache_size: int = 4096, max_length: int = 512):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self._model: Optional[CrossEncoder] = None
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def model(self) -> CrossEncoder:
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self):
+        """
+        Load the model (idempotent).
+        """
+        with self._load_lock:
+            if self._model is None:
+                self._model = CrossEncoder(self.model_name, backend=self.backend, max_length=self.max_length)
+
+    def use_model(self, model):
+        """
+        Score with an already created model with the `CrossEncoder.predict`
+        interface (e.g. a local stand-in for benchmarks) instead of loading `model_name`.
+        """
+        with self._load_lock:
+            self._model = model
+        with self._cache_lock:
+            self._cache.clear()
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """
+        Relevance score of each text for the query (higher is better; 0-1 for the default model).
+        """
+        return self.score_pairs([(query, text) for text in texts])
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        Score of each (query, text) pair; the uncached pairs are scored in one batched call.
+        """
+        keys = [(query, content_hash(text)) for query, text in pairs]
+        scores = np.empty(len(pairs), dtype=np.float32)
+        missing = []
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    scores[i] = cached
+        rerank_pairs.inc(len(pairs) - len(missing), result="cached")
+        rerank_pairs.inc(len(missing), result="scored")
+        if missing:
+            predicted = self.model.predict([pairs[i] for i in missing], batch_size=self.batch_size,
+                                           show_progress_bar=False)
+            with self._cache_lock:
+                for i, value in zip(missing, np.asarray(predicted, dtype=np.float32).reshape(-1)):
+                    scores[i] = value
+                    self._cache[keys[i]] = float(value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, docs: List[Document], top_k: int, min_score: Optional[float] = None) -> List[Document]:
+        """
+        Return the `top_k` best documents by cross-encoder score, without those
+        scoring below `min_score`; the score is added as `rerank_score` metadata.
+        """
+        if not docs:
+            return []
+        return self._select(docs, self.score(query, [doc.page_content for doc in docs]), top_k, min_score)
+
+    def rerank_many(self, queries: List[str], docs: List[List[Document]], top_k: int,
+                    min_score: Optional[float] = None) -> List[List[Document]]:
+        """
+        `rerank` for several queries (`docs[i]` are the candidates of `queries[i]`),
+        scoring the pairs of all of them in one batch.
+        """
+        scores = self.score_pairs([(query, doc.page_content) for query, candidates in zip(queries, docs) for doc in candidates])
+        reranked, start = [], 0
+        for candidates in docs:
+            reranked.append(self._select(candidates, scores[start:start + len(candidates)], top_k, min_score))
+            start += len(candidates)
+        return reranked
+
+    def _select(self, docs: List[Document], scores: np.ndarray, top_k: int, min_score: Optional[float]) -> List[Document]:
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        kept = [i for i in order if min_score is None or scores[i] >= min_score]
+        rerank_dropped.inc(len(order) - len(kept))
+        return [
+            Document(page_content=docs[i].page_content, metadata={**docs[i].metadata, "rerank_score": float(scores[i])})
+            for i in kept
+        ]
+
+    async def arerank(self, query: str, docs: List[Document], top_k: int, min_score: Optional[float] = None) -> List[Document]:
+        return await run_in_thread(self.rerank, query, docs, top_k, min_score)
+
+    async def arerank_many(self, queries: List[str], docs: List[List[Document]], top_k: int,
+                           min_score: Optional[float] = None) -> List[List[Document]]:
+        return await run_in_thread(self.rerank_many, queries, docs, top_k, min_score)
+
+
+_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    """
+    Return the process-wide reranker, configured from environment variables.
+    """
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = Reranker(
+                    model_name=getEnvVariable("RERANK_MODEL", DEFAULT_RERANK_MODEL),
+                    backend=getEnvVariable("RERANK_BACKEND", "torch"),
+                    batch_size=int(getEnvVariable("RERANK_BATCH_SIZE", "32")),
+                    cache_size=int(getEnvVariable("RERANK_CACHE_SIZE", "4096")),
+                )
+    return _reranker
+
+
+def rerank_enabled() -> bool:
+    return getEnvVariable("RERANK_ENABLED", "false") == "true"
+
+
+def rerank_settings() -> dict:
+    """
+    Retriever fields of the rerank stage: empty when RERANK_ENABLED is off,
+    otherwise the shared reranker, the number of candidates it scores and the cutoff.
+    """
+    if not rerank_enabled():
+        return {}
+    min_score = getEnvVariable("RERANK_MIN_SCORE")
+    return {
+        "reranker": get_reranker(),
+        "rerank_candidates": int(getEnvVariable("RERANK_CANDIDATES", "20")),
+        "rerank_min_score": float(min_score) if min_score else None,
+    }
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+from app.src.utils import count_tokens, getEnvVariable, run_in_thread
+from .chains import asummarize_conversation
+
+logger = logging.getLogger(__name__)
+
+Turn = Tuple[str, str]  # (question, answer)
+
+
+@dataclass
+class SessionState:
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+
+
+class InMemorySessionStore:
+    """
+    Sessions kept in process; the least recently used sessions are evicted
+    beyond `max_sessions`, and idle sessions expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 86400.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Tuple[SessionState, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> SessionState:
+        with self._lock:
+            return self._get(session_id)
+
+    def update(self, session_id: str, apply: Callable[[SessionState], None]):
+        """
+        Atomically apply a change to the session.
+        """
+        with self._lock:
+            state = self._get(session_id)
+            apply(state)
+            self._sessions[session_id] = (state, time.time())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _get(self, session_id: str) -> SessionState:
+        entry = self._sessions.get(session_id)
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            return SessionState()
+        self._sessions.move_to_end(session_id)
+        return SessionState(entry[0].summary, list(entry[0].turns))
+
+
+class SQLiteSessionStore:
+    """
+    Sessions persisted in a SQLite file, shared by workers and kept across restarts.
+    Sessions idle for more than `ttl` seconds are treated as empty and purged when
+    the file is opened, which happens on first use rather than on import.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with the lock held
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(session_id TEXT PRIMARY KEY, summary TEXT, turns TEXT, updated REAL)"
+            )
+            db.execute("DELETE FROM sessions WHERE updated <= ?", (time.time() - self.ttl,))
+            db.commit()
+            self._db = db
+        return self._db
+
+    def get(self, session_id: str) -> SessionState:
+        with self._lock:
+            return self._get(session_id)
+
+    def update(self, session_id: str, apply: Callable[[SessionState], None]):
+        """
+        Atomically apply a change to the session (also across processes sharing the file).
+        """
+        with self._lock:
+            db = self._connection()
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                state = self._get(session_id)
+                apply(state)
+                db.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, summary, turns, updated) VALUES (?, ?, ?, ?)",
+                    (session_id, state.summary, json.dumps(state.turns, ensure_ascii=False), time.time()),
+                )
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+    def _get(self, session_id: str) -> SessionState:
+        row = self._connection().execute(
+            "SELECT summary, turns FROM sessions WHERE session_id = ? AND updated > ?",
+            (session_id, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return SessionState()
+        return SessionState(row[0], [tuple(turn) for turn in json.loads(row[1])])
+
+
+def _format_turns(turns: List[Turn]) -> str:
+    return "\n".join(f"Human: {question}\nAI: {answer}" for question, answer in turns)
+
+
+class SessionMemory:
+    """
+    Conversation history per session.
+
+    The prompt history is the running summary of older turns followed by the
+    most recent turns that fit into `max_tokens`. Turns are recorded as soon as
+    an answer is produced; folding the turns that no longer fit into the
+    summary (one LLM call) is done by `compact`, which the API schedules after
+    the response has been sent, so it never adds latency to a chat.
+    """
+
+    def __init__(self, store, max_tokens: int = 1000):
+        self.store = store
+        self.max_tokens = max_tokens
+        # One lock per session being compacted; dropped once no coroutine holds it
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def history(self, session_id: Optional[str]) -> str:
+        """
+        Return the chat history of the session formatted for the prompt.
+        """
+        if not session_id:
+            return ""
+        state = self.store.get(session_id)
+        _, recent = self._split_window(state)
+        parts = []
+        if state.summary:
+            parts.append(f"Summary of the earlier conversation: {state.summary}")
+        if recent:
+            parts.append(_format_turns(recent))
+        return "\n".join(parts)
+
+    def add_turn(self, session_id: Optional[str], question: str, answer: str):
+        """
+        Append a question/answer turn to the session.
+        """
+        if not session_id:
+            return
+        self.store.update(session_id, lambda state: state.turns.append((question, answer)))
+
+    async def compact(self, session_id: Optional[str]):
+        """
+        Fold the turns that fall outside the token window into the summary.
+        """
+        if not session_id:
+            return
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        async with lock:
+            try:
+                state = await run_in_thread(self.store.get, session_id)
+                overflow, _ = self._split_window(state)
+                if not overflow:
+                    return
+                summary = (await asummarize_conversation(state.summary, _format_turns(overflow))).strip()
+
+                def apply(state: SessionState):
+                    # Turns may have been added meanwhile; only drop the ones that were summarized
+                    state.summary = summary
+                    state.turns = state.turns[len(overflow):]
+
+                await run_in_thread(self.store.update, session_id, apply)
+            except Exception as e:
+                logger.exception("Error summarizing session %s: %s", session_id, e)
+
+    def _split_window(self, state: SessionState) -> Tuple[List[Turn], List[Turn]]:
+        # Keep the most recent turns whose total size fits the budget (at least the last one)
+        budget = self.max_tokens - count_tokens(state.summary)
+        kept = 0
+        for question, answer in reversed(state.turns):
+            budget -= count_tokens(f"Human: {question}\nAI: {answer}")
+            if budget < 0 and kept:
+                break
+            kept += 1
+        split = len(state.turns) - kept
+        return state.turns[:split], state.turns[split:]
+
+
+def _create_store():
+    ttl = float(getEnvVariable("SESSION_TTL", "86400"))
+    if getEnvVariable("SESSION_STORE", "memory") == "sqlite":
+        return SQLiteSessionStore(getEnvVariable("SESSION_STORE_PATH", "sessions.db"), ttl=ttl)
+    return InMemorySessionStore(max_sessions=int(getEnvVariable("SESSION_MAX_SESSIONS", "10000")), ttl=ttl)
+
+
+session_memory = SessionMemory(_create_store(), max_tokens=int(getEnvVariable("SESSION_HISTORY_TOKENS", "1000")))
@@ -0,0 +1,109 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+from app.src.utils import getEnvVariable
+from .embedding_service import get_embedding_service
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class TopicEmbeddingCache:
+    """
+    Per-collection matrix of normalized topic embeddings.
+
+    In "label" mode each row is the embedding of the topic label; in
+    "centroid" mode it is the mean embedding of the topic's chunks. The matrix
+    is rebuilt when the topic list changes (a new topic was uploaded), and
+    centroids are updated incrementally from uploaded chunk vectors.
+    """
+
+    def __init__(self, mode: str = "label"):
+        if mode not in ("label", "centroid"):
+            raise ValueError(f"Unknown topic detection mode: {mode}")
+        self.mode = mode
+        self._matrices: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        # collection -> topic -> (sum of chunk vectors, number of chunks)
+        self._centroids: Dict[str, Dict[str, Tuple[np.ndarray, int]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, labels: List[str], collection_name: Optional[str] = None,
+            client: Optional[QdrantClient] = None) -> Tuple[List[str], np.ndarray]:
+        """
+        Return (labels, normalized matrix) for the collection, building it if the labels changed.
+        """
+        key = collection_name or "\0" + "\0".join(sorted(labels))
+        with self._lock:
+            entry = self._matrices.get(key)
+            if entry is not None and entry[0] == sorted(labels):
+                return entry
+        labels = sorted(labels)
+        if self.mode == "centroid" and collection_name and client is not None:
+            matrix = self._centroid_matrix(client, collection_name, labels)
+        else:
+            matrix = get_embedding_service().encode_batch([f"passage: {label}" for label in labels])
+        entry = (labels, _normalize(np.asarray(matrix, dtype=np.float32)))
+        with self._lock:
+            self._matrices[key] = entry
+        return entry
+
+    def match(self, query_vector: np.ndarray, labels: List[str], collection_name: Optional[str] = None,
+              client: Optional[QdrantClient] = None) -> Optional[str]:
+        """
+        Return the label closest to the query embedding (one matrix-vector product).
+        """
+        if not labels:
+            return None
+        labels, matrix = self.get(labels, collection_name, client)
+        scores = matrix @ _normalize(np.asarray(query_vector, dtype=np.float32))
+        return labels[int(scores.argmax())]
+
+    def add_vectors(self, collection_name: str, topic: str, vectors: List[List[float]]):
+        """
+        Fold newly uploaded chunk vectors into the topic centroid and drop the cached matrix.
+        """
+        with self._lock:
+            self._matrices.pop(collection_name, None)
+            centroids = self._centroids.get(collection_name)
+            if centroids is None or not len(vectors):
+                # Not loaded yet; the next centroid build scans the collection
+                return
+            total, count = centroids.get(topic, (0.0, 0))
+            centroids[topic] = (total + np.asarray(vectors, dtype=np.float32).sum(axis=0), count + len(vectors))
+
+    def invalidate(self, collection_name: str):
+        with self._lock:
+            self._matrices.pop(collection_name, None)
+            self._centroids.pop(collection_name, None)
+
+    def _centroid_matrix(self, client: QdrantClient, collection_name: str, labels: List[str]) -> np.ndarray:
+        from app.src.qdrant import scroll_points
+
+        with self._lock:
+            centroids = self._centroids.get(collection_name)
+        if centroids is None:
+            centroids = {}
+            for page in scroll_points(client, collection_name, payload_fields=["topic"], with_vectors=True):
+                for point in page:
+                    topic = (point.payload or {}).get("topic")
+                    if not topic:
+                        continue
+                    vector = point.vector.get("", None) if isinstance(point.vector, dict) else point.vector
+                    total, count = centroids.get(topic, (0.0, 0))
+                    centroids[topic] = (total + np.asarray(vector, dtype=np.float32), count + 1)
+            with self._lock:
+                self._centroids[collection_name] = centroids
+        missing = [label for label in labels if label not in centroids]
+        label_vectors = dict(zip(missing, get_embedding_service().encode_batch([f"passage: {label}" for label in missing]))) if missing else {}
+        return np.stack([
+            centroids[label][0] / centroids[label][1] if label in centroids else label_vectors[label]
+            for label in labels
+        ])
+
+
+topic_embeddings = TopicEmbeddingCache(mode=getEnvVariable("TOPIC_DETECTION_MODE", "label"))
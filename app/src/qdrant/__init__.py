@@ -1,10 +1,22 @@
 from .qbrant_service import (
     init_collection,
     add_text,
+    aadd_text,
+    existing_ids,
+    aexisting_ids,
+    collection_version,
     search_text,
     delete_collection,
     get_available_topics,
-    get_all_texts_from_qdrant
+    get_all_texts_from_qdrant,
+    scroll_points
 )
+from .topic_registry import TopicRegistry, topic_registry
 from .standard_retriever import StandardRetriever
-from .hybrid_retriever import HybridRetriever
\ No newline at end of file
+from .hybrid_retriever import HybridRetriever
+from .fusion import fuse, top_k_indices, FUSION_STRATEGIES
+from .profiles import CollectionProfile, PROFILES, get_profile, apply_profile, collection_search_params, acollection_search_params
+from .collection_info import CollectionInfoCache, CollectionVersions, collection_infos, collection_versions
+from .sparse import SPARSE_VECTOR_NAME, sparse_vector, sparse_query, has_sparse_vectors, ahas_sparse_vectors
+from .bm25_index import BM25Index, get_bm25_index, add_to_bm25_index, drop_bm25_index
+from .client import create_qdrant_client, create_async_qdrant_client, is_embedded_client
\ No newline at end of file
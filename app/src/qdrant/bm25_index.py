@@ -0,0 +1,441 @@
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+from app.src.utils import getEnvVariable
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are only serialized within the process
+    fcntl = None
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenizer shared by indexing and querying (same as the previous BM25Okapi setup).
+    """
+    return text.lower().split()
+
+
+class _Segment:
+    """
+    Immutable block of postings in CSR layout.
+
+    `offsets[t]:offsets[t + 1]` is the slice of `docs`/`tfs` belonging to the
+    t-th term of `terms`. Doc numbers are local to the segment and sorted, so
+    adding `base` gives sorted global doc numbers.
+    """
+
+    def __init__(self, name: str, base: int, doc_ids: List[str], doc_len: np.ndarray,
+                 terms: List[str], offsets: np.ndarray, docs: np.ndarray, tfs: np.ndarray):
+        self.name = name
+        self.base = base
+        self.doc_ids = doc_ids
+        self.doc_len = doc_len
+        self.term_index = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+
+    @classmethod
+    def build(cls, name: str, base: int, doc_ids: List[str], tokenized: List[List[str]]) -> "_Segment":
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for local, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                term_docs, term_tfs = postings.setdefault(term, ([], []))
+                term_docs.append(local)
+                term_tfs.append(tf)
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term][0])
+        docs = np.fromiter((d for term in terms for d in postings[term][0]), dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((f for term in terms for f in postings[term][1]), dtype=np.int32, count=int(offsets[-1]))
+        doc_len = np.array([len(tokens) for tokens in tokenized], dtype=np.int32)
+        return cls(name, base, list(doc_ids), doc_len, terms, offsets, docs, tfs)
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        i = self.term_index.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end] + self.base, self.tfs[start:end]
+
+    def document_frequencies(self) -> Iterable[Tuple[str, int]]:
+        counts = np.diff(self.offsets)
+        return ((term, int(counts[i])) for term, i in self.term_index.items())
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "docs.npy"), self.docs)
+        np.save(os.path.join(directory, "tfs.npy"), self.tfs)
+        np.save(os.path.join(directory, "doc_len.npy"), self.doc_len)
+        terms = sorted(self.term_index, key=self.term_index.get)
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"base": self.base, "doc_ids": self.doc_ids, "terms": terms}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, name: str, directory: str, mmap: bool) -> "_Segment":
+        mode = "r" if mmap else None
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            name=name,
+            base=meta["base"],
+            doc_ids=meta["doc_ids"],
+            doc_len=np.load(os.path.join(directory, "doc_len.npy")),
+            terms=meta["terms"],
+            offsets=np.load(os.path.join(directory, "offsets.npy")),
+            docs=np.load(os.path.join(directory, "docs.npy"), mmap_mode=mode),
+            tfs=np.load(os.path.join(directory, "tfs.npy"), mmap_mode=mode),
+        )
+
+
+class BM25Index:
+    """
+    Segmented BM25 inverted index for one collection.
+
+    Every `add_documents` call appends a new segment instead of rebuilding the
+    index; segments are merged once there are more than `max_segments` (when
+    saving, for a persisted index).
+    Postings live in NumPy arrays and are memory-mapped when loaded from disk.
+    `search` uses term-at-a-time MaxScore pruning, so only the postings of the
+    query terms are read, never the whole corpus.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75,
+                 mmap: bool = True, max_segments: int = 8):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.mmap = mmap
+        self.max_segments = max_segments
+        self._segments: List[_Segment] = []
+        self._doc_ids: List[str] = []
+        self._id_set = set()
+        self._df: Counter = Counter()
+        self._doc_len = np.zeros(0, dtype=np.int32)
+        self._total_len = 0
+        self._next_segment = 0
+        self._manifest_mtime: Optional[float] = None
+        # Segments merged away by `_compact`, deleted from disk by the next `save`
+        self._retired: List[str] = []
+        self._lock = threading.RLock()
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._doc_ids)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._id_set
+
+    def _attach(self, segment: _Segment):
+        self._segments.append(segment)
+        self._doc_ids.extend(segment.doc_ids)
+        self._id_set.update(segment.doc_ids)
+        self._doc_len = np.concatenate([self._doc_len, segment.doc_len])
+        self._total_len += int(segment.doc_len.sum())
+        for term, df in segment.document_frequencies():
+            self._df[term] += df
+
+    def _segment_name(self) -> str:
+        # The random suffix keeps names unique when several workers share the directory
+        self._next_segment += 1
+        return f"seg_{self._next_segment:06d}_{uuid.uuid4().hex[:8]}"
+
+    def add_documents(self, ids: List[str], texts: List[str]) -> int:
+        """
+        Index new documents as a new segment. Ids already in the index are skipped.
+
+        Returns:
+            int: Number of documents added.
+        """
+        with self._lock:
+            new = [(doc_id, text) for doc_id, text in dict(zip(ids, texts)).items() if doc_id not in self._id_set]
+            if not new:
+                return 0
+            segment = _Segment.build(
+                name=self._segment_name(),
+                base=self.num_docs,
+                doc_ids=[doc_id for doc_id, _ in new],
+                tokenized=[tokenize(text) for _, text in new],
+            )
+            self._attach(segment)
+            # A persisted index compacts in `save`, after catching up with the other writers
+            if not self.path and len(self._segments) > self.max_segments:
+                self._compact()
+            return len(new)
+
+    def _compact(self):
+        # Rebuild a single segment from the postings of all segments
+        terms = sorted(self._df)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([self._df[term] for term in terms])
+        docs = np.empty(int(offsets[-1]), dtype=np.int32)
+        tfs = np.empty(int(offsets[-1]), dtype=np.int32)
+        for i, term in enumerate(terms):
+            parts = [p for p in (segment.postings(term) for segment in self._segments) if p is not None]
+            docs[offsets[i]:offsets[i + 1]] = np.concatenate([p[0] for p in parts])
+            tfs[offsets[i]:offsets[i + 1]] = np.concatenate([p[1] for p in parts])
+        segment = _Segment(self._segment_name(), 0, list(self._doc_ids), self._doc_len.copy(), terms, offsets, docs, tfs)
+        self._retired.extend(old.name for old in self._segments)
+        self._segments = [segment]
+
+    def _idf(self, df: int) -> float:
+        # Non-negative BM25 idf; required for the MaxScore upper bounds
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def _term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        parts = [p for p in (segment.postings(term) for segment in self._segments) if p is not None]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def _term_scores(self, docs: np.ndarray, tfs: np.ndarray, idf: float, avgdl: float) -> np.ndarray:
+        tfs = tfs.astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self._doc_len[docs] / avgdl)
+        return idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """
+        Return the top-k (doc_id, score) pairs for the query, best first.
+        """
+        with self._lock:
+            return self._search(query, k, {})
+
+    def search_many(self, queries: List[str], k: int = 20) -> List[List[Tuple[str, float]]]:
+        """
+        `search` for several queries in one pass: the index is locked once and
+        the postings of terms shared by the queries are gathered once.
+        """
+        with self._lock:
+            postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+            return [self._search(query, k, postings) for query in queries]
+
+    def _search(self, query: str, k: int, postings: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> List[Tuple[str, float]]:
+        if not self.num_docs or k <= 0:
+            return []
+        avgdl = self._total_len / self.num_docs or 1.0
+        query_terms = [(term, qtf) for term, qtf in Counter(tokenize(query)).items() if self._df.get(term)]
+        if not query_terms:
+            return []
+        # Upper bound of a term's contribution: tf * (k1 + 1) / (tf + norm) < k1 + 1
+        terms = sorted(
+            ((term, qtf * self._idf(self._df[term])) for term, qtf in query_terms),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+        bounds = np.array([weight * (self.k1 + 1) for _, weight in terms])
+        remaining = np.concatenate([np.cumsum(bounds[::-1])[::-1], [0.0]])
+
+        acc_docs = np.zeros(0, dtype=np.int64)
+        acc_scores = np.zeros(0, dtype=np.float32)
+        for i, (term, weight) in enumerate(terms):
+            if len(acc_docs) >= k:
+                threshold = np.partition(acc_scores, -k)[-k]
+                if remaining[i] <= threshold:
+                    # No unseen document can still reach the top-k: only refine candidates
+                    keep = acc_scores + remaining[i] > threshold
+                    acc_docs, acc_scores = acc_docs[keep], acc_scores[keep]
+                    for rest_term, rest_weight in terms[i:]:
+                        docs, tfs = self._cached_postings(rest_term, postings)
+                        pos = np.searchsorted(docs, acc_docs)
+                        pos[pos >= len(docs)] = 0
+                        hit = docs[pos] == acc_docs
+                        acc_scores[hit] += self._term_scores(acc_docs[hit], tfs[pos[hit]], rest_weight, avgdl)
+                    break
+            docs, tfs = self._cached_postings(term, postings)
+            scores = self._term_scores(docs, tfs, weight, avgdl)
+            merged, inverse = np.unique(np.concatenate([acc_docs, docs]), return_inverse=True)
+            acc_scores = np.bincount(inverse, weights=np.concatenate([acc_scores, scores]), minlength=len(merged)).astype(np.float32)
+            acc_docs = merged
+
+        top = np.argpartition(-acc_scores, k - 1)[:k] if len(acc_scores) > k else np.arange(len(acc_scores))
+        top = top[np.argsort(-acc_scores[top])]
+        return [(self._doc_ids[acc_docs[i]], float(acc_scores[i])) for i in top]
+
+    def _cached_postings(self, term: str, postings: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        if term not in postings:
+            postings[term] = self._term_postings(term)
+        return postings[term]
+
+    def save(self):
+        """
+        Persist new segments and the manifest. Existing segment files are never rewritten.
+
+        Saves of processes sharing the directory are serialized with a file lock.
+        When another worker (or `bulk_ingest`) saved in between, its segments are
+        loaded first and the segments added here since the last save are put on
+        top, so neither loses the other's documents. Only the segments this
+        instance merged away are deleted.
+        """
+        if not self.path:
+            return
+        with self._lock, _locked(self.path):
+            if self.is_stale():
+                self._catch_up()
+            if len(self._segments) > self.max_segments:
+                self._compact()
+            for segment in self._segments:
+                directory = os.path.join(self.path, segment.name)
+                if not os.path.exists(directory):
+                    segment.save(directory)
+            manifest = {
+                "k1": self.k1,
+                "b": self.b,
+                "next_segment": self._next_segment,
+                "segments": [segment.name for segment in self._segments],
+            }
+            tmp = os.path.join(self.path, MANIFEST_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, os.path.join(self.path, MANIFEST_FILE))
+            self._manifest_mtime = os.path.getmtime(os.path.join(self.path, MANIFEST_FILE))
+            # Remove the segments this instance merged away
+            for name in self._retired:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            self._retired = []
+
+    def _catch_up(self):
+        # Adopt the saved index, then re-attach the segments not saved yet (documents added since the last save)
+        saved = BM25Index.load(self.path, mmap=self.mmap, max_segments=self.max_segments)
+        unsaved = [segment for segment in self._segments if not os.path.exists(os.path.join(self.path, segment.name))]
+        self._segments, self._doc_ids, self._id_set = [], [], set()
+        self._df, self._doc_len, self._total_len = Counter(), np.zeros(0, dtype=np.int32), 0
+        for segment in saved._segments:
+            self._attach(segment)
+        for segment in unsaved:
+            if self._id_set.issuperset(segment.doc_ids):
+                continue  # Indexed by the other writer as well
+            segment.base = self.num_docs
+            self._attach(segment)
+        self._next_segment = max(self._next_segment, saved._next_segment)
+        self._manifest_mtime = saved._manifest_mtime
+        self._retired = []
+
+    def refresh(self):
+        """
+        Load the segments another process saved since this instance last read or
+        wrote the directory, keeping the documents added here and not saved yet.
+        """
+        if not self.path:
+            return
+        with self._lock, _locked(self.path):
+            if self.is_stale():
+                self._catch_up()
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, max_segments: int = 8) -> "BM25Index":
+        """
+        Load an index persisted with `save`.
+        """
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        index = cls(path=path, k1=manifest["k1"], b=manifest["b"], mmap=mmap, max_segments=max_segments)
+        for name in manifest["segments"]:
+            index._attach(_Segment.load(name, os.path.join(path, name), mmap))
+        index._next_segment = manifest["next_segment"]
+        index._manifest_mtime = os.path.getmtime(os.path.join(path, MANIFEST_FILE))
+        return index
+
+    def is_stale(self) -> bool:
+        """
+        Whether another process has saved a newer version of this index.
+        """
+        if not self.path:
+            return False
+        manifest = os.path.join(self.path, MANIFEST_FILE)
+        return os.path.exists(manifest) and os.path.getmtime(manifest) != self._manifest_mtime
+
+
+@contextmanager
+def _locked(path: str):
+    # Exclusive lock on the index directory, held across processes
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, LOCK_FILE), "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_indexes: Dict[str, BM25Index] = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_path(collection_name: str) -> str:
+    # Characters other than letters, digits, "_" and "-" are escaped, so the name
+    # cannot leave BM25_INDEX_DIR ("..", "/") and distinct names keep distinct directories
+    directory = re.sub(r"[^\w-]", lambda match: "%{:02x}".format(ord(match.group())), collection_name)
+    if not directory:
+        raise ValueError("Empty collection name")
+    return os.path.join(getEnvVariable("BM25_INDEX_DIR", "bm25_index"), directory)
+
+
+def get_bm25_index(client: QdrantClient, collection_name: str) -> BM25Index:
+    """
+    Return the BM25 index of a collection.
+    Loaded from disk when persisted, otherwise built once from the Qdrant collection.
+    """
+    from .qbrant_service import get_all_texts_from_qdrant
+
+    with _indexes_lock:
+        index = _indexes.get(collection_name)
+        if index is not None:
+            if index.is_stale():
+                # Catch up in place: a new instance would lose segments added but not saved yet
+                index.refresh()
+            return index
+        path = _index_path(collection_name)
+        mmap = getEnvVariable("BM25_INDEX_MMAP", "true") == "true"
+        if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            index = BM25Index.load(path, mmap=mmap)
+        else:
+            index = BM25Index(path=path, mmap=mmap)
+            pairs = get_all_texts_from_qdrant(client, collection_name)
+            index.add_documents([doc_id for doc_id, _ in pairs], [text for _, text in pairs])
+            index.save()
+        _indexes[collection_name] = index
+        return index
+
+
+def add_to_bm25_index(client: QdrantClient, collection_name: str, ids: List[str], chunks: List[str]):
+    """
+    Incrementally index newly uploaded chunks and persist the new segment.
+    """
+    index = get_bm25_index(client, collection_name)
+    if index.add_documents(ids, chunks):
+        index.save()
+
+
+def drop_bm25_index(collection_name: str):
+    """
+    Forget the BM25 index of a deleted collection and remove it from disk, so a
+    collection created later with the same name starts from an empty index.
+    """
+    with _indexes_lock:
+        _indexes.pop(collection_name, None)
+        path = _index_path(collection_name)
+        if os.path.isdir(path):
+            with _locked(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,97 @@
+import json
+from typing import Any, Dict, Optional
+
+import httpx
+from qdrant_client import AsyncQdrantClient, QdrantClient
+
+from app.src.utils import getEnvVariable
+
+
+def _grpc_options(retries: int) -> Dict[str, Any]:
+    # Retry transient UNAVAILABLE errors at the channel level and keep connections warm
+    service_config = {
+        "methodConfig": [{
+            "name": [{}],
+            "retryPolicy": {
+                "maxAttempts": max(retries + 1, 2),
+                "initialBackoff": "0.1s",
+                "maxBackoff": "2s",
+                "backoffMultiplier": 2,
+                "retryableStatusCodes": ["UNAVAILABLE"],
+            },
+        }]
+    }
+    return {
+        "grpc.enable_retries": 1,
+        "grpc.service_config": json.dumps(service_config),
+        "grpc.keepalive_time_ms": 30_000,
+    }
+
+
+def qdrant_client_settings() -> Dict[str, Any]:
+    """
+    Read the Qdrant connection settings from environment variables.
+    """
+    return {
+        "location": getEnvVariable("QDRANT_LOCATION"),  # ":memory:" or a local path for embedded mode
+        "host": getEnvVariable("QDRANT_HOST", "localhost"),
+        "port": int(getEnvVariable("QDRANT_PORT", "6333")),
+        "grpc_port": int(getEnvVariable("QDRANT_GRPC_PORT", "6334")),
+        "prefer_grpc": getEnvVariable("QDRANT_PREFER_GRPC", "false") == "true",
+        "https": getEnvVariable("QDRANT_HTTPS", "false") == "true",
+        "api_key": getEnvVariable("QDRANT_API_KEY"),
+        "timeout": int(getEnvVariable("QDRANT_TIMEOUT", "10")),
+        "pool_size": int(getEnvVariable("QDRANT_POOL_SIZE", "32")),
+        "retries": int(getEnvVariable("QDRANT_RETRIES", "3")),
+    }
+
+
+def _client_kwargs(settings: Dict[str, Any], transport: Any) -> Dict[str, Any]:
+    if settings["location"] == ":memory:":
+        return {"location": settings["location"]}
+    if settings["location"]:
+        return {"path": settings["location"]}
+    return {
+        "host": settings["host"],
+        "port": settings["port"],
+        "grpc_port": settings["grpc_port"],
+        "prefer_grpc": settings["prefer_grpc"],
+        "https": settings["https"],
+        "api_key": settings["api_key"],
+        "timeout": settings["timeout"],
+        "grpc_options": _grpc_options(settings["retries"]),
+        # Forwarded to the httpx client of the REST transport
+        "transport": transport,
+    }
+
+
+def is_embedded_client(client: QdrantClient) -> bool:
+    """
+    True for an embedded (":memory:" or on-disk) client, which must not be used from several threads at once.
+    """
+    options = getattr(client, "init_options", {}) or {}
+    return bool(options.get("location") == ":memory:" or options.get("path"))
+
+
+def create_qdrant_client() -> QdrantClient:
+    """
+    Create the shared sync Qdrant client with a bounded keep-alive connection pool.
+    """
+    settings = qdrant_client_settings()
+    limits = httpx.Limits(max_connections=settings["pool_size"], max_keepalive_connections=settings["pool_size"])
+    transport = httpx.HTTPTransport(limits=limits, retries=settings["retries"])
+    return QdrantClient(**_client_kwargs(settings, transport))
+
+
+def create_async_qdrant_client() -> Optional[AsyncQdrantClient]:
+    """
+    Create the shared async Qdrant client with a bounded keep-alive connection pool.
+    Returns None in embedded mode, where the storage can only be opened by one client;
+    the retrievers then run the sync client in the thread pool.
+    """
+    settings = qdrant_client_settings()
+    if settings["location"]:
+        return None
+    limits = httpx.Limits(max_connections=settings["pool_size"], max_keepalive_connections=settings["pool_size"])
+    transport = httpx.AsyncHTTPTransport(limits=limits, retries=settings["retries"])
+    return AsyncQdrantClient(**_client_kwargs(settings, transport))
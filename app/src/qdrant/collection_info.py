@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import CollectionInfo
+
+from app.src.utils import getEnvVariable
+
+
+class CollectionInfoCache:
+    """
+    Per-collection cache of `get_collection`, used to decide how a collection
+    is searched (sparse vectors, profile search parameters). Entries are
+    dropped when this process creates, migrates or deletes the collection,
+    and refreshed after `ttl` seconds so changes made by other processes
+    (`migrate_collection`, `bulk_ingest --serving-profile`, other workers)
+    show up too.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._infos: Dict[str, Tuple[CollectionInfo, float]] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, collection_name: str) -> Optional[CollectionInfo]:
+        with self._lock:
+            entry = self._infos.get(collection_name)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def _store(self, collection_name: str, info: CollectionInfo) -> CollectionInfo:
+        with self._lock:
+            self._infos[collection_name] = (info, time.monotonic())
+        return info
+
+    def get(self, client: QdrantClient, collection_name: str) -> Optional[CollectionInfo]:
+        """
+        Return the collection info, or None if the collection does not exist.
+        """
+        info = self._cached(collection_name)
+        if info is not None:
+            return info
+        if not client.collection_exists(collection_name):
+            self.invalidate(collection_name)
+            return None
+        return self._store(collection_name, client.get_collection(collection_name))
+
+    async def aget(self, client: AsyncQdrantClient, collection_name: str) -> Optional[CollectionInfo]:
+        """
+        Async variant of `get`.
+        """
+        info = self._cached(collection_name)
+        if info is not None:
+            return info
+        if not await client.collection_exists(collection_name):
+            self.invalidate(collection_name)
+            return None
+        return self._store(collection_name, await client.get_collection(collection_name))
+
+    def invalidate(self, collection_name: str):
+        with self._lock:
+            self._infos.pop(collection_name, None)
+
+
+class CollectionVersions:
+    """
+    Per-collection cache of the exact number of points, the version answers
+    are cached under. Writes made by this process drop the entry; writes made
+    by other processes show up after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._versions: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, client: QdrantClient, collection_name: str) -> int:
+        with self._lock:
+            entry = self._versions.get(collection_name)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        if collection_infos.get(client, collection_name) is None:
+            version = 0
+        else:
+            version = client.count(collection_name, exact=True).count
+        with self._lock:
+            self._versions[collection_name] = (version, time.monotonic())
+        return version
+
+    def invalidate(self, collection_name: str):
+        with self._lock:
+            self._versions.pop(collection_name, None)
+
+
+collection_infos = CollectionInfoCache(ttl=float(getEnvVariable("COLLECTION_INFO_TTL", "30")))
+collection_versions = CollectionVersions(ttl=float(getEnvVariable("COLLECTION_VERSION_TTL", "5")))
@@ -0,0 +1,89 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+FUSION_STRATEGIES = ("minmax", "zscore", "rrf")
+
+
+def _minmax(scores: np.ndarray) -> np.ndarray:
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def _zscore(scores: np.ndarray) -> np.ndarray:
+    std = scores.std()
+    if std < 1e-12:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+def _rrf(scores: np.ndarray, k: int) -> np.ndarray:
+    # Rank 1 for the best score
+    ranks = np.empty(len(scores), dtype=np.float64)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(1, len(scores) + 1)
+    return 1.0 / (k + ranks)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores in descending order (argpartition, then a sort of k items).
+    """
+    if k <= 0 or not len(scores):
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def fuse(ranked_lists: Sequence[Tuple[Sequence[str], Sequence[float]]], weights: Sequence[float], top_k: int,
+         strategy: str = "minmax", rrf_k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse the candidate lists of several retrievers into one ranking.
+
+    Only the given candidates (the top-N of each retriever) are scored, so the
+    cost depends on N, not on the corpus size. Scores of each list are
+    normalized on their own ("minmax" to [0, 1], "zscore" to mean 0 / std 1, or
+    replaced by reciprocal ranks for "rrf") and combined with `weights`. A
+    candidate missing from a list gets that list's lowest normalized score
+    (0 for RRF).
+
+    Args:
+        ranked_lists: One (ids, scores) pair per retriever; higher scores are better.
+        weights: Weight of each retriever.
+        top_k: Number of results.
+        strategy: "minmax", "zscore" or "rrf".
+        rrf_k: Rank offset of reciprocal rank fusion.
+
+    Returns:
+        List[Tuple[str, float]]: (id, fused score) in descending order.
+    """
+    if strategy not in FUSION_STRATEGIES:
+        raise ValueError(f"Unknown fusion strategy: {strategy}")
+    positions: Dict[str, int] = {}
+    for ids, _ in ranked_lists:
+        for doc_id in ids:
+            positions.setdefault(doc_id, len(positions))
+    if not positions:
+        return []
+
+    fused = np.zeros(len(positions), dtype=np.float64)
+    for (ids, scores), weight in zip(ranked_lists, weights):
+        if not len(ids):
+            continue
+        scores = np.asarray(scores, dtype=np.float64)
+        if strategy == "minmax":
+            normalized = _minmax(scores)
+        elif strategy == "zscore":
+            normalized = _zscore(scores)
+        else:
+            normalized = _rrf(scores, rrf_k)
+        column = np.full(len(positions), 0.0 if strategy == "rrf" else normalized.min())
+        column[[positions[doc_id] for doc_id in ids]] = normalized
+        fused += weight * column
+
+    ids = list(positions)
+    return [(ids[i], float(fused[i])) for i in top_k_indices(fused, top_k)]
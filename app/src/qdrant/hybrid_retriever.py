@@ -1,84 +1,244 @@
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from rank_bm25 import BM25Okapi
-from typing import List, Callable, Optional
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import Filter, FieldCondition, MatchValue, Prefetch, FusionQuery, Fusion, QueryRequest, SearchParams
+from typing import Any, Awaitable, List, Callable, Optional, Sequence, Tuple
 from pydantic import BaseModel
-import numpy as np
+from app.src.utils import metrics, run_in_thread, span
+from .bm25_index import BM25Index
+from .fusion import fuse
+from .topic_registry import TOPIC_FIELD
+from .sparse import SPARSE_VECTOR_NAME, sparse_query
+
+retrieved_chunks = metrics.counter("rag_retrieved_chunks_total", "Chunks fetched by the retrievers (before reranking)", ["retriever"])
 
 class HybridRetriever(BaseRetriever, BaseModel):
+    """
+    Dense + keyword retrieval.
+
+    Without `bm25_index` (collections with sparse vectors) both searches run in
+    Qdrant as one query: a dense and a sparse prefetch, each filtered by topic,
+    fused server-side (RRF, or DBSF for the score-based strategies). With a
+    `bm25_index` (older collections) keyword search runs locally, keyword
+    hits of other topics are dropped, and the candidates are fused with `fuse`. With a `reranker`, `rerank_candidates`
+    fused candidates are rescored by the cross-encoder in one batch and the
+    best `top_k` are kept.
+    """
     client: QdrantClient
     collection_name: str
     embed_fn: Callable[[List[str]], List[List[float]]]
-    bm25_corpus: List[str]  # Raw texts for BM25
-    bm25_ids: List[str]  # IDs corresponding to the BM25 corpus
+    async_client: Optional[AsyncQdrantClient] = None  # Used by the async path when provided
+    aembed_fn: Optional[Callable[[List[str]], Awaitable[List[List[float]]]]] = None
+    bm25_index: Optional[BM25Index] = None  # Local keyword index, for collections without sparse vectors
     topic: Optional[str] = None
     top_k: int = 5
+    vector_top_n: int = 20  # Number of vector candidates taken from Qdrant
+    bm25_top_n: int = 20  # Number of keyword candidates taken from the index
+    bm25_topic_oversample: int = 4  # With a topic, candidates taken per kept one (the index has no topics)
     alpha: float = 0.5  # Weight for vector vs. keyword search
-    bm25_id_map: dict = {}  # Map of BM25 IDs to texts
+    fusion: str = "minmax"  # Score fusion strategy: "minmax", "zscore" or "rrf"
+    rrf_k: int = 60  # Rank offset of reciprocal rank fusion
+    search_params: Optional[SearchParams] = None  # Search-time settings of the collection profile
+    reranker: Optional[Any] = None  # Cross-encoder stage (app.src.process.Reranker); None disables it
+    rerank_candidates: int = 20  # Fused candidates passed to the reranker, which keeps the best `top_k`
+    rerank_min_score: Optional[float] = None  # Candidates the reranker scores below this are dropped
 
-    def __init__(self, **data):
-        super().__init__(**data)
-        # Tokenize for BM25 index
-        self._bm25_tokenized = [doc.lower().split() for doc in self.bm25_corpus]
-        self._bm25 = BM25Okapi(self._bm25_tokenized)
-        self.bm25_id_map = dict(zip(self.bm25_ids, self.bm25_corpus))
-
-    def _get_filter(self):
-        if self.topic:
+    def _get_filter(self, topic: Optional[str] = None):
+        topic = topic or self.topic
+        if topic:
             return Filter(
                 must=[
                     FieldCondition(
                         key="topic",
-                        match=MatchValue(value=self.topic)
+                        match=MatchValue(value=topic)
                     )
                 ]
             )
         return None
     
-    def _get_relevant_documents(self, query: str) -> List[Document]:
-        # ====== 1. Vector Search with Qdrant ======
-        vector = self.embed_fn([f"passage: {query}"])[0]
-        vector_hits = self.client.search(
+    def _search_kwargs(self, vector) -> dict:
+        return dict(
             collection_name=self.collection_name,
             query_vector=vector,
-            limit=20,
+            limit=self.vector_top_n,
             query_filter=self._get_filter(),
+            search_params=self.search_params,
             with_payload=True,
         )
-        vector_scores = {
-            hit.payload["id"]: 1 - hit.score  # id → similarity
-            for hit in vector_hits if "id" in hit.payload
-        }
-        id_to_text = {
-            hit.payload["id"]: hit.payload.get("text", "")
-            for hit in vector_hits if "id" in hit.payload
-        }
-
-        # ====== 2. BM25 Search ======
-        bm25_scores = self._bm25.get_scores(query.lower().split())
-        bm25_map = {
-            self.bm25_ids[i]: score for i, score in enumerate(bm25_scores)
-        }  # self.bm25_ids: list of ids in same order as corpus
-
-        # ====== 3. Merge by ID ======
-        all_ids = set(vector_scores.keys()) | set(bm25_map.keys())
-        combined_scores = []
-        for doc_id in all_ids:
-            vec_score = vector_scores.get(doc_id, 0.0)
-            bm25_score = bm25_map.get(doc_id, 0.0)
-            combined = self.alpha * vec_score + (1 - self.alpha) * bm25_score
-            text = id_to_text.get(doc_id, self.bm25_id_map.get(doc_id, ""))
-            combined_scores.append((text, combined, doc_id))
-
-        # ====== 4. Sort and build Document ======
-        top_results = sorted(combined_scores, key=lambda x: x[1], reverse=True)[:self.top_k]
-        docs = [
-            Document(
-                page_content=text,
-                metadata={"score": score, "id": doc_id}
+
+    def _query_kwargs(self, vector, query: str, topic: Optional[str] = None) -> dict:
+        query_filter = self._get_filter(topic)
+        return dict(
+            prefetch=[
+                Prefetch(query=vector, filter=query_filter, params=self.search_params, limit=self.vector_top_n),
+                Prefetch(query=sparse_query(query), using=SPARSE_VECTOR_NAME, filter=query_filter, limit=self.bm25_top_n),
+            ],
+            query=FusionQuery(fusion=Fusion.RRF if self.fusion == "rrf" else Fusion.DBSF),
+            limit=self._fused_k(),
+            with_payload=True,
+        )
+
+    def _fused_k(self) -> int:
+        # Number of fused candidates: the final top_k, or the reranker's input
+        return max(self.rerank_candidates, self.top_k) if self.reranker is not None else self.top_k
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        docs = self._retrieve(query)
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return self.reranker.rerank(query, docs, self.top_k, self.rerank_min_score)
+
+    async def _aget_relevant_documents(self, query: str) -> List[Document]:
+        docs = await self._aretrieve(query)
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return await self.reranker.arerank(query, docs, self.top_k, self.rerank_min_score)
+
+    def _retrieve(self, query: str) -> List[Document]:
+        # ====== 1. Vector Search with Qdrant ======
+        with span("embedding"):
+            vector = self.embed_fn([f"passage: {query}"])[0]
+        if self.bm25_index is None:
+            # ====== Dense + sparse search and fusion in one Qdrant query ======
+            with span("hybrid_search"):
+                response = self.client.query_points(self.collection_name, **self._query_kwargs(vector, query))
+            return [_to_document(str(point.id), point.payload or {}, point.score) for point in response.points]
+        with span("vector_search"):
+            vector_hits = self.client.search(**self._search_kwargs(vector))
+
+        # ====== 2. BM25 Search (top-N only) ======
+        with span("bm25_search"):
+            bm25_hits = self.bm25_index.search(query, k=self._bm25_k([self.topic]))
+        # Fetch texts of keyword-only hits from Qdrant
+        missing_ids = self._missing_ids(vector_hits, bm25_hits)
+        with span("fetch_payloads"):
+            points = self.client.retrieve(self.collection_name, ids=missing_ids, with_payload=True) if missing_ids else []
+        return self._merge(vector_hits, bm25_hits, points)
+
+    async def _aretrieve(self, query: str) -> List[Document]:
+        # ====== 1. Vector Search with Qdrant ======
+        with span("embedding"):
+            if self.aembed_fn is not None:
+                vector = (await self.aembed_fn([f"passage: {query}"]))[0]
+            else:
+                vector = (await run_in_thread(self.embed_fn, [f"passage: {query}"]))[0]
+        if self.bm25_index is None:
+            # ====== Dense + sparse search and fusion in one Qdrant query ======
+            with span("hybrid_search"):
+                if self.async_client is not None:
+                    response = await self.async_client.query_points(self.collection_name, **self._query_kwargs(vector, query))
+                else:
+                    response = await run_in_thread(self.client.query_points, self.collection_name,
+                                                   **self._query_kwargs(vector, query))
+            return [_to_document(str(point.id), point.payload or {}, point.score) for point in response.points]
+        with span("vector_search"):
+            if self.async_client is not None:
+                vector_hits = await self.async_client.search(**self._search_kwargs(vector))
+            else:
+                vector_hits = await run_in_thread(self.client.search, **self._search_kwargs(vector))
+
+        # ====== 2. BM25 Search (top-N only) ======
+        with span("bm25_search"):
+            bm25_hits = await run_in_thread(self.bm25_index.search, query, k=self._bm25_k([self.topic]))
+        missing_ids = self._missing_ids(vector_hits, bm25_hits)
+        points = []
+        with span("fetch_payloads"):
+            if missing_ids and self.async_client is not None:
+                points = await self.async_client.retrieve(self.collection_name, ids=missing_ids, with_payload=True)
+            elif missing_ids:
+                points = await run_in_thread(self.client.retrieve, self.collection_name, ids=missing_ids, with_payload=True)
+        return self._merge(vector_hits, bm25_hits, points)
+
+    async def aretrieve_many(self, queries: List[str], vectors: Sequence[Sequence[float]],
+                             topics: Optional[List[Optional[str]]] = None) -> List[List[Document]]:
+        """
+        Documents of several queries whose vectors are already computed: one
+        `query_batch_points` request for all of them (dense + sparse prefetch
+        per query, or the dense searches when keyword search is local), the
+        local BM25 searches in one pass, one fetch of the keyword-only
+        payloads and, with a reranker, one batch of (query, chunk) pairs.
+        `topics` filters each query (the retriever's topic when None).
+        """
+        topics = topics or [None] * len(queries)
+        vectors = [[float(value) for value in vector] for vector in vectors]
+        if self.bm25_index is None:
+            requests = [QueryRequest(**self._query_kwargs(vector, query, topic))
+                        for query, vector, topic in zip(queries, vectors, topics)]
+            with span("hybrid_search"):
+                responses = await self._aquery_batch(requests)
+            docs = [[_to_document(str(point.id), point.payload or {}, point.score) for point in response.points]
+                    for response in responses]
+        else:
+            requests = [
+                QueryRequest(query=vector, filter=self._get_filter(topic), params=self.search_params,
+                             limit=self.vector_top_n, with_payload=True)
+                for vector, topic in zip(vectors, topics)
+            ]
+            with span("vector_search"):
+                responses = await self._aquery_batch(requests)
+            with span("bm25_search"):
+                bm25_hits = await run_in_thread(self.bm25_index.search_many, queries, k=self._bm25_k(topics))
+            missing_ids = list(dict.fromkeys(
+                doc_id for response, hits in zip(responses, bm25_hits) for doc_id in self._missing_ids(response.points, hits)))
+            points = []
+            with span("fetch_payloads"):
+                if missing_ids and self.async_client is not None:
+                    points = await self.async_client.retrieve(self.collection_name, ids=missing_ids, with_payload=True)
+                elif missing_ids:
+                    points = await run_in_thread(self.client.retrieve, self.collection_name, ids=missing_ids, with_payload=True)
+            docs = [self._merge(response.points, hits, points, topic)
+                    for response, hits, topic in zip(responses, bm25_hits, topics)]
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return await self.reranker.arerank_many(queries, docs, self.top_k, self.rerank_min_score)
+
+    async def _aquery_batch(self, requests: List[QueryRequest]):
+        if self.async_client is not None:
+            return await self.async_client.query_batch_points(self.collection_name, requests)
+        return await run_in_thread(self.client.query_batch_points, self.collection_name, requests)
+
+    def _bm25_k(self, topics: List[Optional[str]]) -> int:
+        # Keyword hits of other topics are only dropped once their payloads are fetched
+        if any(topic or self.topic for topic in topics):
+            return self.bm25_top_n * self.bm25_topic_oversample
+        return self.bm25_top_n
+
+    def _missing_ids(self, vector_hits, bm25_hits: List[Tuple[str, float]]) -> List[str]:
+        vector_ids = {hit.payload["id"] for hit in vector_hits if "id" in hit.payload}
+        return [doc_id for doc_id, _ in bm25_hits if doc_id not in vector_ids]
+
+    def _merge(self, vector_hits, bm25_hits: List[Tuple[str, float]], points,
+               topic: Optional[str] = None) -> List[Document]:
+        vector_hits = [hit for hit in vector_hits if "id" in hit.payload]
+        topic = topic or self.topic
+        if topic:
+            # Vector hits are already filtered by topic in Qdrant; keyword hits are checked on their payload
+            in_topic = {hit.payload["id"] for hit in vector_hits}
+            in_topic.update(str(point.id) for point in points if (point.payload or {}).get(TOPIC_FIELD) == topic)
+            bm25_hits = [hit for hit in bm25_hits if hit[0] in in_topic][:self.bm25_top_n]
+        # ====== 3. Fuse the top-N candidates of both retrievers ======
+        with span("fusion"):
+            ranked = fuse(
+                [
+                    ([hit.payload["id"] for hit in vector_hits], [hit.score for hit in vector_hits]),  # cosine similarity
+                    ([doc_id for doc_id, _ in bm25_hits], [score for _, score in bm25_hits]),
+                ],
+                weights=[self.alpha, 1 - self.alpha],
+                top_k=self._fused_k(),
+                strategy=self.fusion,
+                rrf_k=self.rrf_k,
             )
-            for text, score, doc_id in top_results
-        ]
-        return docs
+
+        # ====== 4. Build Documents ======
+        payloads = {str(point.id): point.payload or {} for point in points}
+        payloads.update({hit.payload["id"]: hit.payload for hit in vector_hits})
+        return [_to_document(doc_id, payloads.get(doc_id, {}), score) for doc_id, score in ranked]
+
+
+def _to_document(doc_id: str, payload: dict, score: float) -> Document:
+    retrieved_chunks.inc(retriever="hybrid")
+    metadata = {key: value for key, value in payload.items() if key != "text"}
+    return Document(page_content=payload.get("text", ""), metadata={**metadata, "score": score, "id": doc_id})
@@ -0,0 +1,163 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    CollectionInfo,
+    CollectionParamsDiff,
+    Disabled,
+    HnswConfigDiff,
+    KeywordIndexParams,
+    KeywordIndexType,
+    OptimizersConfigDiff,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParamsDiff,
+)
+
+from app.src.utils import getEnvVariable
+from .collection_info import collection_infos
+from .topic_registry import TOPIC_FIELD
+
+DEFAULT_INDEXING_THRESHOLD = 20000  # KB, Qdrant's default
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    Storage and search settings of a collection.
+
+    Attributes:
+        quantization: None, "scalar" (int8) or "binary".
+        quantization_in_ram: Keep quantized vectors in RAM even when the originals are on disk.
+        rescore: Re-rank quantized candidates with the original vectors.
+        oversampling: Quantized candidates fetched per result before rescoring.
+        hnsw_m / hnsw_ef_construct: HNSW graph degree and build-time beam (m=0 builds no graph).
+        hnsw_ef: Search-time beam; None uses Qdrant's default.
+        on_disk_vectors / on_disk_payload / on_disk_index: Keep original vectors, payload and
+            the `topic` index on disk (memory-mapped) instead of in RAM.
+        indexing_threshold: KB of vectors in a segment before it gets an HNSW index (0 disables indexing).
+    """
+    name: str
+    quantization: Optional[str] = None
+    quantization_in_ram: bool = True
+    rescore: bool = True
+    oversampling: float = 1.0
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    hnsw_ef: Optional[int] = None
+    on_disk_vectors: bool = False
+    on_disk_payload: bool = False
+    on_disk_index: bool = False
+    indexing_threshold: int = DEFAULT_INDEXING_THRESHOLD
+
+    def hnsw_config(self) -> HnswConfigDiff:
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct, on_disk=self.on_disk_vectors)
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8, quantile=0.99, always_ram=self.quantization_in_ram))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_in_ram))
+        return None
+
+    def optimizers_config(self) -> OptimizersConfigDiff:
+        return OptimizersConfigDiff(indexing_threshold=self.indexing_threshold)
+
+    def topic_index(self) -> KeywordIndexParams:
+        return KeywordIndexParams(type=KeywordIndexType.KEYWORD, on_disk=self.on_disk_index)
+
+    def search_params(self) -> Optional[SearchParams]:
+        quantization = None
+        if self.quantization:
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if quantization is None and self.hnsw_ef is None:
+            return None
+        return SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+
+PROFILES: Dict[str, CollectionProfile] = {
+    profile.name: profile for profile in (
+        # Previous defaults: full-precision vectors, graph and payload in RAM
+        CollectionProfile("balanced"),
+        # int8 vectors in RAM for the graph walk (4x smaller), rescored with the originals;
+        # a denser graph and a wider search beam for recall
+        CollectionProfile("low-latency", quantization="scalar", oversampling=1.5,
+                          hnsw_m=32, hnsw_ef_construct=200, hnsw_ef=128),
+        # 1-bit vectors in RAM (32x smaller); originals, graph, payload and index on disk,
+        # heavy oversampling with rescoring keeps recall
+        CollectionProfile("memory-lean", quantization="binary", oversampling=3.0, hnsw_ef=128,
+                          on_disk_vectors=True, on_disk_payload=True, on_disk_index=True),
+        # No graph while loading; migrate to a serving profile once ingestion is done
+        CollectionProfile("bulk-ingest", hnsw_m=0, on_disk_vectors=True, on_disk_payload=True,
+                          indexing_threshold=0),
+    )
+}
+
+
+def get_profile(name: Optional[str] = None) -> CollectionProfile:
+    """
+    Return a profile by name; without a name, the one set by COLLECTION_PROFILE (default "balanced").
+    """
+    name = name or getEnvVariable("COLLECTION_PROFILE", "balanced")
+    if name not in PROFILES:
+        raise ValueError(f"Unknown collection profile: {name} (available: {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+def profile_of(info: Optional[CollectionInfo]) -> Optional[CollectionProfile]:
+    """
+    Recognize the profile a collection was created or migrated with from its configuration.
+    """
+    if info is None:
+        return None
+    quantization = info.config.quantization_config
+    kind = "scalar" if getattr(quantization, "scalar", None) else "binary" if getattr(quantization, "binary", None) else None
+    hnsw = info.config.hnsw_config
+    for profile in PROFILES.values():
+        if (profile.quantization, profile.hnsw_m, profile.hnsw_ef_construct) == (kind, hnsw.m, hnsw.ef_construct):
+            return profile
+    return None
+
+
+def collection_search_params(client: QdrantClient, collection_name: str) -> Optional[SearchParams]:
+    """
+    Search-time parameters (hnsw_ef, quantization rescoring) of the collection's profile.
+    """
+    profile = profile_of(collection_infos.get(client, collection_name))
+    return profile.search_params() if profile else None
+
+
+async def acollection_search_params(client: AsyncQdrantClient, collection_name: str) -> Optional[SearchParams]:
+    """
+    Async variant of `collection_search_params`.
+    """
+    profile = profile_of(await collection_infos.aget(client, collection_name))
+    return profile.search_params() if profile else None
+
+
+def apply_profile(client: QdrantClient, collection_name: str, profile: CollectionProfile):
+    """
+    Migrate an existing collection to a profile in place.
+
+    Qdrant rebuilds the affected segments (quantization, HNSW graph, on-disk
+    storage) in the background while the collection keeps serving.
+    """
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": VectorParamsDiff(on_disk=profile.on_disk_vectors)},
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config() or Disabled.DISABLED,
+        optimizers_config=profile.optimizers_config(),
+        collection_params=CollectionParamsDiff(on_disk_payload=profile.on_disk_payload),
+    )
+    # (Re)create the topic index with the profile's storage; older collections may lack it
+    client.create_payload_index(collection_name=collection_name, field_name=TOPIC_FIELD, field_schema=profile.topic_index())
+    collection_infos.invalidate(collection_name)
+
@@ -1,26 +1,87 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
-from typing import List, Tuple
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import VectorParams, Distance, PointStruct, Record, SparseVectorParams, Modifier
+from typing import Iterator, List, Optional, Set, Tuple
+from .topic_registry import topic_registry, TOPIC_FIELD
+from .sparse import SPARSE_VECTOR_NAME, sparse_vectors, has_sparse_vectors, ahas_sparse_vectors
+from .collection_info import collection_infos, collection_versions
+from .profiles import get_profile
+from .bm25_index import drop_bm25_index
+import logging
 
-# Create a collection if it doesn't exist.
-def init_collection(client: QdrantClient, collection_name: str, vector_size=384):
+logger = logging.getLogger(__name__)
+
+# Create a collection if it doesn't exist, with the settings of a collection profile
+def init_collection(client: QdrantClient, collection_name: str, vector_size=384, profile: Optional[str] = None):
     if not client.collection_exists(collection_name):
+        settings = get_profile(profile)
         client.recreate_collection(
             collection_name=collection_name,
-            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE)
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=settings.on_disk_vectors),
+            # Lexical vectors for hybrid search; Qdrant applies the IDF at query time
+            sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)},
+            hnsw_config=settings.hnsw_config(),
+            quantization_config=settings.quantization_config(),
+            optimizers_config=settings.optimizers_config(),
+            on_disk_payload=settings.on_disk_payload
+        )
+        collection_infos.invalidate(collection_name)
+        # Keyword index on topic: fast filtered search and facet-based topic listing
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=TOPIC_FIELD,
+            field_schema=settings.topic_index()
         )
 
-# Add text + vector + topic
-def add_text(client: QdrantClient, collection_name: str, ids: list, vectors: list, chunks: list, topic: str):
-    points = [
+def _build_points(ids: list, vectors: list, chunks: list, topic: str, metadatas: Optional[List[dict]] = None,
+                  sparse: bool = False) -> List[PointStruct]:
+    metadatas = metadatas or [{}] * len(ids)
+    if sparse:
+        # Unnamed dense vector plus the named sparse one
+        vectors = [{"": vector, SPARSE_VECTOR_NAME: lexical} for vector, lexical in zip(vectors, sparse_vectors(chunks))]
+    return [
         PointStruct(
             id=uid,
             vector=vector,
-            payload={"id": uid, "text": chunk, "topic": topic}
+            payload={**metadata, "id": uid, "text": chunk, "topic": topic}
         )
-        for uid, vector, chunk in zip(ids, vectors, chunks)
+        for uid, vector, chunk, metadata in zip(ids, vectors, chunks, metadatas)
     ]
+
+# Add text + vector (+ sparse lexical vector when the collection has one) + topic (+ optional extra payload such as page numbers)
+def add_text(client: QdrantClient, collection_name: str, ids: list, vectors: list, chunks: list, topic: str,
+             metadatas: Optional[List[dict]] = None):
+    points = _build_points(ids, vectors, chunks, topic, metadatas, sparse=has_sparse_vectors(client, collection_name))
     client.upsert(collection_name=collection_name, points=points)
+    topic_registry.add(collection_name, topic)
+    collection_versions.invalidate(collection_name)
+
+# Async variant of add_text
+async def aadd_text(client: AsyncQdrantClient, collection_name: str, ids: list, vectors: list, chunks: list, topic: str,
+                    metadatas: Optional[List[dict]] = None):
+    sparse = await ahas_sparse_vectors(client, collection_name)
+    points = _build_points(ids, vectors, chunks, topic, metadatas, sparse=sparse)
+    await client.upsert(collection_name=collection_name, points=points)
+    topic_registry.add(collection_name, topic)
+    collection_versions.invalidate(collection_name)
+
+# Ids among `ids` that are already stored in the collection
+def existing_ids(client: QdrantClient, collection_name: str, ids: List[str]) -> Set[str]:
+    if not ids or collection_infos.get(client, collection_name) is None:
+        return set()
+    points = client.retrieve(collection_name, ids=ids, with_payload=False, with_vectors=False)
+    return {str(point.id) for point in points}
+
+# Async variant of existing_ids
+async def aexisting_ids(client: AsyncQdrantClient, collection_name: str, ids: List[str]) -> Set[str]:
+    if not ids or await collection_infos.aget(client, collection_name) is None:
+        return set()
+    points = await client.retrieve(collection_name, ids=ids, with_payload=False, with_vectors=False)
+    return {str(point.id) for point in points}
+
+# Version of the collection's contents: its number of points, which grows with every ingestion that
+# stores new chunks (duplicates are skipped), whichever process ran it
+def collection_version(client: QdrantClient, collection_name: str) -> int:
+    return collection_versions.get(client, collection_name)
 
 # Find the nearest vector
 def search_text(client: QdrantClient, collection_name: str, query_vector: list, limit: int = 3, topic: str = None):
@@ -45,30 +106,51 @@ def search_text(client: QdrantClient, collection_name: str, query_vector: list,
 def delete_collection(client: QdrantClient, collection_name: str):
     if client.collection_exists(collection_name):
         client.delete_collection(collection_name=collection_name)
-        print(f"Collection {collection_name} deleted.")
+        topic_registry.invalidate(collection_name)
+        collection_infos.invalidate(collection_name)
+        collection_versions.invalidate(collection_name)
+        drop_bm25_index(collection_name)
+        logger.info("Collection %s deleted.", collection_name)
     else:
-        print(f"Collection {collection_name} does not exist.")
+        logger.info("Collection %s does not exist.", collection_name)
 
-def get_available_topics(client: QdrantClient, collection_name: str) -> List[str]:
-    response, _ = client.scroll(
-        collection_name=collection_name,
-        limit=10_000,
-        with_payload=True,
-    )
+# Stream every point of a collection, one bounded page at a time
+def scroll_points(client: QdrantClient, collection_name: str, page_size: int = 256,
+                  payload_fields: Optional[List[str]] = None, with_vectors: bool = False,
+                  scroll_filter=None) -> Iterator[List[Record]]:
+    """
+    Yield the points of a collection in pages of at most `page_size`.
+
+    Args:
+        payload_fields (Optional[List[str]]): Payload keys to fetch; None fetches the whole payload.
+        with_vectors (bool): Whether to fetch the vectors too.
+        scroll_filter: Optional Qdrant filter.
+    """
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=page_size,
+            offset=offset,
+            with_payload=payload_fields if payload_fields is not None else True,
+            with_vectors=with_vectors,
+            scroll_filter=scroll_filter,
+        )
+        if points:
+            yield points
+        if offset is None:
+            break
 
-    topics = {point.payload.get("topic") for point in response if point.payload and point.payload.get("topic")}
-    return list(topics)
+def get_available_topics(client: QdrantClient, collection_name: str) -> List[str]:
+    return topic_registry.get(client, collection_name)
 
 # Get all texts from your Qdrant collection
 def get_all_texts_from_qdrant(client: QdrantClient, collection_name: str) -> List[Tuple[str, str]]:
-    scroll_result = client.scroll(
-        collection_name=collection_name,
-        with_payload=True,
-        limit=1000  # adjust based on size
-    )
-    print (f"Retrieved {len(scroll_result[0])} points from collection {collection_name}")  # Debugging info
-    return [
+    pairs = [
         (point.payload.get("id", ""), point.payload.get("text", ""))
-        for point in scroll_result[0]
+        for page in scroll_points(client, collection_name, page_size=1000, payload_fields=["id", "text"])
+        for point in page
         if "id" in point.payload and "text" in point.payload
-    ]
\ No newline at end of file
+    ]
+    logger.debug("Retrieved %d points from collection %s", len(pairs), collection_name)
+    return pairs
\ No newline at end of file
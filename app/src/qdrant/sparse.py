@@ -0,0 +1,68 @@
+import zlib
+from collections import Counter
+from typing import Dict, List
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import SparseVector
+
+from app.src.utils import getEnvVariable
+from .bm25_index import tokenize
+from .collection_info import collection_infos
+
+SPARSE_VECTOR_NAME = "bm25"
+
+
+def _term_index(term: str) -> int:
+    # Stable across processes (unlike hash()); collisions just share a dimension
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def sparse_vector(text: str, k1: float = 1.5, b: float = 0.75, avg_len: float = None) -> SparseVector:
+    """
+    Lexical sparse vector of a chunk: the BM25 term-frequency part of each token.
+
+    The IDF part is applied by Qdrant at query time (the sparse vector is
+    configured with `Modifier.IDF`), so adding documents never rewrites
+    existing vectors. Document length is normalized against a fixed
+    `avg_len` (env SPARSE_AVG_LEN) instead of the corpus average.
+    """
+    if avg_len is None:
+        avg_len = float(getEnvVariable("SPARSE_AVG_LEN", "256"))
+    tokens = tokenize(text)
+    norm = k1 * (1 - b + b * len(tokens) / avg_len)
+    weights: Dict[int, float] = {}
+    for term, tf in Counter(tokens).items():
+        index = _term_index(term)
+        weights[index] = weights.get(index, 0.0) + tf * (k1 + 1) / (tf + norm)
+    return SparseVector(indices=list(weights), values=list(weights.values()))
+
+
+def sparse_vectors(texts: List[str]) -> List[SparseVector]:
+    return [sparse_vector(text) for text in texts]
+
+
+def sparse_query(text: str) -> SparseVector:
+    """
+    Sparse vector of a query: weight 1 per distinct token, so the score is the sum of BM25 term scores.
+    """
+    indices = sorted({_term_index(term) for term in tokenize(text)})
+    return SparseVector(indices=indices, values=[1.0] * len(indices))
+
+
+def has_sparse_vectors(client: QdrantClient, collection_name: str) -> bool:
+    """
+    Whether the collection stores lexical sparse vectors (created by `init_collection`
+    since sparse support). Older collections keep using the local BM25 index.
+    """
+    return _has_sparse(collection_infos.get(client, collection_name))
+
+
+async def ahas_sparse_vectors(client: AsyncQdrantClient, collection_name: str) -> bool:
+    """
+    Async variant of `has_sparse_vectors`.
+    """
+    return _has_sparse(await collection_infos.aget(client, collection_name))
+
+
+def _has_sparse(info) -> bool:
+    return info is not None and SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
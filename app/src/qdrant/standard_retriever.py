@@ -1,39 +1,108 @@
-from typing import List, Optional, Callable
+from typing import Any, Awaitable, List, Optional, Callable, Sequence
 from pydantic import BaseModel
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue, QueryRequest, SearchParams
+from app.src.utils import metrics, run_in_thread, span
+
+retrieved_chunks = metrics.counter("rag_retrieved_chunks_total", "Chunks fetched by the retrievers (before reranking)", ["retriever"])
 
 class StandardRetriever(BaseRetriever, BaseModel):
     client: QdrantClient
     collection_name: str
     embed_fn: Callable[[List[str]], List[List[float]]]
+    async_client: Optional[AsyncQdrantClient] = None  # Used by the async path when provided
+    aembed_fn: Optional[Callable[[List[str]], Awaitable[List[List[float]]]]] = None
     topic: Optional[str] = None
     top_k: int = 5
+    search_params: Optional[SearchParams] = None  # Search-time settings of the collection profile
+    reranker: Optional[Any] = None  # Cross-encoder stage (app.src.process.Reranker); None disables it
+    rerank_candidates: int = 20  # Candidates fetched for the reranker, which keeps the best `top_k`
+    rerank_min_score: Optional[float] = None  # Candidates the reranker scores below this are dropped
 
-    def _get_filter(self):
-        if self.topic:
+    def _get_filter(self, topic: Optional[str] = None):
+        topic = topic or self.topic
+        if topic:
             return Filter(
                 must=[
                     FieldCondition(
                         key="topic",
-                        match=MatchValue(value=self.topic)
+                        match=MatchValue(value=topic)
                     )
                 ]
             )
         return None
 
-    def _get_relevant_documents(self, query: str) -> List[Document]:
-        vector = self.embed_fn([f"passage: {query}"])[0]
-        hits = self.client.search(
+    def _limit(self) -> int:
+        return max(self.rerank_candidates, self.top_k) if self.reranker is not None else self.top_k
+
+    def _search_kwargs(self, vector) -> dict:
+        return dict(
             collection_name=self.collection_name,
             query_vector=vector,
-            limit=self.top_k,
+            limit=self._limit(),
             query_filter=self._get_filter(),
+            search_params=self.search_params,
             with_payload=True
         )
+
+    def _to_documents(self, hits) -> List[Document]:
+        retrieved_chunks.inc(len(hits), retriever="standard")
         return [
             Document(page_content=hit.payload.get("text", ""), metadata=hit.payload)
             for hit in hits
         ]
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        with span("embedding"):
+            vector = self.embed_fn([f"passage: {query}"])[0]
+        with span("vector_search"):
+            hits = self.client.search(**self._search_kwargs(vector))
+        docs = self._to_documents(hits)
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return self.reranker.rerank(query, docs, self.top_k, self.rerank_min_score)
+
+    async def _aget_relevant_documents(self, query: str) -> List[Document]:
+        with span("embedding"):
+            if self.aembed_fn is not None:
+                vector = (await self.aembed_fn([f"passage: {query}"]))[0]
+            else:
+                vector = (await run_in_thread(self.embed_fn, [f"passage: {query}"]))[0]
+        with span("vector_search"):
+            if self.async_client is not None:
+                hits = await self.async_client.search(**self._search_kwargs(vector))
+            else:
+                hits = await run_in_thread(self.client.search, **self._search_kwargs(vector))
+        docs = self._to_documents(hits)
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return await self.reranker.arerank(query, docs, self.top_k, self.rerank_min_score)
+
+    async def aretrieve_many(self, queries: List[str], vectors: Sequence[Sequence[float]],
+                             topics: Optional[List[Optional[str]]] = None) -> List[List[Document]]:
+        """
+        Documents of several queries whose vectors are already computed: one
+        `query_batch_points` request for all of them and, with a reranker, one
+        batch of (query, chunk) pairs. `topics` filters each query (the
+        retriever's topic when None).
+        """
+        topics = topics or [None] * len(queries)
+        requests = [
+            QueryRequest(query=[float(value) for value in vector], filter=self._get_filter(topic),
+                         params=self.search_params, limit=self._limit(), with_payload=True)
+            for vector, topic in zip(vectors, topics)
+        ]
+        with span("vector_search"):
+            if self.async_client is not None:
+                responses = await self.async_client.query_batch_points(self.collection_name, requests)
+            else:
+                responses = await run_in_thread(self.client.query_batch_points, self.collection_name, requests)
+        docs = [self._to_documents(response.points) for response in responses]
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return await self.reranker.arerank_many(queries, docs, self.top_k, self.rerank_min_score)
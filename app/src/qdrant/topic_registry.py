@@ -0,0 +1,76 @@
+import threading
+import time
+from typing import Dict, List, Set, Tuple
+
+from qdrant_client import QdrantClient
+
+from app.src.utils import getEnvVariable
+
+TOPIC_FIELD = "topic"
+
+
+class TopicRegistry:
+    """
+    Per-collection cache of the distinct `topic` values.
+
+    Loaded with a facet query when the collection has a keyword payload index on
+    `topic` (O(#topics)), otherwise with a one-off paginated scan of only the
+    `topic` field. Uploads register their topic directly; entries are refreshed
+    after `ttl` seconds so topics added by other workers show up too.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._topics: Dict[str, Tuple[Set[str], float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, client: QdrantClient, collection_name: str) -> List[str]:
+        """
+        Return the topics of a collection, loading them on first use or after the TTL.
+        """
+        with self._lock:
+            entry = self._topics.get(collection_name)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                return sorted(entry[0])
+        topics = self._load(client, collection_name)
+        with self._lock:
+            self._topics[collection_name] = (topics, time.monotonic())
+        return sorted(topics)
+
+    def add(self, collection_name: str, topic: str) -> bool:
+        """
+        Register a topic written to a collection.
+
+        Returns:
+            bool: True if the topic was not known yet.
+        """
+        with self._lock:
+            entry = self._topics.get(collection_name)
+            if entry is None:
+                # Nothing cached yet; the next `get` loads the full list
+                return True
+            if topic in entry[0]:
+                return False
+            entry[0].add(topic)
+            return True
+
+    def invalidate(self, collection_name: str):
+        with self._lock:
+            self._topics.pop(collection_name, None)
+
+    def _load(self, client: QdrantClient, collection_name: str) -> Set[str]:
+        from .qbrant_service import scroll_points
+
+        payload_schema = client.get_collection(collection_name).payload_schema or {}
+        if TOPIC_FIELD in payload_schema:
+            response = client.facet(collection_name=collection_name, key=TOPIC_FIELD, limit=10_000, exact=True)
+            return {str(hit.value) for hit in response.hits}
+        return {
+            point.payload[TOPIC_FIELD]
+            for page in scroll_points(client, collection_name, payload_fields=[TOPIC_FIELD])
+            for point in page
+            if point.payload and point.payload.get(TOPIC_FIELD)
+        }
+
+
+topic_registry = TopicRegistry(ttl=float(getEnvVariable("TOPIC_REGISTRY_TTL", "60")))
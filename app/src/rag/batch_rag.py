@@ -0,0 +1,135 @@
+from app.src.process import LLMOverloadedError, agenerate_answer_with_docs, answer_cache, detect_topic, get_embedding_service, model_key
+from app.src.qdrant import collection_version, get_available_topics
+from app.src.rag.standard_rag import build_retriever
+from app.src.rag.hybrid_rag import abuild_retriever
+from app.src.rag.iterative_rag import run as iterative_rag_run
+from app.src.utils import StageTimer, metrics, run_in_thread, span
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+batch_questions = metrics.counter("rag_batch_questions_total", "Questions of batch chats by outcome", ["result"])
+
+async def stream(questions: List[str], client: QdrantClient, collection_name: str, mode: str, is_topic: bool,
+                 type_iterative: str = "standard", model_name: Optional[str] = None,
+                 async_client: Optional[AsyncQdrantClient] = None, concurrency: int = 8) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Answer many single-turn questions on one collection.
+
+    All questions are embedded in one call (which also serves topic detection
+    and the answer cache). Cached answers are sent first. For "standard" and
+    "hybrid", the remaining questions are retrieved together (one batched
+    Qdrant query, one BM25 pass, one rerank batch), then answered with at most
+    `concurrency` LLM calls in flight. "iterative" runs the iterative loop
+    of each question under the same limit.
+
+    Yields:
+        Tuple[str, dict]: one ("result", ...) or ("error", ...) per question in
+        completion order (with its `index` in `questions`), then ("done", ...)
+        with the counts and the per-stage timings of the whole batch.
+    """
+    timer = StageTimer("batch")
+    started = timer.start
+    counts = {"answered": 0, "cached": 0, "errors": 0}
+
+    def result(index: int, answer: str, topic: Optional[str], cached: bool, **extra) -> Tuple[str, dict]:
+        counts["cached" if cached else "answered"] += 1
+        batch_questions.inc(result="cached" if cached else "answered")
+        return "result", {"index": index, "question": questions[index], "answer": answer, "topic": topic,
+                          "cached": cached, "time": round(time.time() - started, 3), **extra}
+
+    def error(index: int, e: Exception) -> Tuple[str, dict]:
+        counts["errors"] += 1
+        batch_questions.inc(result="error")
+        if not isinstance(e, LLMOverloadedError):
+            logger.exception("Error answering batch question %d: %s", index, e)
+        return "error", {"index": index, "question": questions[index], "message": str(e),
+                         "status": 429 if isinstance(e, LLMOverloadedError) else 500}
+
+    with span("embedding"):
+        vectors = await get_embedding_service().aencode([f"passage: {question}" for question in questions])
+    topics: List[Optional[str]] = [None] * len(questions)
+    if is_topic:
+        stage = time.time()
+        topics = await run_in_thread(_detect_topics, questions, client, collection_name)
+        timer.add("topic", stage)
+
+    pending = list(range(len(questions)))
+    if mode != "iterative":
+        stage = time.time()
+        version = await run_in_thread(collection_version, client, collection_name) if answer_cache.enabled else 0
+        cached = await run_in_thread(_cached_answers, questions, topics, collection_name, mode, model_name, version)
+        timer.add("cache", stage)
+        for index, answer in enumerate(cached):
+            if answer is not None:
+                yield result(index, answer, topics[index], cached=True)
+        pending = [index for index, answer in enumerate(cached) if answer is None]
+
+    slots = asyncio.Semaphore(max(concurrency, 1))
+
+    async def answer(index: int, docs) -> str:
+        async with slots:
+            text = await agenerate_answer_with_docs(questions[index], docs, model_name=model_name)
+        await run_in_thread(answer_cache.put, collection_name, topics[index], mode, model_key(model_name), questions[index], text, version)
+        return text
+
+    async def answer_iteratively(index: int) -> dict:
+        async with slots:
+            if type_iterative == "hybrid":
+                retriever = await abuild_retriever(client, collection_name, topics[index], async_client)
+            else:
+                retriever = await run_in_thread(build_retriever, client, collection_name, topics[index], async_client)
+            return await iterative_rag_run(questions[index], client, retriever, collection_name, is_topic)
+
+    async def settle(index: int, work) -> tuple:
+        # (index, outcome, error): a failed question does not stop the others
+        try:
+            return index, await work, None
+        except Exception as e:
+            return index, None, e
+
+    tasks = []
+    if pending and mode == "iterative":
+        tasks = [asyncio.ensure_future(settle(index, answer_iteratively(index))) for index in pending]
+    elif pending:
+        retriever = await (abuild_retriever(client, collection_name, None, async_client) if mode == "hybrid"
+                           else run_in_thread(build_retriever, client, collection_name, None, async_client))
+        stage = time.time()
+        try:
+            docs = await retriever.aretrieve_many([questions[index] for index in pending], vectors[pending],
+                                                  [topics[index] for index in pending])
+        except Exception as e:
+            for index in pending:
+                yield error(index, e)
+            pending, docs = [], []
+        timer.add("retrieval", stage)
+        tasks = [asyncio.ensure_future(settle(index, answer(index, documents))) for index, documents in zip(pending, docs)]
+
+    try:
+        for future in asyncio.as_completed(tasks):
+            index, outcome, failure = await future
+            if failure is not None:
+                yield error(index, failure)
+            elif mode == "iterative":
+                yield result(index, outcome["answer"], outcome["topic"], cached=False, iterations=outcome["iterations"])
+            else:
+                yield result(index, outcome, topics[index], cached=False)
+    finally:
+        # Stop answering when the client goes away
+        for task in tasks:
+            task.cancel()
+
+    yield "done", {"questions": len(questions), **counts, "timings": timer.total()}
+
+def _detect_topics(questions: List[str], client: QdrantClient, collection_name: str) -> List[Optional[str]]:
+    labels = get_available_topics(client, collection_name)
+    return [detect_topic(question, labels, collection_name=collection_name, client=client) for question in questions]
+
+def _cached_answers(questions: List[str], topics: List[Optional[str]], collection_name: str, mode: str,
+                    model_name: Optional[str], version: int) -> List[Optional[str]]:
+    return [answer_cache.get(collection_name, topic, mode, model_key(model_name), question, version)
+            for question, topic in zip(questions, topics)]
@@ -1,11 +1,17 @@
 from app.src.qdrant import HybridRetriever
-from app.src.process import generate_answer, get_model, detect_topic
-from app.src.qdrant import get_available_topics, get_all_texts_from_qdrant
-from qdrant_client import QdrantClient
-from typing import Optional
+from app.src.process import agenerate_answer, get_embedding_service, detect_topic, answer_cache, model_key, session_memory, rerank_settings
+from app.src.qdrant import get_available_topics, get_bm25_index, has_sparse_vectors, collection_search_params
+from app.src.utils import StageTimer, getEnvVariable, run_in_thread, span
+from app.src.rag.streaming import cached_answer, stream_answer
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from typing import AsyncIterator, Optional, Tuple
+import logging
 import time
 
-def run(question: str, client: QdrantClient, collection_name: str, is_topic: bool, is_memory: bool, model_name: Optional[str] = None):
+logger = logging.getLogger(__name__)
+
+async def run(question: str, client: QdrantClient, collection_name: str, is_topic: bool, is_memory: bool, model_name: Optional[str] = None,
+              async_client: Optional[AsyncQdrantClient] = None, session_id: Optional[str] = None):
     """
     Run the chat function with the provided parameters.
 
@@ -14,41 +20,97 @@ def run(question: str, client: QdrantClient, collection_name: str, is_topic: boo
         client (QdrantClient): Qdrant vector database client.
         collection_name (str): Name of the collection to search.
         is_topic (bool): Whether to detect topic from the question.
+        async_client (Optional[AsyncQdrantClient]): Async client used for the vector search.
+        session_id (Optional[str]): Conversation whose history is used when `is_memory` is set.
 
     Returns:
-        dict: Contains the answer, detected topic, and elapsed time.
+        dict: Contains the answer, detected topic, elapsed time and per-stage timings.
     """
-    start = time.time()
+    timer = StageTimer("hybrid")
     if is_topic:
         # Detect topic based on the question and available topics in the collection
-        topic = detect_topic(question, get_available_topics(client, collection_name))
+        topic = await run_in_thread(_detect_topic, question, client, collection_name)
+        timer.add("topic", timer.start)
     else:
         topic = None
-    # Get all texts from Qdrant collection for BM25
-    pairs = get_all_texts_from_qdrant(client, collection_name)
-    print(f"Pairs retrieved: {len(pairs)}")  # Debugging info
-    bm25_ids = [doc_id for doc_id, _ in pairs]
-    bm25_corpus = [text for _, text in pairs]
-    print(f"BM25 corpus size: {len(bm25_corpus)} documents, IDs: {len(bm25_ids)}")  # Debugging info
+    # Single-turn answers are served from the semantic cache when a similar question was answered
+    if not is_memory:
+        stage = time.time()
+        cached, version = await run_in_thread(cached_answer, client, collection_name, topic, "hybrid", model_name, question)
+        timer.add("cache", stage)
+        if cached is not None:
+            timings = timer.total()
+            return {"answer:": cached, "topic": topic, "time": timings["total"], "is_memory": is_memory, "cached": True, "timings": timings}
+    retriever = await abuild_retriever(client, collection_name, topic, async_client)
+    chat_history = await run_in_thread(session_memory.history, session_id) if is_memory else ""
+    # Generate answer using retriever and question (timed as "retrieval" and "generation")
+    result = await agenerate_answer(retriever, question, is_memory, model_name=model_name, chat_history=chat_history)
+    if is_memory:
+        # Summarizing older turns is scheduled by the API after the response is sent
+        await run_in_thread(session_memory.add_turn, session_id, question, result)
+    else:
+        await run_in_thread(answer_cache.put, collection_name, topic, "hybrid", model_key(model_name), question, result, version)
+    timings = timer.total()
+    # Return answer, topic, elapsed time and the per-stage breakdown
+    return {"answer:": result, "topic": topic, "time": timings["total"], "is_memory": is_memory, "session_id": session_id, "cached": False, "timings": timings}
+
+async def stream(question: str, client: QdrantClient, collection_name: str, is_topic: bool, is_memory: bool, model_name: Optional[str] = None,
+                 async_client: Optional[AsyncQdrantClient] = None, session_id: Optional[str] = None) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming variant of `run`.
+
+    Yields:
+        Tuple[str, dict]: ("retrieval", topic and documents), then ("token", answer token)
+        events, then ("done", topic and per-stage timings).
+    """
+    timer = StageTimer("hybrid")
+    topic = None
+    if is_topic:
+        topic = await run_in_thread(_detect_topic, question, client, collection_name)
+        timer.add("topic", timer.start)
+    retriever = await abuild_retriever(client, collection_name, topic, async_client)
+    async for event in stream_answer(question, retriever, collection_name, "hybrid", topic, is_memory, model_name, timer, client, session_id):
+        yield event
+
+async def abuild_retriever(client: QdrantClient, collection_name: str, topic: Optional[str],
+                           async_client: Optional[AsyncQdrantClient] = None) -> HybridRetriever:
+    # Keyword search runs in Qdrant when the collection has sparse vectors,
+    # otherwise on the persistent BM25 index of the collection
+    bm25_index = await run_in_thread(_local_bm25_index, client, collection_name)
+    search_params = await run_in_thread(collection_search_params, client, collection_name)
     # Initialize retriever with embedding function and topic (if any)
-    retriever = HybridRetriever(
+    return HybridRetriever(
         client=client,
+        async_client=async_client,
         collection_name=collection_name,
-        embed_fn=get_model().encode,
-        bm25_corpus=bm25_corpus,
-        bm25_ids=bm25_ids,
+        embed_fn=get_embedding_service().encode,
+        aembed_fn=get_embedding_service().aencode,
+        bm25_index=bm25_index,
+        search_params=search_params,
         topic=topic,
         top_k=5,
-        alpha=0.5  # Balance between semantic and keyword
+        alpha=0.5,  # Balance between semantic and keyword
+        **_fusion_settings(),
+        **rerank_settings()
     )
-    # Generate answer using retriever and question
-    result = generate_answer(retriever, question, is_memory, model_name=model_name)
-    end = time.time()
-    # Return answer, topic, and elapsed time
-    return {"answer:": result, "topic": topic, "time": round(end - start, 3), "is_memory": is_memory}
 
+def _local_bm25_index(client: QdrantClient, collection_name: str):
+    if has_sparse_vectors(client, collection_name):
+        return None
+    with span("bm25_index"):
+        bm25_index = get_bm25_index(client, collection_name)
+    logger.debug("BM25 index of %s: %d documents", collection_name, len(bm25_index))
+    return bm25_index
+
+def _fusion_settings() -> dict:
+    candidates = int(getEnvVariable("HYBRID_CANDIDATES", "20"))
+    return {"fusion": getEnvVariable("HYBRID_FUSION", "minmax"), "vector_top_n": candidates, "bm25_top_n": candidates}
+
+def _detect_topic(question: str, client: QdrantClient, collection_name: str):
+    return detect_topic(question, get_available_topics(client, collection_name), collection_name=collection_name, client=client)
 
-def run_retriever(question: str, client: QdrantClient, collection_name: str, is_topic: bool):
+def run_retriever(question: str, client: QdrantClient, collection_name: str, is_topic: bool,
+                  async_client: Optional[AsyncQdrantClient] = None):
     """
     Run the retriever with the provided parameters.
 
@@ -57,23 +119,24 @@ def run_retriever(question: str, client: QdrantClient, collection_name: str, is_
         client (QdrantClient): Qdrant vector database client.
         collection_name (str): Name of the collection to search.
         is_topic (bool): Whether to detect topic from the question.
+        async_client (Optional[AsyncQdrantClient]): Async client used for the vector search.
 
     Returns:
         List[Document]: Retrieved documents based on the question.
     """
-    # Get all texts from Qdrant collection for BM25
-    pairs = get_all_texts_from_qdrant(client, collection_name)
-    bm25_ids = [doc_id for doc_id, _ in pairs]
-    bm25_corpus = [text for _, text in pairs]
     # Initialize retriever with embedding function and topic (if any)
     retriever = HybridRetriever(
         client=client,
+        async_client=async_client,
         collection_name=collection_name,
-        embed_fn=get_model().encode,
-        bm25_corpus=bm25_corpus,
-        bm25_ids=bm25_ids,
-        topic=detect_topic(question, get_available_topics(client, collection_name)) if is_topic else None,
+        embed_fn=get_embedding_service().encode,
+        aembed_fn=get_embedding_service().aencode,
+        bm25_index=_local_bm25_index(client, collection_name),
+        search_params=collection_search_params(client, collection_name),
+        topic=_detect_topic(question, client, collection_name) if is_topic else None,
         top_k=5,
-        alpha=0.5  # Balance between semantic and keyword
+        alpha=0.5,  # Balance between semantic and keyword
+        **_fusion_settings(),
+        **rerank_settings()
     )
-    return retriever
\ No newline at end of file
+    return retriever
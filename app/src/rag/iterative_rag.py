@@ -1,61 +1,132 @@
-from app.src.process import generate_answer_from_docs, generate_followup_question_if_needed, get_model, detect_topic
-from app.src.qdrant import get_available_topics
+from app.src.process import agenerate_answer_with_followup, astream_answer_with_followup
+from app.src.utils import StageTimer, getEnvVariable, span
 from qdrant_client import QdrantClient
-from typing import List
+from typing import AsyncIterator, List, Set, Tuple
 from langchain.schema import Document
 from langchain_core.retrievers import BaseRetriever
 import time
 
-def run(question: str, client: QdrantClient, retriever: BaseRetriever, collection_name: str, is_topic: bool, max_iterations: int = 3):
+class _Context:
+    """
+    Documents accumulated across iterations, deduplicated by chunk id. The
+    prompt packs them within `max_tokens` (documents retrieved earlier come first).
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.documents: List[Document] = []
+        self._seen: Set[str] = set()
+
+    def add(self, docs: List[Document]) -> List[Document]:
+        """
+        Add the unseen documents and return them.
+        """
+        unseen = []
+        for doc in docs:
+            key = str(doc.metadata.get("id") or doc.page_content)
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            unseen.append(doc)
+        self.documents.extend(unseen)
+        return unseen
+
+def _context_budget() -> int:
+    return int(getEnvVariable("ITERATIVE_CONTEXT_TOKENS", getEnvVariable("CONTEXT_MAX_TOKENS", "3000")))
+
+async def run(question: str, client: QdrantClient, retriever: BaseRetriever, collection_name: str, is_topic: bool, max_iterations: int = 3):
     """
     Run Iterative RAG to refine answer through multiple retrieval and generation steps.
 
+    Each iteration is a single LLM call that answers the question from the
+    accumulated context and decides on a follow-up question, which drives the
+    next retrieval. The loop stops when no follow-up is needed or when a
+    retrieval brings no unseen chunks.
+
     Args:
         question (str): The user's complex question.
         client (QdrantClient): Qdrant vector database client.
+        retriever (BaseRetriever): Retriever built for the question (its topic is reused).
         collection_name (str): Name of the collection to search.
-        is_topic (bool): Whether to detect topic from the question.
+        is_topic (bool): Whether the retriever was built with topic detection.
         max_iterations (int): Maximum number of refinement loops.
 
     Returns:
-        dict: Final answer, topic, and elapsed time.
+        dict: Final answer, topic, elapsed time and per-stage timings.
     """
-    
+
     if not retriever:
         return {"answer": "No retriever provided", "topic": None, "time": 0, "iterations": 0}
-    
-    start = time.time()  # Start timing
-    
-    if is_topic:
-        # Detect topic from the question and available topics
-        topic = detect_topic(question, get_available_topics(client, collection_name))
-    else:
-        topic = None
-        
+
+    timer = StageTimer("iterative")  # Start timing
+    # The topic was already detected when the retriever was built
+    topic = getattr(retriever, "topic", None) if is_topic else None
+
     current_question = question  # Set the current question for the first iteration
-    accumulated_context: List[Document] = []  # Store all retrieved documents
+    context = _Context(_context_budget())  # Deduplicated documents of all iterations
     answer = ""  # Initialize answer
-    
+    iterations = 0
+
     for iteration in range(max_iterations):
         # Retrieve documents relevant to the current question
-        docs = retriever.invoke(current_question)
-        accumulated_context.extend(docs)  # Add new docs to the context
+        with span("retrieval"):
+            docs = await retriever.ainvoke(current_question)
+        if not context.add(docs) and iteration > 0:
+            break  # Nothing new to answer from
 
-        # Generate answer from the accumulated context
-        answer = generate_answer_from_docs(current_question, accumulated_context)
-
-        # Generate a follow-up question if the answer is insufficient
-        followup_question = generate_followup_question_if_needed(current_question, answer)
+        # Answer the original question and decide on a follow-up in one call
+        answer, followup_question = await agenerate_answer_with_followup(question, context.documents, context.max_tokens)
+        iterations = iteration + 1
 
         if not followup_question:
             break  # No follow-up needed, stop iteration
 
         current_question = followup_question  # Update question for next iteration
 
-    end = time.time()  # End timing
+    timings = timer.total()  # End timing
     return {
         "answer": answer,  # Final answer
         "topic": topic,    # Detected topic (if any)
-        "time": round(end - start, 3),  # Total elapsed time
-        "iterations": iteration + 1     # Number of iterations performed
+        "time": timings["total"],  # Total elapsed time
+        "iterations": iterations,  # Number of iterations performed
+        "timings": timings         # Per-stage breakdown
     }
+
+async def stream(question: str, client: QdrantClient, retriever: BaseRetriever, collection_name: str, is_topic: bool,
+                 max_iterations: int = 3) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming variant of `run`.
+
+    Every iteration yields a ("retrieval", ...) event with its question and new documents,
+    followed by the ("token", ...) events of that iteration's answer; a client keeps
+    the answer of the last iteration. Ends with ("done", ...) carrying the timings.
+    """
+    timer = StageTimer("iterative")
+    topic = getattr(retriever, "topic", None) if is_topic else None
+
+    current_question = question
+    context = _Context(_context_budget())
+    iterations = 0
+    for iteration in range(max_iterations):
+        stage = time.time()
+        docs = context.add(await retriever.ainvoke(current_question))
+        timer.add("retrieval", stage)
+        if not docs and iteration > 0:
+            break
+        yield "retrieval", {"topic": topic, "iteration": iteration + 1, "question": current_question, "documents": docs}
+
+        stage = time.time()
+        followup_question = None
+        async for kind, value in astream_answer_with_followup(question, context.documents, context.max_tokens):
+            if kind == "token":
+                timer.first("first_token")
+                yield "token", {"token": value}
+            else:
+                followup_question = value
+        timer.add("generation", stage)
+        iterations = iteration + 1
+        if not followup_question:
+            break
+        current_question = followup_question
+
+    yield "done", {"topic": topic, "iterations": iterations, "timings": timer.total()}
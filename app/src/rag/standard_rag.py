@@ -1,11 +1,14 @@
 from app.src.qdrant import StandardRetriever
-from app.src.process import generate_answer, get_model, detect_topic
-from app.src.qdrant import get_available_topics
-from qdrant_client import QdrantClient
-from typing import Optional
+from app.src.process import agenerate_answer, get_embedding_service, detect_topic, answer_cache, model_key, session_memory, rerank_settings
+from app.src.qdrant import get_available_topics, collection_search_params
+from app.src.utils import StageTimer, run_in_thread
+from app.src.rag.streaming import cached_answer, stream_answer
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from typing import AsyncIterator, Optional, Tuple
 import time
 
-def run(question: str, client: QdrantClient, collection_name: str, is_topic: bool, is_memory: bool, model_name: Optional[str] = None):
+async def run(question: str, client: QdrantClient, collection_name: str, is_topic: bool, is_memory: bool, model_name: Optional[str] = None,
+              async_client: Optional[AsyncQdrantClient] = None, session_id: Optional[str] = None):
     """
     Run the chat function with the provided parameters.
 
@@ -14,31 +17,78 @@ def run(question: str, client: QdrantClient, collection_name: str, is_topic: boo
         client (QdrantClient): Qdrant vector database client.
         collection_name (str): Name of the collection to search.
         is_topic (bool): Whether to detect topic from the question.
+        async_client (Optional[AsyncQdrantClient]): Async client used for the vector search.
+        session_id (Optional[str]): Conversation whose history is used when `is_memory` is set.
 
     Returns:
-        dict: Contains the answer, detected topic, and elapsed time.
+        dict: Contains the answer, detected topic, elapsed time and per-stage timings.
     """
-    start = time.time()
+    timer = StageTimer("standard")
     if is_topic:
         # Detect topic based on the question and available topics in the collection
-        topic = detect_topic(question, get_available_topics(client, collection_name))
+        topic = await run_in_thread(_detect_topic, question, client, collection_name)
+        timer.add("topic", timer.start)
     else:
         topic = None
+    # Single-turn answers are served from the semantic cache when a similar question was answered
+    if not is_memory:
+        stage = time.time()
+        cached, version = await run_in_thread(cached_answer, client, collection_name, topic, "standard", model_name, question)
+        timer.add("cache", stage)
+        if cached is not None:
+            timings = timer.total()
+            return {"answer:": cached, "topic": topic, "time": timings["total"], "is_memory": is_memory, "cached": True, "timings": timings}
+    retriever = await run_in_thread(build_retriever, client, collection_name, topic, async_client)
+    chat_history = await run_in_thread(session_memory.history, session_id) if is_memory else ""
+    # Generate answer using retriever and question (timed as "retrieval" and "generation")
+    result = await agenerate_answer(retriever, question, is_memory, model_name=model_name, chat_history=chat_history)
+    if is_memory:
+        # Summarizing older turns is scheduled by the API after the response is sent
+        await run_in_thread(session_memory.add_turn, session_id, question, result)
+    else:
+        await run_in_thread(answer_cache.put, collection_name, topic, "standard", model_key(model_name), question, result, version)
+    timings = timer.total()
+    # Return answer, topic, elapsed time and the per-stage breakdown
+    return {"answer:": result, "topic": topic, "time": timings["total"], "is_memory": is_memory, "session_id": session_id, "cached": False, "timings": timings}
+
+async def stream(question: str, client: QdrantClient, collection_name: str, is_topic: bool, is_memory: bool, model_name: Optional[str] = None,
+                 async_client: Optional[AsyncQdrantClient] = None, session_id: Optional[str] = None) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming variant of `run`.
+
+    Yields:
+        Tuple[str, dict]: ("retrieval", topic and documents), then ("token", answer token)
+        events, then ("done", topic and per-stage timings).
+    """
+    timer = StageTimer("standard")
+    topic = None
+    if is_topic:
+        topic = await run_in_thread(_detect_topic, question, client, collection_name)
+        timer.add("topic", timer.start)
+    retriever = await run_in_thread(build_retriever, client, collection_name, topic, async_client)
+    async for event in stream_answer(question, retriever, collection_name, "standard", topic, is_memory, model_name, timer, client, session_id):
+        yield event
+
+def build_retriever(client: QdrantClient, collection_name: str, topic: Optional[str],
+                    async_client: Optional[AsyncQdrantClient] = None) -> StandardRetriever:
     # Initialize retriever with embedding function and topic (if any)
-    retriever = StandardRetriever(
+    return StandardRetriever(
         client=client,
+        async_client=async_client,
         collection_name=collection_name,
-        embed_fn=get_model().encode,
+        embed_fn=get_embedding_service().encode,
+        aembed_fn=get_embedding_service().aencode,
         topic=topic,
-        top_k=5
+        top_k=5,
+        search_params=collection_search_params(client, collection_name),
+        **rerank_settings()
     )
-    # Generate answer using retriever and question
-    result = generate_answer(retriever, question, is_memory, model_name=model_name)
-    end = time.time()
-    # Return answer, topic, and elapsed time
-    return {"answer:": result, "topic": topic, "time": round(end - start, 3), "is_memory": is_memory}
 
-def run_retriever(question: str, client: QdrantClient, collection_name: str, is_topic: bool):
+def _detect_topic(question: str, client: QdrantClient, collection_name: str):
+    return detect_topic(question, get_available_topics(client, collection_name), collection_name=collection_name, client=client)
+
+def run_retriever(question: str, client: QdrantClient, collection_name: str, is_topic: bool,
+                  async_client: Optional[AsyncQdrantClient] = None):
     """
     Run the retriever with the provided parameters.
 
@@ -47,15 +97,20 @@ def run_retriever(question: str, client: QdrantClient, collection_name: str, is_
         client (QdrantClient): Qdrant vector database client.
         collection_name (str): Name of the collection to search.
         is_topic (bool): Whether to detect topic from the question.
+        async_client (Optional[AsyncQdrantClient]): Async client used for the vector search.
 
     Returns:
         List[Document]: Retrieved documents based on the question.
     """
     retriever = StandardRetriever(
         client=client,
+        async_client=async_client,
         collection_name=collection_name,
-        embed_fn=get_model().encode,
-        topic=detect_topic(question, get_available_topics(client, collection_name)) if is_topic else None,
-        top_k=5
+        embed_fn=get_embedding_service().encode,
+        aembed_fn=get_embedding_service().aencode,
+        topic=_detect_topic(question, client, collection_name) if is_topic else None,
+        top_k=5,
+        search_params=collection_search_params(client, collection_name),
+        **rerank_settings()
     )
-    return retriever
\ No newline at end of file
+    return retriever
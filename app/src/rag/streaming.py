@@ -0,0 +1,60 @@
+from app.src.process import astream_answer, answer_cache, model_key, session_memory
+from app.src.qdrant import collection_version
+from app.src.utils import StageTimer, run_in_thread
+from langchain.schema import Document
+from langchain_core.retrievers import BaseRetriever
+from qdrant_client import QdrantClient
+from typing import AsyncIterator, List, Optional, Tuple
+import time
+
+def cached_answer(client: QdrantClient, collection_name: str, topic: Optional[str], mode: str,
+                  model_name: Optional[str], question: str) -> Tuple[Optional[str], int]:
+    """
+    Look up the answer cache for the current version of the collection.
+
+    Returns:
+        Tuple[Optional[str], int]: The cached answer or None, and the version to store a new answer under.
+    """
+    if not answer_cache.enabled:
+        return None, 0
+    version = collection_version(client, collection_name)
+    return answer_cache.get(collection_name, topic, mode, model_key(model_name), question, version), version
+
+async def stream_answer(question: str, retriever: BaseRetriever, collection_name: str, mode: str, topic: Optional[str],
+                        is_memory: bool, model_name: Optional[str], timer: StageTimer, client: QdrantClient,
+                        session_id: Optional[str] = None) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Retrieve documents, yield them as a "retrieval" event, then yield the answer
+    tokens as "token" events and finish with a "done" event carrying the timings.
+    A cached answer (single-turn chats only) is sent as one token without retrieval.
+    """
+    use_cache = not is_memory
+    if use_cache:
+        stage = time.time()
+        cached, version = await run_in_thread(cached_answer, client, collection_name, topic, mode, model_name, question)
+        timer.add("cache", stage)
+        if cached is not None:
+            yield "retrieval", {"topic": topic, "documents": [], "cached": True}
+            timer.first("first_token")
+            yield "token", {"token": cached}
+            yield "done", {"topic": topic, "is_memory": is_memory, "cached": True, "timings": timer.total()}
+            return
+    chat_history = await run_in_thread(session_memory.history, session_id) if is_memory else ""
+
+    stage = time.time()
+    docs: List[Document] = await retriever.ainvoke(question)
+    timer.add("retrieval", stage)
+    yield "retrieval", {"topic": topic, "documents": docs}
+
+    stage = time.time()
+    answer = ""
+    async for token in astream_answer(question, docs, is_memory, model_name=model_name, chat_history=chat_history):
+        timer.first("first_token")
+        answer += token
+        yield "token", {"token": token}
+    timer.add("generation", stage)
+    if use_cache:
+        await run_in_thread(answer_cache.put, collection_name, topic, mode, model_key(model_name), question, answer, version)
+    if is_memory:
+        await run_in_thread(session_memory.add_turn, session_id, question, answer)
+    yield "done", {"topic": topic, "is_memory": is_memory, "session_id": session_id, "cached": False, "timings": timer.total()}
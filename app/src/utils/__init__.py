@@ -1,2 +1,7 @@
 from .pdf_extraction import *
-from .env import getEnvVariable, setEnvronVariable
\ No newline at end of file
+from .env import getEnvVariable, setEnvronVariable
+from .executors import run_in_thread, run_in_process, shutdown_executors
+from .tokens import Tokenizer, count_tokens, get_tokenizer
+from .metrics import metrics, MetricsRegistry, StageTimer, current_timer, span
+from .profiler import SamplingProfiler, profiler
+from .single_flight import SingleFlight
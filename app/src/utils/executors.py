@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .env import getEnvVariable
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """
+    Bounded thread pool for blocking I/O and GIL-releasing work (embedding, Qdrant sync calls).
+    """
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=int(getEnvVariable("WORKER_THREADS", "16")),
+            thread_name_prefix="rag-worker",
+        )
+    return _thread_pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Bounded process pool for CPU-bound pure-Python work (PDF extraction).
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=int(getEnvVariable("WORKER_PROCESSES", str(os.cpu_count() or 1))),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+async def run_in_thread(func: Callable, *args, **kwargs):
+    """
+    Run a blocking function in the bounded thread pool without blocking the event loop.
+    Context variables (e.g. the request's stage timer) are visible in the thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(context.run, func, *args, **kwargs))
+
+
+async def run_in_process(func: Callable, *args, **kwargs):
+    """
+    Run a picklable CPU-bound function in the bounded process pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """
+    Shut down the pools (called on application shutdown).
+    """
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
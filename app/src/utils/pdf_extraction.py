@@ -1,26 +1,81 @@
 import pdfplumber
 import pytesseract
 from pdf2image import convert_from_path
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+from typing import Iterator, List, Optional, Tuple
+from .env import getEnvVariable
 
-def extract_pdf_text(pdf_path):
-    with pdfplumber.open(pdf_path) as pdf:
-        text = ""
-        for page in pdf.pages:
-            # Extract text from page
-            text += page.extract_text() or ""
-            # Extract tables
-            tables = page.extract_tables()
-            for table in tables:
-                for row in table:
-                    # Convert None to empty string in each cell
-                    cleaned_row = [str(cell) if cell is not None else "" for cell in row]
-                    text += "\t".join(cleaned_row) + "\n"
+def _extract_page_text(page) -> str:
+    # Extract text from page
+    text = page.extract_text() or ""
+    # Extract tables
+    tables = page.extract_tables()
+    for table in tables:
+        for row in table:
+            # Convert None to empty string in each cell
+            cleaned_row = [str(cell) if cell is not None else "" for cell in row]
+            text += "\t".join(cleaned_row) + "\n"
     return text
 
+def _needs_ocr(page, text: str) -> bool:
+    # Image-only page: no text layer but at least one embedded image (scan)
+    return not text.strip() and bool(page.images)
+
+def count_pdf_pages(pdf_path) -> int:
+    # Read /Count of the page tree from the document catalog instead of building every page
+    try:
+        with open(pdf_path, "rb") as f:
+            document = PDFDocument(PDFParser(f))
+            return int(resolve1(resolve1(document.catalog["Pages"])["Count"]))
+    except Exception:
+        # Damaged or unusual page tree: let pdfplumber walk it
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+
+def _iter_page_texts(pdf_path, start: int, end: Optional[int]) -> Iterator[Tuple[int, str, bool]]:
+    # Only the pages of the window are built (pdfplumber numbers pages from 1)
+    pages = range(start + 1, end + 1) if end is not None else None
+    with pdfplumber.open(pdf_path, pages=pages) as pdf:
+        for page in pdf.pages[start:end] if pages is None else pdf.pages:
+            text = _extract_page_text(page)
+            yield page.page_number, text, _needs_ocr(page, text)
+            # Release the page caches so memory does not grow with the document
+            page.close()
+
+def extract_pdf_pages(pdf_path, start: int, end: int) -> List[Tuple[int, str, bool]]:
+    """
+    Extract the text layer of pages [start, end) (picklable entry point for worker processes).
+
+    Returns:
+        List[Tuple[int, str, bool]]: (1-based page number, text, whether the page needs OCR).
+    """
+    return list(_iter_page_texts(pdf_path, start, end))
+
+def ocr_pdf_page(pdf_path, page_number: int, dpi: Optional[int] = None, lang: Optional[str] = None) -> str:
+    """
+    OCR a single page (1-based) with Tesseract at the given DPI.
+    """
+    dpi = dpi or int(getEnvVariable("OCR_DPI", "300"))
+    lang = lang or getEnvVariable("OCR_LANG")
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    return "".join(pytesseract.image_to_string(image, lang=lang) if lang else pytesseract.image_to_string(image) for image in images)
+
+def iter_pdf_pages(pdf_path, ocr: bool = True) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page number, text) for each page, OCR-ing image-only pages when enabled.
+    """
+    for number, text, needs_ocr in _iter_page_texts(pdf_path, 0, None):
+        yield number, ocr_pdf_page(pdf_path, number) if needs_ocr and ocr else text
+
+def extract_pdf_text(pdf_path):
+    return "".join(text for _, text in iter_pdf_pages(pdf_path))
+
 
 def extract_text_from_scanned_pdf(pdf_path):
     images = convert_from_path(pdf_path)
     text = ""
     for image in images:
         text += pytesseract.image_to_string(image)
-    return text
\ No newline at end of file
+    return text
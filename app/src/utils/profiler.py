@@ -0,0 +1,108 @@
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler that can be switched on and off in a running process.
+
+    While running, a background thread records the Python stack of every
+    other thread each `interval` seconds. Stacks are aggregated in the
+    "collapsed" format (`thread;outer;...;inner count`) read by flamegraph.pl
+    and speedscope. Nothing is sampled, and nothing costs, while it is off.
+    """
+
+    def __init__(self, max_stacks: int = 20000):
+        self.max_stacks = max_stacks
+        self.interval = 0.01
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01) -> bool:
+        """
+        Start sampling with fresh counts; False if already running.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.interval = max(interval, 0.001)
+            self.samples = 0
+            self.started_at = time.time()
+            self._stacks = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> str:
+        """
+        Stop sampling and return the collapsed stacks.
+        """
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+    def stats(self, top: int = 20) -> dict:
+        """
+        Status and the functions most often on top of a stack (where the time goes).
+        """
+        leaves: Counter = Counter()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            samples = self.samples
+        return {
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 3),
+            "seconds": round(time.time() - self.started_at, 3) if self.started_at else 0.0,
+            "samples": samples,
+            "top": [{"frame": frame, "samples": count} for frame, count in leaves.most_common(top)],
+        }
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            with self._lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = self._collapse(names.get(ident, str(ident)), frame)
+                    # Bound memory on long runs: new distinct stacks are dropped, known ones still count
+                    if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[stack] += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            # Function-level frames (no line numbers) keep the number of distinct stacks small
+            parts.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ";".join(reversed(parts))
+
+
+profiler = SamplingProfiler()
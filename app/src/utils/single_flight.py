@@ -0,0 +1,109 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .metrics import metrics
+
+single_flight_calls = metrics.counter(
+    "single_flight_calls_total", "Calls that started a computation (leader) or joined an identical one in flight (coalesced)",
+    ["flight", "result"])
+
+
+class _Broadcast:
+    """
+    Events of one in-flight stream, replayed to every subscriber.
+    """
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls in this process: while a computation
+    for a key is running, further calls with the same key wait for it and get
+    its result (or its exception) instead of starting their own. Nothing is
+    kept once it finishes, which is what distinguishes it from a cache: it
+    protects the moment a cold entry is first requested by many clients.
+
+    The computation runs as its own task, so a caller that goes away does not
+    cancel it for the others. A stream is cancelled once its last subscriber
+    has gone.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Return the result of `compute()` for the key and whether it was shared with a call already in flight.
+        """
+        task = self._calls.get(key)
+        coalesced = task is not None
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget_call(key, done))
+        single_flight_calls.inc(flight=self.name, result="coalesced" if coalesced else "leader")
+        return await asyncio.shield(task), coalesced
+
+    def _forget_call(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here when every caller has gone
+
+    async def stream(self, key: Hashable, events: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Iterate the events of `events()` for the key; a subscriber joining a stream
+        in flight first receives the events already produced.
+        """
+        flight = self._streams.get(key)
+        single_flight_calls.inc(flight=self.name, result="leader" if flight is None else "coalesced")
+        if flight is None:
+            flight = self._streams[key] = _Broadcast()
+            flight.task = asyncio.ensure_future(self._pump(key, flight, events()))
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                changed = flight.changed
+                if position < len(flight.events):
+                    position += 1
+                    yield flight.events[position - 1]
+                    continue
+                if flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.finished:
+                flight.task.cancel()
+
+    async def _pump(self, key: Hashable, flight: _Broadcast, events: AsyncIterator[Any]):
+        try:
+            async for event in events:
+                flight.events.append(event)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.finished = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            flight.notify()
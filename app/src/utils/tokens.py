@@ -0,0 +1,85 @@
+import threading
+from typing import Dict, List, Optional
+
+
+class Tokenizer:
+    """
+    Counts and truncates text in the tokens of one model.
+
+    `model` is an OpenAI model name (tiktoken's encoding of that model) or
+    "hf:<repo id>" for a Hugging Face tokenizer (e.g. the one of an Ollama
+    model). Anything else, or a tokenizer that cannot be loaded (tiktoken
+    downloads its encodings on first use), falls back to cl100k_base and then
+    to ~4 characters per token.
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self._encoding = _load_encoding(model)
+
+    def encode(self, text: str) -> Optional[List[int]]:
+        if self._encoding is None:
+            return None
+        if hasattr(self._encoding, "encode_ordinary"):
+            return self._encoding.encode_ordinary(text)
+        return self._encoding.encode(text, add_special_tokens=False)
+
+    def count(self, text: str) -> int:
+        tokens = self.encode(text)
+        return len(text) // 4 + 1 if tokens is None else len(tokens)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        The longest prefix of the text within `max_tokens`.
+        """
+        if max_tokens <= 0:
+            return ""
+        tokens = self.encode(text)
+        if tokens is None:
+            return text[:(max_tokens - 1) * 4]
+        if len(tokens) <= max_tokens:
+            return text
+        return self._encoding.decode(tokens[:max_tokens])
+
+
+def _load_encoding(model: Optional[str]):
+    if model and model.startswith("hf:"):
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(model[3:])
+        except Exception:
+            pass
+    try:
+        import tiktoken
+        if model and not model.startswith("hf:"):
+            try:
+                return tiktoken.encoding_for_model(model)
+            except Exception:
+                pass
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_tokenizers: Dict[Optional[str], Tokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_tokenizer(model: Optional[str] = None) -> Tokenizer:
+    """
+    Return the shared tokenizer of `model` (loaded once, failures included).
+    """
+    tokenizer = _tokenizers.get(model)
+    if tokenizer is None:
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.get(model)
+            if tokenizer is None:
+                tokenizer = _tokenizers[model] = Tokenizer(model)
+    return tokenizer
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Approximate number of LLM tokens in a text (cl100k_base unless `model` is given; ~4 characters per token without tiktoken).
+    """
+    return get_tokenizer(model).count(text)
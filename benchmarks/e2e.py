@@ -0,0 +1,332 @@
+"""
+Offline end-to-end benchmark of the FastAPI app.
+
+The app is served in-process by uvicorn on a local port (its real lifespan,
+routes and pipelines) against an embedded Qdrant (":memory:" or a local
+path) and a deterministic fake chat model with configurable latency, so runs
+need no network or API key and are comparable from one commit to the next.
+
+    python -m benchmarks.e2e [--sizes 1000 10000 100000] [--concurrency 1 8 32] [--output results.json]
+
+For every corpus size a collection of synthetic chunks is populated, then
+each pipeline (standard, hybrid, iterative) is called with streamed /chat
+requests at each concurrency level. The report has p50/p95/p99 latency,
+time to first token and throughput per level, plus the per-stage timings
+the app reports in the "done" event. /upload is measured with synthetic PDFs,
+and with `--batch` the same questions are also sent in one /chat/batch request.
+
+`--fake-embeddings` replaces the embedding model with a hash-based encoder
+(and the reranker of `--rerank` with a word-overlap scorer), which isolates
+the rest of the pipeline and makes corpora of 1M chunks quick to populate. Embedded Qdrant searches by brute force; run with
+`--server` to use the Qdrant configured by QDRANT_HOST/QDRANT_PORT instead
+(populated collections are reused across runs).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+PIPELINES = ("standard", "hybrid", "iterative")
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "mean": round(float(np.mean(values)), 4)}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _chat(http, question: str, collection_name: str, pipeline: str) -> dict:
+    """
+    One streamed chat: client-side latency and time to first token, and the
+    stage timings of the "done" event.
+    """
+    form = {"question": question, "collection_name": collection_name, "stream": "true",
+            "type": pipeline, "type_iterative": "hybrid"}
+    started = time.perf_counter()
+    first_token = None
+    result = {"ok": False, "timings": {}}
+    async with http.stream("POST", "/chat", data=form) as response:
+        if response.status_code != 200:
+            await response.aread()
+            result["error"] = f"HTTP {response.status_code}"
+            return result
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event == "done":
+                    result.update(ok=True, timings=json.loads(line[len("data: "):])["timings"])
+                elif event == "error":
+                    result["error"] = json.loads(line[len("data: "):])["message"]
+    result["latency"] = time.perf_counter() - started
+    result["first_token"] = first_token
+    return result
+
+
+async def run_level(http, questions: List[str], collection_name: str, pipeline: str, concurrency: int) -> dict:
+    """
+    Send all questions with `concurrency` requests in flight.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for question in questions:
+        queue.put_nowait(question)
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            question = queue.get_nowait()
+            try:
+                results.append(await _chat(http, question, collection_name, pipeline))
+            except Exception as e:
+                results.append({"ok": False, "error": str(e), "timings": {}})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [result for result in results if result["ok"]]
+    stages = sorted({stage for result in ok for stage in result["timings"]})
+    errors = [result.get("error", "no done event") for result in results if not result["ok"]]
+    return {
+        "pipeline": pipeline,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3),
+        "latency": percentiles([result["latency"] for result in ok]),
+        "first_token": percentiles([result["first_token"] for result in ok if result["first_token"] is not None]),
+        # Seconds the app spent in each stage, as reported in the "done" event
+        "stages": {stage: percentiles([result["timings"][stage] for result in ok if stage in result["timings"]])
+                   for stage in stages},
+    }
+
+
+async def run_batch(http, questions: List[str], collection_name: str, pipeline: str, concurrency: int) -> dict:
+    """
+    All questions in one /chat/batch request: throughput and the completion time of each answer.
+    """
+    form = {"questions": questions, "collection_name": collection_name, "type": pipeline,
+            "type_iterative": "hybrid", "concurrency": str(concurrency)}
+    started = time.perf_counter()
+    completions, errors, timings = [], [], {}
+    async with http.stream("POST", "/chat/batch", data=form) as response:
+        if response.status_code != 200:
+            await response.aread()
+            errors.append(f"HTTP {response.status_code}")
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "result":
+                    completions.append(time.perf_counter() - started)
+                elif event == "error":
+                    errors.append(data["message"])
+                elif event == "done":
+                    timings = data["timings"]
+    elapsed = time.perf_counter() - started
+    return {
+        "pipeline": pipeline,
+        "concurrency": concurrency,
+        "questions": len(questions),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "seconds": round(elapsed, 3),
+        "throughput_qps": round(len(completions) / elapsed, 3),
+        "completion": percentiles(completions),
+        "stages": timings,
+    }
+
+
+async def run_uploads(http, collection_name: str, documents: int, pages: int, concurrency: int) -> dict:
+    from benchmarks.synthetic import TOPICS, synthetic_pdf
+
+    topics = list(TOPICS)
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(documents):
+        # Distinct seeds per concurrency level, so no chunk is deduplicated against an earlier upload
+        queue.put_nowait((i, synthetic_pdf(pages, topics[i % len(topics)], seed=concurrency * 100_000 + i)))
+    latencies, chunks, errors = [], 0, []
+
+    async def worker():
+        nonlocal chunks
+        while not queue.empty():
+            i, pdf = queue.get_nowait()
+            started = time.perf_counter()
+            response = await http.post("/upload", data={"topic": topics[i % len(topics)], "collection_name": collection_name},
+                                       files={"file": (f"synthetic_{i}.pdf", pdf, "application/pdf")})
+            if response.status_code != 200:
+                errors.append(f"HTTP {response.status_code}: {response.text[:200]}")
+                continue
+            latencies.append(time.perf_counter() - started)
+            chunks += response.json()["data"]["chunks_stored"]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "documents": documents,
+        "pages_per_document": pages,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(len(latencies) / elapsed, 3),
+        "chunks_per_second": round(chunks / elapsed, 3),
+        "latency": percentiles(latencies),
+    }
+
+
+async def _serve(app, port: int):
+    """
+    Start the app on a local uvicorn server (its lifespan included) and return
+    the server and its task. A real HTTP server is used because an ASGI test
+    transport buffers the response and would hide the streaming behaviour.
+    """
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False, lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()  # Raise the startup error
+            raise RuntimeError("server exited during startup")
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from app.main import app
+    from app.src.process import get_embedding_service, get_reranker, llm_registry
+    from app.src.utils import run_in_thread
+    from benchmarks.fakes import FakeChatModel, FakeCrossEncoder, FakeEncoder
+    from benchmarks.synthetic import populate, synthetic_questions
+
+    llm_registry.use_factory(lambda model_name: FakeChatModel(
+        first_token_latency=args.llm_first_token_ms / 1000, token_latency=args.llm_token_ms / 1000,
+        answer_tokens=args.llm_tokens))
+    if args.fake_embeddings:
+        get_embedding_service().use_model(FakeEncoder())
+        if args.rerank:
+            get_reranker().use_model(FakeCrossEncoder())
+
+    report = {"chat": [], "batch": [], "upload": [], "populate": {}}
+    server, task = await _serve(app, args.port)
+    # No client-side cap below the highest concurrency level
+    limits = httpx.Limits(max_connections=max(args.concurrency + args.upload_concurrency) * 2)
+    try:
+        # Populate through the app's own client: embedded storage can only be opened once
+        client = app.state.qdrant_client
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=None, limits=limits) as http:
+            for size in args.sizes:
+                collection_name = f"{args.prefix}_{size}"
+                print(f"Populating {collection_name} with {size} chunks")
+                seconds = await run_in_thread(populate, client, collection_name, size)
+                report["populate"][str(size)] = {"seconds": round(seconds, 3),
+                                                 "chunks_per_second": round(size / seconds, 3) if seconds else None}
+                for pipeline in args.pipelines:
+                    for concurrency in args.concurrency:
+                        seed = size * 1000 + PIPELINES.index(pipeline) * 100 + concurrency
+                        questions = synthetic_questions(max(args.requests, 2 * concurrency), seed=seed)
+                        result = await run_level(http, questions, collection_name, pipeline, concurrency)
+                        result["corpus_size"] = size
+                        report["chat"].append(result)
+                        print(f"size={size} {pipeline:>9} c={concurrency:<3} {result['throughput_rps']:>8.2f} req/s "
+                              f"p50={result['latency']['p50']}s p95={result['latency']['p95']}s "
+                              f"p99={result['latency']['p99']}s ttft p50={result['first_token']['p50']}s "
+                              f"errors={result['errors']}")
+                        if args.batch:
+                            result = await run_batch(http, questions, collection_name, pipeline, concurrency)
+                            result["corpus_size"] = size
+                            report["batch"].append(result)
+                            print(f"size={size} {pipeline:>9} batch={len(questions)} c={concurrency:<3} "
+                                  f"{result['throughput_qps']:>8.2f} q/s last={result['completion']['p99']}s "
+                                  f"errors={result['errors']}")
+            for concurrency in args.upload_concurrency if args.uploads else []:
+                result = await run_uploads(http, f"{args.prefix}_upload", args.uploads, args.upload_pages, concurrency)
+                report["upload"].append(result)
+                print(f"upload c={concurrency:<3} {result['documents_per_second']:.2f} docs/s "
+                      f"{result['chunks_per_second']:.1f} chunks/s p50={result['latency']['p50']}s errors={result['errors']}")
+    finally:
+        server.should_exit = True
+        await task
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Corpus sizes in chunks")
+    parser.add_argument("--pipelines", nargs="+", default=list(PIPELINES), choices=PIPELINES)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Chat requests in flight")
+    parser.add_argument("--requests", type=int, default=64, help="Chat requests per level (at least 2x concurrency)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Also send each level's questions as one /chat/batch request (concurrency = LLM calls in flight)")
+    parser.add_argument("--uploads", type=int, default=8, help="Synthetic PDFs uploaded per level (0: skip)")
+    parser.add_argument("--upload-pages", type=int, default=20)
+    parser.add_argument("--upload-concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0, help="Fake chat model latency to the first token")
+    parser.add_argument("--llm-token-ms", type=float, default=10.0, help="Fake chat model latency per further token")
+    parser.add_argument("--llm-tokens", type=int, default=50, help="Fake chat model answer length")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Hash-based encoder instead of the embedding model")
+    parser.add_argument("--rerank", action="store_true", help="Enable the cross-encoder rerank stage (RERANK_ENABLED)")
+    parser.add_argument("--location", default=":memory:", help="Embedded Qdrant: \":memory:\" or a directory")
+    parser.add_argument("--server", action="store_true", help="Use the Qdrant server of QDRANT_HOST/QDRANT_PORT")
+    parser.add_argument("--port", type=int, default=8765, help="Local port the app is served on")
+    parser.add_argument("--prefix", default="benchmark", help="Prefix of the benchmark collections")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    # Read by the app at import time: caches would answer repeated work instead of the pipeline
+    os.environ["QDRANT_LOCATION"] = "" if args.server else args.location
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+    os.environ["CHAT_COALESCING_ENABLED"] = "false"
+    os.environ["RERANK_ENABLED"] = "true" if args.rerank else "false"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+    started = time.time()
+    report = asyncio.run(run(args))
+    report["meta"] = {
+        "commit": _git_commit(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "seconds": round(time.time() - started, 3),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "qdrant": "server" if args.server else args.location,
+        "embedding_model": "fake" if args.fake_embeddings else os.environ.get("EMBEDDING_MODEL_NAME", "default"),
+        "embedding_backend": os.environ.get("EMBEDDING_BACKEND", "torch"),
+        "rerank_model": ("fake" if args.fake_embeddings else os.environ.get("RERANK_MODEL", "default")) if args.rerank else None,
+        "args": vars(args),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare embedding backends against the full-precision PyTorch reference.
+
+For each backend it reports ingestion throughput (passages/s, batched),
+single-query latency, the cosine similarity of its embeddings to the
+reference embeddings, and recall@k of the reference top-k neighbours of
+each query, which is what matters for retrieval.
+
+    python -m benchmarks.embedding_backends [--texts corpus.txt] [--backends torch onnx int8]
+
+`--texts` takes one passage per line; without it a synthetic corpus is used.
+"""
+import argparse
+import random
+import time
+from typing import List
+
+import numpy as np
+
+from app.src.process.embedding_backends import EMBEDDING_BACKENDS, load_embedding_model
+from app.src.process.embedding_service import DEFAULT_MODEL_NAME
+
+WORDS = (
+    "contract payment invoice delivery warranty customer refund policy employee salary leave "
+    "server database backup network security password access report budget quarter revenue "
+    "hợp đồng thanh toán hóa đơn giao hàng bảo hành khách hàng nhân viên lương báo cáo doanh thu"
+).split()
+
+
+def _synthetic_corpus(size: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))) + "." for _ in range(size)]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _recall_at_k(reference_docs, reference_queries, docs, queries, k: int) -> float:
+    expected = np.argsort(-(reference_queries @ reference_docs.T), axis=1)[:, :k]
+    got = np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+    return float(np.mean([len(set(e) & set(g)) / k for e, g in zip(expected, got)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--texts", help="File with one passage per line")
+    parser.add_argument("--size", type=int, default=1000, help="Passages of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = _synthetic_corpus(args.size)
+    passages = ["passage: " + text for text in corpus]
+    # Questions are embedded with the same prefix as the retrievers use
+    queries = ["passage: " + " ".join(text.split()[:8]) for text in random.Random(1).sample(corpus, min(args.queries, len(corpus)))]
+
+    reference = load_embedding_model(args.model, "torch")
+    reference_docs = _normalize(reference.encode(passages, batch_size=args.batch_size))
+    reference_queries = _normalize(reference.encode(queries, batch_size=args.batch_size))
+
+    print(f"{len(passages)} passages, {len(queries)} queries, model {args.model}")
+    print(f"{'backend':>8} {'load s':>8} {'passages/s':>11} {'query ms':>9} {'cos mean':>9} {'cos min':>8} {'recall@' + str(args.k):>10}")
+    for backend in args.backends:
+        start = time.perf_counter()
+        model = reference if backend == "torch" else load_embedding_model(args.model, backend)
+        load_time = time.perf_counter() - start
+
+        model.encode(passages[:args.batch_size], batch_size=args.batch_size)  # Warm-up
+        start = time.perf_counter()
+        docs = _normalize(model.encode(passages, batch_size=args.batch_size))
+        throughput = len(passages) / (time.perf_counter() - start)
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            model.encode([query])
+            latencies.append((time.perf_counter() - start) * 1000)
+        query_vectors = _normalize(model.encode(queries, batch_size=args.batch_size))
+
+        cosine = np.sum(docs * reference_docs, axis=1)
+        recall = _recall_at_k(reference_docs, reference_queries, docs, query_vectors, args.k)
+        print(f"{backend:>8} {load_time:>8.1f} {throughput:>11.1f} {np.median(latencies):>9.2f} "
+              f"{cosine.mean():>9.4f} {cosine.min():>8.4f} {recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Deterministic local stand-ins for the chat backends and the embedding model.
+"""
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FOLLOWUP_MARKER = "Follow-up question:"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering with `answer_tokens` words derived from a hash of the
+    prompt (same prompt, same answer) after `first_token_latency` seconds, then
+    one word every `token_latency` seconds. Prompts asking for a follow-up
+    question (iterative RAG) get "Follow-up question: None" appended.
+    """
+    first_token_latency: float = 0.3
+    token_latency: float = 0.01
+    answer_tokens: int = 50
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "\n".join(str(message.content) for message in messages)
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little")
+        rng = np.random.default_rng(seed)
+        tokens = [f"word{int(n)} " for n in rng.integers(0, 5000, self.answer_tokens)]
+        if FOLLOWUP_MARKER in prompt:
+            tokens.append(f"\n{FOLLOWUP_MARKER} None")
+        return tokens
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self.token_latency * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            await asyncio.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeEncoder:
+    """
+    Embedding model stand-in with the `SentenceTransformer.encode` interface:
+    normalized vectors seeded by a hash of each text, plus `seconds_per_text`
+    of simulated compute per text.
+    """
+
+    def __init__(self, dimension: int = 384, seconds_per_text: float = 0.0):
+        self.dimension = dimension
+        self.seconds_per_text = seconds_per_text
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if self.seconds_per_text:
+            time.sleep(self.seconds_per_text * len(texts))
+        vectors = np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dimension), np.float32)
+        return vectors[0] if single else vectors
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+class FakeCrossEncoder:
+    """
+    Cross-encoder stand-in with the `CrossEncoder.predict` interface: the
+    score is the share of query words found in the text (0-1), plus
+    `seconds_per_pair` of simulated compute per pair.
+    """
+
+    def __init__(self, seconds_per_pair: float = 0.0):
+        self.seconds_per_pair = seconds_per_pair
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if self.seconds_per_pair:
+            time.sleep(self.seconds_per_pair * len(pairs))
+        scores = []
+        for query, text in pairs:
+            words = set(query.lower().split())
+            scores.append(len(words & set(text.lower().split())) / max(len(words), 1))
+        return np.asarray(scores, dtype=np.float32)
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of hybrid score fusion.
+
+Compares the previous merge (a dict of every scored document, summed in
+Python and fully sorted) with `fuse` over the top-N candidates of each
+retriever, for corpora of 1k to 1M documents.
+
+    python -m benchmarks.fusion [--top-n 20] [--top-k 5] [--repeat 20]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.src.qdrant.fusion import FUSION_STRATEGIES, fuse, top_k_indices
+
+CORPUS_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def legacy_merge(vector_scores: dict, bm25_scores: dict, alpha: float, top_k: int):
+    combined = []
+    for doc_id in set(vector_scores) | set(bm25_scores):
+        score = alpha * vector_scores.get(doc_id, 0.0) + (1 - alpha) * bm25_scores.get(doc_id, 0.0)
+        combined.append((doc_id, score))
+    return sorted(combined, key=lambda x: x[1], reverse=True)[:top_k]
+
+
+def _time(fn, repeat: int) -> float:
+    # Median wall time in milliseconds
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-n", type=int, default=20, help="Candidates per retriever")
+    parser.add_argument("--top-k", type=int, default=5, help="Results after fusion")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'corpus':>10} {'legacy':>12} {'top-n':>10} " + " ".join(f"{name:>10}" for name in FUSION_STRATEGIES))
+    for size in CORPUS_SIZES:
+        ids = [str(i) for i in range(size)]
+        cosine = rng.uniform(-0.2, 0.9, size)
+        bm25 = rng.exponential(2.0, size)
+
+        vector_map, bm25_map = dict(zip(ids, cosine.tolist())), dict(zip(ids, bm25.tolist()))
+        legacy = _time(lambda: legacy_merge(vector_map, bm25_map, 0.5, args.top_k), max(1, args.repeat // 10))
+
+        # What the retrievers hand over: their own top-N (Qdrant limit, BM25 argpartition)
+        selection = _time(lambda: (top_k_indices(cosine, args.top_n), top_k_indices(bm25, args.top_n)), args.repeat)
+        vector_top, bm25_top = top_k_indices(cosine, args.top_n), top_k_indices(bm25, args.top_n)
+        lists = [
+            ([ids[i] for i in vector_top], cosine[vector_top].tolist()),
+            ([ids[i] for i in bm25_top], bm25[bm25_top].tolist()),
+        ]
+        fused = [_time(lambda: fuse(lists, [0.5, 0.5], args.top_k, strategy=name), args.repeat)
+                 for name in FUSION_STRATEGIES]
+        print(f"{size:>10} {legacy:>10.2f}ms {selection:>8.2f}ms " + " ".join(f"{ms:>8.3f}ms" for ms in fused))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Synthetic PDFs, corpora and questions for the offline benchmarks.
+"""
+import random
+import time
+from typing import Iterator, List, Tuple
+
+from qdrant_client import QdrantClient
+
+from app.src.process import chunk_id, content_hash, get_embedding_service
+from app.src.qdrant import add_text, init_collection
+
+TOPICS = {
+    "finance": "contract payment invoice budget quarter revenue refund tax audit expense",
+    "hr": "employee salary leave policy contract training recruitment benefit review holiday",
+    "it": "server database backup network security password access report incident deployment",
+}
+COMMON_WORDS = "the of and to in for with on by from is are was this that which".split()
+
+
+def synthetic_text(rng: random.Random, topic: str, words: int) -> str:
+    # Topic words with numeric suffixes give the lexical index a realistic number of rare terms
+    vocabulary = TOPICS[topic].split()
+    tokens = []
+    for _ in range(words):
+        if rng.random() < 0.4:
+            tokens.append(rng.choice(vocabulary) + (str(rng.randint(0, 999)) if rng.random() < 0.5 else ""))
+        else:
+            tokens.append(rng.choice(COMMON_WORDS))
+    return " ".join(tokens) + "."
+
+
+def synthetic_chunks(size: int, seed: int = 0) -> Iterator[Tuple[str, str]]:
+    """
+    Yield `size` (chunk text, topic) pairs of roughly CHUNK_SIZE characters.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    for i in range(size):
+        topic = topics[i % len(topics)]
+        yield synthetic_text(rng, topic, rng.randint(60, 80)), topic
+
+
+def synthetic_questions(count: int, seed: int = 1) -> List[str]:
+    """
+    Distinct questions over the synthetic vocabulary (distinct so no cache answers them).
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    return [f"What does the {topics[i % len(topics)]} document say about "
+            f"{synthetic_text(rng, topics[i % len(topics)], 6)[:-1]} (question {i})?"
+            for i in range(count)]
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """
+    Minimal valid PDF with one page of Helvetica text per string.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>"]
+    font = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font} 0 R >> >> >>")
+        text = text.replace("\\", "").replace("(", "").replace(")", "")
+        lines = [text[start:start + 90] for start in range(0, len(text), 90)]
+        body = "BT /F1 9 Tf 20 770 Td 11 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(body)} >>\nstream\n{body}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF"
+    return out.encode("latin-1")
+
+
+def synthetic_pdf(pages: int, topic: str, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    # About 3000 characters per page, i.e. 6 to 7 chunks
+    return make_pdf([synthetic_text(rng, topic, 450) for _ in range(pages)])
+
+
+def populate(client: QdrantClient, collection_name: str, size: int, batch_size: int = 1024, seed: int = 0) -> float:
+    """
+    Fill a collection with `size` synthetic chunks, embedded by the shared
+    embedding service and stored like uploaded chunks (dense + sparse vectors,
+    topic). Skipped when the collection already holds `size` points.
+    Returns the seconds spent.
+    """
+    started = time.perf_counter()
+    init_collection(client, collection_name)
+    if client.count(collection_name, exact=True).count >= size:
+        return 0.0
+    service = get_embedding_service()
+    batch: List[Tuple[str, str]] = []
+
+    def flush():
+        for topic in TOPICS:
+            chunks = [text for text, chunk_topic in batch if chunk_topic == topic]
+            if not chunks:
+                continue
+            vectors = service.encode_batch(["passage: " + chunk for chunk in chunks], batch_size)
+            ids = [chunk_id(content_hash(chunk), collection_name, topic) for chunk in chunks]
+            add_text(client, collection_name, ids, vectors.tolist(), chunks, topic)
+        batch.clear()
+
+    for done, record in enumerate(synthetic_chunks(size, seed), 1):
+        batch.append(record)
+        if len(batch) == batch_size:
+            flush()
+        if done % 100_000 == 0:
+            print(f"{collection_name}: {done}/{size} chunks in {time.perf_counter() - started:.0f}s")
+    flush()
+    return time.perf_counter() - started
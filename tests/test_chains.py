@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.src.process import chains
+
+
+class _FakeChain:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    async def ainvoke(self, chain_input):
+        return "".join(self.tokens)
+
+    async def astream(self, chain_input):
+        for token in self.tokens:
+            yield token
+
+
+def _tokens(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+async def _stream():
+    answer, followup = "", None
+    async for kind, value in chains.astream_answer_with_followup("question?", []):
+        if kind == "token":
+            answer += value
+        else:
+            followup = value
+    return answer, followup
+
+
+TEXTS = [
+    "Leave is 25 days a year.",
+    "Leave is 25 days a year.\nFollow-up question: None",
+    "Leave is 25 days a year.\nFollow-up question: How is leave carried over?",
+    # The model quotes the marker inside the answer before the real one
+    "The template asks for a line starting with \"Follow-up question:\" at the end.\n"
+    "Leave is 25 days a year.\nFollow-up question: How is leave carried over?",
+    "Quoted follow-up question: inside.\nFOLLOW-UP QUESTION: None",
+]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+@pytest.mark.parametrize("text", TEXTS)
+def test_stream_splits_like_split_followup(monkeypatch, text, size):
+    monkeypatch.setattr(chains, "_answer_with_followup_chain", lambda: _FakeChain(_tokens(text, size)))
+
+    answer, followup = asyncio.run(_stream())
+
+    expected_answer, expected_followup = chains._split_followup(text)
+    assert answer.strip() == expected_answer
+    assert followup == expected_followup
+    assert asyncio.run(chains.agenerate_answer_with_followup("question?", [])) == (expected_answer, expected_followup)
+
+
+def test_marker_twice_keeps_first_occurrence_in_answer(monkeypatch):
+    text = "Write \"Follow-up question:\" last.\nFollow-up question: What about sick leave?"
+    monkeypatch.setattr(chains, "_answer_with_followup_chain", lambda: _FakeChain(_tokens(text, 2)))
+
+    answer, followup = asyncio.run(_stream())
+
+    assert answer.strip() == "Write \"Follow-up question:\" last."
+    assert followup == "What about sick leave?"
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.src.process.process_data import CHUNK_OVERLAP, CHUNK_SIZE, IncrementalChunker
+
+
+def _document(rng: random.Random) -> str:
+    # Words, lines and paragraphs of random lengths, with a few words and lines longer than a chunk
+    parts = []
+    for _ in range(rng.randint(1, 1200)):
+        roll = rng.random()
+        if roll < 0.01:
+            parts.append("x" * rng.randint(CHUNK_SIZE - 5, 3 * CHUNK_SIZE))
+        elif roll < 0.1:
+            parts.append(rng.choice(["\n", "\n\n", "\n\n\n", " \n", "\t", "  "]))
+        else:
+            parts.append("".join(rng.choice("abcdefgh") for _ in range(rng.randint(1, 12))))
+        parts.append(" " if rng.random() < 0.8 else "")
+    if rng.random() < 0.3:
+        parts.append("\n\n" if rng.random() < 0.5 else "\n")
+    return "".join(parts)
+
+
+def _pages(text: str, rng: random.Random):
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 12))))
+    bounds = [0] + cuts + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_incremental_chunker_matches_splitter(seed):
+    rng = random.Random(seed)
+    text = _document(rng)
+    if seed % 4 == 0:
+        text = text.replace("\n\n", "\n")  # No paragraph separator: split on lines throughout
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    chunker = IncrementalChunker()
+    records = []
+    for number, page in enumerate(_pages(text, rng), start=1):
+        records.extend(chunker.feed(page, page=number))
+    records.extend(chunker.flush())
+
+    assert [chunk for chunk, _ in records] == splitter.split_text(text)
+    for index, (chunk, metadata) in enumerate(records):
+        assert metadata["chunk_index"] == index
+        assert text[metadata["start"]:metadata["end"]] == chunk
+
+
+def test_incremental_chunker_pages():
+    chunker = IncrementalChunker(chunk_size=20, chunk_overlap=0)
+    records = chunker.feed("first page ", page=1) + chunker.feed("second. third page", page=2) + chunker.flush()
+    assert [chunk for chunk, _ in records] == ["first page second.", "third page"]
+    assert [(metadata["page"], metadata["page_end"]) for _, metadata in records] == [(1, 2), (2, 2)]